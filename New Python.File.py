@@ -1,29 +1,274 @@
+import argparse
+import bisect
+import csv
+import fcntl
+import os
+from contextlib import contextmanager
+
+# Every change is appended to steps_log.txt; steps_snapshot.txt holds the
+# totals up to a point in the log, so a start only replays what came after it.
+LOG_FILE = "steps_log.txt"
+SNAPSHOT_FILE = "steps_snapshot.txt"
+LOCK_FILE = "steps.lock"
+LEGACY_FILE = "leaderboard.txt"
+BONUS_STEPS = 8000
+BONUS_POINTS = 20
+COMPACT_AFTER = 10000  # log lines replayed on load before the log is folded into the snapshot
+
+
 def calculate_points(steps):
     return steps // 100
 
 
-def load_leaderboard():
-    data = {}
-    try:
-        with open("leaderboard.txt", "r") as f:
-            for line in f:
-                name, points = line.strip().split(",")
-                data[name] = int(points)
-    except:
-        pass
-    return data
+def entry_points(steps):
+    """Points for one step entry, including the 8000-step bonus"""
+    points = calculate_points(steps)
+    if steps >= BONUS_STEPS:
+        points += BONUS_POINTS
+    return points
+
+
+@contextmanager
+def store_lock():
+    """Serialize writers (interactive sessions, bulk loads, syncs)"""
+    with open(LOCK_FILE, "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class Ranking:
+    """(-points, name) pairs kept in order, so showing the leaderboard never re-sorts"""
+
+    def __init__(self, users):
+        self.entries = sorted((-user[0], name) for name, user in users.items())
+
+    def update(self, name, old_points, new_points):
+        if old_points is not None:
+            del self.entries[bisect.bisect_left(self.entries, (-old_points, name))]
+        bisect.insort(self.entries, (-new_points, name))
+
+    def rank(self, name, points):
+        return bisect.bisect_left(self.entries, (-points, name)) + 1
+
+    def top(self, limit=None):
+        return [(name, -points) for points, name in self.entries[:limit]]
+
+
+class StepStore:
+    """Per-user [points, steps, steps synced to the web app], from snapshot + log"""
+
+    def __init__(self):
+        self.users = {}
+        self.ranking = Ranking({})
+        self.log_inode = None
+        self.log_offset = 0
+        self.replayed = 0
+
+    def load(self):
+        self.users = {}
+        snapshot_inode, offset = None, 0
+        try:
+            with open(SNAPSHOT_FILE, "r") as f:
+                header = f.readline().strip().split("|")
+                snapshot_inode, offset = int(header[1]), int(header[2])
+                for line in f:
+                    name, points, steps, synced = line.rstrip("\n").split("|")
+                    self.users[name] = [int(points), int(steps), int(synced)]
+        except (OSError, ValueError, IndexError):
+            snapshot_inode, offset = None, 0
+            self.users = {}
+            if not os.path.exists(LOG_FILE):
+                self.import_legacy()
+
+        self.log_inode = self.current_log_inode()
+        if self.log_inode != snapshot_inode:
+            # The log was rotated after this snapshot was written: all of it is new
+            offset = 0
+        self.log_offset = offset
+        self.replayed = 0
+        self.replay()
+        self.ranking = Ranking(self.users)
+
+    def import_legacy(self):
+        """Start from the totals in the old leaderboard.txt, if there is one"""
+        entries, skipped = [], 0
+        try:
+            with open(LEGACY_FILE, "r") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    fields = line.strip().split(",")
+                    try:
+                        if len(fields) != 2 or not valid_username(fields[0]):
+                            raise ValueError(line)
+                        entries.append((fields[0], int(fields[1])))
+                    except ValueError:
+                        skipped += 1
+        except OSError:
+            return
+        if skipped:
+            print(f"Skipped {skipped} malformed lines in {LEGACY_FILE}")
+        with open(LOG_FILE, "a") as f:
+            f.write("".join(f"points|{name}|{points}\n" for name, points in entries))
 
+    def current_log_inode(self):
+        try:
+            return os.stat(LOG_FILE).st_ino
+        except OSError:
+            return None
 
-def save_leaderboard(data):
-    with open("leaderboard.txt", "w") as f:
-        for name in data:
-            f.write(f"{name},{data[name]}\n")
+    def replay(self, ranked=False):
+        """Apply log lines written since log_offset (by this or another process)"""
+        try:
+            f = open(LOG_FILE, "rb")
+        except OSError:
+            return
+        with f:
+            f.seek(self.log_offset)
+            for raw in f:
+                if not raw.endswith(b"\n"):
+                    break  # torn write from a crash; drop_torn_tail() removes it
+                self.apply(raw.decode().rstrip("\n").split("|"), ranked)
+                self.log_offset += len(raw)
+                self.replayed += 1
 
+    def apply(self, fields, ranked):
+        kind, name, value = fields[0], fields[1], int(fields[2])
+        user = self.users.get(name)
+        old_points = user[0] if user else None
+        if user is None:
+            user = self.users[name] = [0, 0, 0]
+        if kind == "steps":
+            user[0] += entry_points(value)
+            user[1] += value
+        elif kind == "points":
+            user[0] += value
+        elif kind == "synced":
+            user[2] += value
+        if ranked and user[0] != old_points:
+            self.ranking.update(name, old_points, user[0])
 
-def show_leaderboard(data):
+    def refresh(self):
+        """Catch up with the log; call with store_lock() held before appending"""
+        if self.current_log_inode() != self.log_inode:
+            self.load()
+        else:
+            self.replay(ranked=True)
+
+    def drop_torn_tail(self):
+        try:
+            size = os.path.getsize(LOG_FILE)
+        except OSError:
+            return
+        if size > self.log_offset:
+            with open(LOG_FILE, "r+b") as f:
+                f.truncate(self.log_offset)
+
+    def append(self, entries):
+        """Log (kind, name, value) entries in one write and apply them"""
+        with store_lock():
+            self.append_locked(entries)
+
+    def append_locked(self, entries):
+        self.refresh()
+        self.drop_torn_tail()
+        lines = "".join(f"{kind}|{name}|{value}\n" for kind, name, value in entries)
+        with open(LOG_FILE, "a") as f:
+            f.write(lines)
+        self.log_inode = self.current_log_inode()
+        self.replay(ranked=True)
+
+    def compact(self):
+        """Fold the log into a new snapshot and start an empty log"""
+        with store_lock():
+            self.refresh()
+            tmp = SNAPSHOT_FILE + ".tmp"
+            with open(tmp, "w") as f:
+                f.write(f"#log|{self.log_inode or 0}|{self.log_offset}\n")
+                for name, (points, steps, synced) in self.users.items():
+                    f.write(f"{name}|{points}|{steps}|{synced}\n")
+            os.replace(tmp, SNAPSHOT_FILE)
+            # A crash here is fine: the snapshot covers the whole old log
+            open(LOG_FILE + ".tmp", "w").close()
+            os.replace(LOG_FILE + ".tmp", LOG_FILE)
+            self.log_inode = self.current_log_inode()
+            self.log_offset = 0
+            self.replayed = 0
+
+    def points(self, name):
+        user = self.users.get(name)
+        return user[0] if user else 0
+
+
+def valid_username(name):
+    return bool(name) and not any(c in name for c in "|,\n")
+
+
+def load_step_rows(path):
+    """(username, steps) rows from a CSV with an optional username,steps header"""
+    rows, errors = [], []
+    with open(path, newline="") as f:
+        for line_no, row in enumerate(csv.reader(f), start=1):
+            if not row or (line_no == 1 and row[0].strip().lower() == "username"):
+                continue
+            try:
+                name, steps = row[0].strip(), int(row[1])
+            except (IndexError, ValueError):
+                errors.append(f"line {line_no}: expected username,steps")
+                continue
+            if not valid_username(name):
+                errors.append(f"line {line_no}: invalid username {name!r}")
+            elif steps < 0:
+                errors.append(f"line {line_no}: steps must not be negative")
+            else:
+                rows.append((name, steps))
+    return rows, errors
+
+
+def bulk_add(store, path):
+    rows, errors = load_step_rows(path)
+    for error in errors:
+        print(error)
+    if rows:
+        store.append([("steps", name, steps) for name, steps in rows])
+    bonuses = sum(1 for _, steps in rows if steps >= BONUS_STEPS)
+    print(f"Added {len(rows)} step logs for {len(set(name for name, _ in rows))} users "
+          f"({bonuses} with the {BONUS_STEPS}-step bonus), {len(errors)} rows skipped")
+
+
+def sync_to_web(store):
+    """Add steps not yet synced to the web app's total_steps, in one user_data write.
+    Steps are logged as synced before they are added, so a crash in between
+    loses that sync rather than adding the steps twice on the next one."""
+    from app import load_users, load_user_data, new_user_record, save_user_data, user_data_lock
+    with store_lock():
+        store.refresh()
+        pending = {name: user[1] - user[2] for name, user in store.users.items() if user[1] > user[2]}
+        registered = load_users()
+        with user_data_lock():
+            user_data = load_user_data()
+            synced = {name: steps for name, steps in pending.items() if name in user_data or name in registered}
+            if synced:
+                store.append_locked([("synced", name, steps) for name, steps in synced.items()])
+                try:
+                    for name, steps in synced.items():
+                        user = user_data.setdefault(name, new_user_record())
+                        user["total_steps"] = user.get("total_steps", 0) + steps
+                    save_user_data(user_data)
+                except Exception:
+                    store.append_locked([("synced", name, -steps) for name, steps in synced.items()])
+                    raise
+    skipped = len(pending) - len(synced)
+    print(f"Synced {sum(synced.values())} steps for {len(synced)} users"
+          + (f", {skipped} users not registered in the web app" if skipped else ""))
+
+
+def show_leaderboard(store):
     print("\n🏆 Leaderboard")
-    sorted_users = sorted(data.items(), key=lambda x: x[1], reverse=True)
-    for i, (name, points) in enumerate(sorted_users, start=1):
+    for i, (name, points) in enumerate(store.ranking.top(), start=1):
         print(f"{i}. {name} - {points} points")
 
 
@@ -34,49 +279,82 @@ def menu():
     print("4. Exit")
 
 
-# ---- Start Program ----
-leaderboard = load_leaderboard()
+def interactive(store):
+    username = input("Enter your username: ").strip()
+    while not valid_username(username):
+        username = input("Usernames cannot be empty or contain | or , - enter your username: ").strip()
+
+    store.refresh()
+    if username not in store.users:
+        # New users join the leaderboard with 0 points, as before the step log
+        store.append([("points", username, 0)])
+
+    while True:
+        menu()
+        try:
+            user = int(input("Choose option: "))
+        except ValueError:
+            user = 0
 
-username = input("Enter your username: ")
+        if user == 1:
+            try:
+                steps = int(input("Enter steps walked: "))
+            except ValueError:
+                steps = -1
 
-if username not in leaderboard:
-    leaderboard[username] = 0
+            if steps < 0:
+                print("Invalid steps")
+                continue
 
-while True:
-    menu()
-    user = int(input("Choose option: "))
+            store.append([("steps", username, steps)])
 
-    if user == 1:
-        steps = int(input("Enter steps walked: "))
+            # Bonus
+            if steps >= BONUS_STEPS:
+                print(f"🔥 Bonus {BONUS_POINTS} points!")
 
-        if steps < 0:
-            print("Invalid steps")
-            continue
+            print("You earned:", calculate_points(steps), "points")
 
-        earned = calculate_points(steps)
-        leaderboard[username] += earned
+        elif user == 2:
+            store.refresh()
+            print("Your total points:", store.points(username))
+            if username in store.users:
+                print(f"Steps: {store.users[username][1]}, rank {store.ranking.rank(username, store.points(username))}"
+                      f" of {len(store.users)}")
 
-        # Bonus
-        if steps >= 8000:
-            print("🔥 Bonus 20 points!")
-            leaderboard[username] += 20
+        elif user == 3:
+            store.refresh()
+            show_leaderboard(store)
 
-        save_leaderboard(leaderboard)
+        elif user == 4:
+            print("Exiting...")
+            break
 
-        print("You earned:", earned, "points")
+        else:
+            print("Invalid choice")
 
-    elif user == 2:
-        print("Your total points:", leaderboard[username])
 
-    elif user == 3:
-        show_leaderboard(leaderboard)
+def main():
+    parser = argparse.ArgumentParser(description="Step tracker: points are steps // 100, +20 for 8000+ steps")
+    parser.add_argument("--bulk", metavar="CSV", help="add step logs for many users from a username,steps CSV")
+    parser.add_argument("--sync-web", action="store_true",
+                        help="add unsynced steps to total_steps in the web app's user data")
+    parser.add_argument("--compact", action="store_true", help="fold the step log into the snapshot")
+    args = parser.parse_args()
 
-    elif user == 4:
-        print("Exiting...")
-        break
+    store = StepStore()
+    store.load()
+    if store.replayed > COMPACT_AFTER:
+        store.compact()
 
-    else:
-        print("Invalid choice")
+    if args.bulk:
+        bulk_add(store, args.bulk)
+    if args.sync_web:
+        sync_to_web(store)
+    if args.compact:
+        store.compact()
+    if not (args.bulk or args.sync_web or args.compact):
+        interactive(store)
 
-        
 
+if __name__ == "__main__":
+    main()
@@ -1,244 +1,4065 @@
-from flask import Flask, render_template, request, redirect, jsonify, session
-from flask_session import Session
+from flask import Flask, Blueprint, current_app, render_template, request, redirect, jsonify, session, make_response, Response, stream_with_context
+from markupsafe import Markup
+from collections import OrderedDict, deque
 import json
 import math
-from datetime import datetime
+import base64
+import os
+import gc
+import gzip
+import fcntl
+import glob
+import heapq
+import bisect
+import queue
+import atexit
+import itertools
+import threading
+import multiprocessing
+import time
+import mmap
+import struct
+import operator
+import random
+import re
+from array import array
+from contextlib import contextmanager
+import csv
+import io
+import click
+from datetime import datetime, timedelta, timezone
 import hashlib
 import secrets
-import pyotp
-import smtplib
-from email.mime.text import MIMEText
 from functools import wraps
 
-app = Flask(__name__)
-app.config['SECRET_KEY'] = secrets.token_hex(32)
-app.config['SESSION_TYPE'] = 'filesystem'
-Session(app)
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    from sortedcontainers import SortedList
+except ImportError:
+    SortedList = None
+
+# numpy speeds up footstep integration and user ranking when installed. It is
+# imported on first use rather than here, so a cold start does not pay for it.
+_numpy = {"module": None, "checked": False}
+
+def optional_numpy():
+    """The numpy module, imported on first call; None if it is not installed"""
+    if not _numpy["checked"]:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        _numpy.update(module=numpy, checked=True)
+    return _numpy["module"]
+
+# Routes, hooks and CLI commands live on this blueprint; create_app() (at the
+# end of the module) builds the Flask app around it.
+bp = Blueprint("energy", __name__, cli_group=None)
 
 # ============= ADMIN CREDENTIALS =============
 ADMIN_CREDENTIALS = {
     "admin": {"password_hash": hashlib.sha256("admin123".encode()).hexdigest(), "email": "admin@energy.com"}
 }
 
-def load_admin_credentials():
-    """Load admin accounts from storage"""
-    credentials = {}
-    try:
-        with open("admin_credentials.txt", "r") as f:
-            for line in f:
-                if line.strip():
-                    parts = line.strip().split("|")
-                    if len(parts) >= 3:
-                        username = parts[0]
-                        credentials[username] = {
-                            "password_hash": parts[1],
-                            "email": parts[2]
-                        }
-    except:
-        # Initialize with default admin if file doesn't exist
-        credentials = ADMIN_CREDENTIALS.copy()
-    return credentials
+def load_admin_credentials():
+    """Load admin accounts from storage"""
+    credentials = {}
+    try:
+        with open("admin_credentials.txt", "r") as f:
+            for line in f:
+                if line.strip():
+                    parts = line.strip().split("|")
+                    if len(parts) >= 3:
+                        username = parts[0]
+                        credentials[username] = {
+                            "password_hash": parts[1],
+                            "email": parts[2]
+                        }
+    except:
+        # Initialize with default admin if file doesn't exist
+        credentials = ADMIN_CREDENTIALS.copy()
+    return credentials
+
+def save_admin_credentials(credentials):
+    """Save admin credentials to storage"""
+    with open("admin_credentials.txt", "w") as f:
+        for username in credentials:
+            admin = credentials[username]
+            f.write(f"{username}|{admin['password_hash']}|{admin['email']}\n")
+
+# ============= AUTHENTICATION DATABASE FUNCTIONS =============
+def load_users():
+    """Load user accounts with credentials"""
+    users = {}
+    try:
+        with open("users.txt", "r") as f:
+            for line in f:
+                if line.strip():
+                    parts = line.strip().split("|")
+                    if len(parts) >= 5:
+                        username = parts[0]
+                        users[username] = {
+                            "password_hash": parts[1],
+                            "email": parts[2],
+                            "mfa_secret": parts[3],
+                            "otp_secret": parts[4] if len(parts) > 4 else None
+                        }
+    except:
+        pass
+    return users
+
+def save_users(users):
+    """Save user accounts"""
+    with open("users.txt", "w") as f:
+        for username in users:
+            user = users[username]
+            f.write(f"{username}|{user['password_hash']}|{user['email']}|{user['mfa_secret']}|{user.get('otp_secret', '')}\n")
+
+def hash_password(password):
+    """Hash password using SHA256"""
+    return hashlib.sha256(password.encode()).hexdigest()
+
+def verify_password(stored_hash, password):
+    """Verify password hash"""
+    return stored_hash == hash_password(password)
+
+def generate_mfa_secret():
+    """Generate TOTP secret for user"""
+    import pyotp
+    return pyotp.random_base32()
+
+def load_mfa_sessions():
+    """Load pending MFA sessions"""
+    sessions = {}
+    try:
+        with open("mfa_sessions.txt", "r") as f:
+            for line in f:
+                if line.strip():
+                    parts = line.strip().split("|")
+                    if len(parts) >= 4:
+                        session_id = parts[0]
+                        sessions[session_id] = {
+                            "username": parts[1],
+                            "user_type": parts[2],
+                            "otp": parts[3],
+                            "timestamp": float(parts[4]) if len(parts) > 4 else 0
+                        }
+    except:
+        pass
+    return sessions
+
+def save_mfa_sessions(sessions):
+    """Save MFA sessions"""
+    with open("mfa_sessions.txt", "w") as f:
+        for session_id in sessions:
+            s = sessions[session_id]
+            f.write(f"{session_id}|{s['username']}|{s['user_type']}|{s['otp']}|{s['timestamp']}\n")
+
+_mfa_sessions_thread_lock = threading.RLock()
+
+@contextmanager
+def mfa_sessions_lock():
+    """Serialize load-modify-save of mfa_sessions.txt across threads and workers"""
+    with _mfa_sessions_thread_lock:
+        with open("mfa_sessions.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def consume_mfa_session(mfa_session_id):
+    """Remove a verified MFA session"""
+    with mfa_sessions_lock():
+        mfa_sessions = load_mfa_sessions()
+        if mfa_sessions.pop(mfa_session_id, None) is not None:
+            save_mfa_sessions(mfa_sessions)
+
+# ============= ENERGY TILE DATABASE =============
+# Default tiles - will be created on first run
+DEFAULT_ENERGY_TILES = {
+    "tile_001": {"name": "Shibuya Crossing", "lat": 35.6595, "lon": 139.7004, "radius": 0.001, "capacity": 1000},
+    "tile_002": {"name": "Tokyo Station", "lat": 35.6762, "lon": 139.7674, "radius": 0.001, "capacity": 800},
+    "tile_003": {"name": "Shinjuku Station", "lat": 35.5308, "lon": 139.7100, "radius": 0.001, "capacity": 900},
+    "tile_004": {"name": "Harajuku", "lat": 35.6654, "lon": 139.7033, "radius": 0.0015, "capacity": 700},
+    "tile_005": {"name": "Ginza", "lat": 35.6730, "lon": 139.7725, "radius": 0.0012, "capacity": 600},
+}
+
+def load_energy_tiles():
+    """Load energy tiles from storage"""
+    tiles = {}
+    try:
+        with open("energy_tiles.txt", "r") as f:
+            for line in f:
+                if line.strip():
+                    parts = line.strip().split("|")
+                    if len(parts) >= 6:
+                        tile_id = parts[0]
+                        tiles[tile_id] = {
+                            "name": parts[1],
+                            "lat": float(parts[2]),
+                            "lon": float(parts[3]),
+                            "radius": float(parts[4]),
+                            "capacity": int(parts[5])
+                        }
+    except:
+        # No registry yet: serve the defaults (ensure_default_tiles() writes them)
+        tiles = DEFAULT_ENERGY_TILES.copy()
+    return tiles
+
+def ensure_default_tiles():
+    """Write the default tiles when there is no tile registry yet"""
+    if not os.path.exists("energy_tiles.txt"):
+        save_energy_tiles(DEFAULT_ENERGY_TILES.copy())
+
+def save_energy_tiles(tiles):
+    """Save energy tiles to storage (atomically, via a temp file and rename)"""
+    tmp_path = f"energy_tiles.txt.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        for tile_id in tiles:
+            tile = tiles[tile_id]
+            f.write(f"{tile_id}|{tile['name']}|{tile['lat']}|{tile['lon']}|{tile['radius']}|{tile['capacity']}\n")
+    os.replace(tmp_path, "energy_tiles.txt")
+
+_energy_tiles_thread_lock = threading.RLock()
+
+@contextmanager
+def energy_tiles_lock():
+    """Serialize load-modify-save of energy_tiles.txt across threads and workers"""
+    with _energy_tiles_thread_lock:
+        with open("energy_tiles.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def validate_tile_fields(tile_name, latitude_str, longitude_str, radius_str="0.001", capacity_str="1000"):
+    """Validate raw tile fields. Returns (tile, None) or (None, error message)"""
+    if not tile_name or len(tile_name.strip()) == 0:
+        return None, "Tile name required"
+    
+    if "|" in tile_name or "\n" in tile_name:
+        return None, "Tile name cannot contain '|' or line breaks"
+    
+    # Validate and convert coordinates
+    if not latitude_str or not longitude_str:
+        return None, "Latitude and Longitude are required"
+    
+    try:
+        latitude = float(latitude_str)
+        longitude = float(longitude_str)
+    except ValueError:
+        return None, "Latitude and Longitude must be numbers"
+    
+    if not (-90 <= latitude <= 90) or not (-180 <= longitude <= 180):
+        return None, "Invalid GPS coordinates"
+    
+    # Validate radius
+    try:
+        radius = float(radius_str)
+    except (TypeError, ValueError):
+        radius = 0.001
+    
+    # Validate capacity
+    try:
+        capacity = int(capacity_str)
+    except (TypeError, ValueError):
+        return None, "Capacity must be a whole number"
+    
+    if capacity <= 0:
+        return None, "Capacity must be greater than 0"
+    
+    return {
+        "name": tile_name,
+        "lat": latitude,
+        "lon": longitude,
+        "radius": radius,
+        "capacity": capacity
+    }, None
+
+def calculate_distance(lat1, lon1, lat2, lon2):
+    """Calculate distance between two GPS coordinates in kilometers"""
+    R = 6371  # Earth's radius in km
+    dlat = math.radians(lat2 - lat1)
+    dlon = math.radians(lon2 - lon1)
+    a = math.sin(dlat/2)**2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlon/2)**2
+    c = 2 * math.asin(math.sqrt(a))
+    return R * c
+
+def is_on_energy_tile(user_lat, user_lon):
+    """Check if user is on an energy tile and return tile info"""
+    energy_tiles = load_energy_tiles()
+    for tile_id, tile_info in energy_tiles.items():
+        distance = calculate_distance(user_lat, user_lon, tile_info["lat"], tile_info["lon"])
+        # Convert radius from degrees to km (approximately)
+        if distance < (tile_info["radius"] * 111):  # 1 degree ≈ 111 km
+            return tile_id, tile_info
+    return None, None
+
+def parse_user_fields(parts):
+    """Build a user's aggregates from the fields of one user_data.txt line"""
+    return {
+        "total_energy_wh": float(parts[1]),
+        "reward_points": float(parts[2]),
+        "pressure_given": float(parts[3]),
+        "ampere": float(parts[4]),
+        "voltage": float(parts[5]),
+        "tiles_visited": int(parts[6]),
+        "total_steps": int(parts[7]) if len(parts) > 7 else 0,
+        "assigned_location": parts[8] if len(parts) > 8 else None
+    }
+
+def load_user_data():
+    """Load all user data including energy records and rewards"""
+    data = {}
+    try:
+        with open("user_data.txt", "r") as f:
+            for line in f:
+                if line.strip():
+                    parts = line.strip().split("|")
+                    if len(parts) >= 7:
+                        data[parts[0]] = parse_user_fields(parts)
+    except:
+        pass
+    return data
+
+def save_user_data(data):
+    """Save user data to persistent storage (atomically, via a temp file and rename)"""
+    tmp_path = f"user_data.txt.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        for username in data:
+            user = data[username]
+            f.write(f"{username}|{user['total_energy_wh']}|{user['reward_points']}|{user.get('pressure_given', 0)}|{user.get('ampere', 0)}|{user.get('voltage', 0)}|{user.get('tiles_visited', 0)}|{user.get('total_steps', 0)}|{user.get('assigned_location', '')}\n")
+    os.replace(tmp_path, "user_data.txt")
+
+# ============= USER TABLE =============
+# Read-side user aggregates are held column-wise: one array per numeric
+# field plus a username -> row index, instead of a dict of 8 boxed values
+# per user. UserRow gives templates and callers the usual dict-style access.
+USER_FLOAT_FIELDS = ("total_energy_wh", "reward_points", "pressure_given", "ampere", "voltage")
+USER_INT_FIELDS = ("tiles_visited", "total_steps")
+USER_FIELDS = USER_FLOAT_FIELDS + USER_INT_FIELDS + ("assigned_location",)
+
+class UserRow:
+    """Dict-like, read-only view of one row of a UserTable"""
+    __slots__ = ("_table", "_row")
+
+    def __init__(self, table, row):
+        self._table = table
+        self._row = row
+
+    def __getitem__(self, field):
+        if field == "assigned_location":
+            return self._table.assigned[self._row]
+        return self._table.columns[field][self._row]
+
+    def get(self, field, default=None):
+        try:
+            return self[field]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return USER_FIELDS
+
+    def __iter__(self):
+        return iter(USER_FIELDS)
+
+    def __contains__(self, field):
+        return field in USER_FIELDS
+
+    def items(self):
+        return [(field, self[field]) for field in USER_FIELDS]
+
+    def to_dict(self):
+        return dict(self.items())
+
+class UserTable:
+    """Read-only user aggregates stored in typed arrays, one per field"""
+
+    def __init__(self, usernames=(), columns=None, assigned=None):
+        self.usernames = list(usernames)
+        self.row_of = {username: row for row, username in enumerate(self.usernames)}
+        if columns is None:
+            columns = {field: array("d") for field in USER_FLOAT_FIELDS}
+            columns.update({field: array("q") for field in USER_INT_FIELDS})
+        self.columns = columns
+        self.assigned = assigned if assigned is not None else [None] * len(self.usernames)
+
+    @classmethod
+    def load(cls, path="user_data.txt"):
+        """Parse a user_data.txt file straight into columns (same rules as load_user_data)"""
+        table = cls()
+        locations = {}
+        try:
+            with open(path, "r") as f:
+                for line in f:
+                    if line.strip():
+                        parts = line.strip().split("|")
+                        if len(parts) >= 7:
+                            location = parts[8] if len(parts) > 8 else None
+                            table.set_row(parts[0], (
+                                float(parts[1]), float(parts[2]), float(parts[3]), float(parts[4]), float(parts[5]),
+                                int(parts[6]), int(parts[7]) if len(parts) > 7 else 0,
+                                locations.setdefault(location, location)))
+        except:
+            pass
+        return table
+
+    @classmethod
+    def from_user_data(cls, data):
+        table = cls()
+        for username, user in data.items():
+            table.set_row(username, tuple(user.get(field, 0) for field in USER_FLOAT_FIELDS + USER_INT_FIELDS)
+                          + (user.get("assigned_location"),))
+        return table
+
+    def set_row(self, username, values):
+        """Add or overwrite a user's row; values are in USER_FIELDS order"""
+        row = self.row_of.get(username)
+        if row is None:
+            self.row_of[username] = len(self.usernames)
+            self.usernames.append(username)
+            for field, value in zip(USER_FLOAT_FIELDS + USER_INT_FIELDS, values):
+                self.columns[field].append(value)
+            self.assigned.append(values[-1])
+        else:
+            for field, value in zip(USER_FLOAT_FIELDS + USER_INT_FIELDS, values):
+                self.columns[field][row] = value
+            self.assigned[row] = values[-1]
+
+    def get(self, username, default=None):
+        row = self.row_of.get(username)
+        return UserRow(self, row) if row is not None else default
+
+    def __getitem__(self, username):
+        return UserRow(self, self.row_of[username])
+
+    def __contains__(self, username):
+        return username in self.row_of
+
+    def __iter__(self):
+        return iter(self.usernames)
+
+    def __len__(self):
+        return len(self.usernames)
+
+    def items(self):
+        return ((username, UserRow(self, row)) for row, username in enumerate(self.usernames))
+
+    def values(self):
+        return (UserRow(self, row) for row in range(len(self.usernames)))
+
+    def total(self, field):
+        return sum(self.columns[field])
+
+    def ranking(self, field="reward_points"):
+        """Rows ordered by a field, highest first (ties keep file order)"""
+        column = self.columns[field]
+        numpy = optional_numpy() if len(column) else None
+        if numpy is not None:
+            values = numpy.frombuffer(column, dtype=numpy.float64 if column.typecode == "d" else numpy.int64)
+            return array("I", numpy.argsort(-values, kind="stable").astype(numpy.uint32).tobytes())
+        return array("I", sorted(range(len(column)), key=column.__getitem__, reverse=True))
+
+    def to_dict(self):
+        """Mutable dict-of-dicts copy, in the load_user_data() shape"""
+        return {username: UserRow(self, row).to_dict() for row, username in enumerate(self.usernames)}
+
+_user_data_cache = {"stamp": None, "data": UserTable()}
+
+def get_user_data_stamp():
+    """Identity of the current user_data.txt contents"""
+    try:
+        st = os.stat("user_data.txt")
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+    except OSError:
+        return None
+
+def load_user_data_cached():
+    """Read-only UserTable of user data, re-parsed only when user_data.txt changes.
+    Use load_user_data() to get a mutable copy."""
+    replica = current_replica()
+    if replica is not None:
+        return replica["users"]
+    stamp = get_user_data_stamp()
+    if _user_data_cache["stamp"] != stamp:
+        _user_data_cache["data"] = UserTable.load()
+        _user_data_cache["stamp"] = stamp
+    return _user_data_cache["data"]
+
+_user_data_thread_lock = threading.RLock()
+
+@contextmanager
+def user_data_lock():
+    """Serialize load-modify-save of user_data.txt across threads and workers"""
+    with _user_data_thread_lock:
+        with open("user_data.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+_leaderboard_cache = {"stamp": None, "order": []}
+
+def get_leaderboard_order():
+    """Usernames by reward points, highest first (kept per user data version)"""
+    replica = current_replica()
+    if replica is not None:
+        return replica["order"]
+    user_data = load_user_data_cached()
+    stamp = _user_data_cache["stamp"]
+    if _leaderboard_cache["stamp"] != stamp or stamp is None:
+        _leaderboard_cache["order"] = [user_data.usernames[row] for row in user_data.ranking("reward_points")]
+        _leaderboard_cache["stamp"] = stamp
+    return _leaderboard_cache["order"]
+
+def new_user_record():
+    """Fresh aggregates for a user with no data yet"""
+    return {
+        "total_energy_wh": 0,
+        "reward_points": 0,
+        "pressure_given": 0,
+        "ampere": 0,
+        "voltage": 0,
+        "tiles_visited": 0,
+        "total_steps": 0
+    }
+
+def energy_record_logs():
+    """Every append-only energy record log: the main file and shard segments"""
+    return ["energy_records.txt"] + sorted(glob.glob(os.path.join(SHARD_DIR, "energy_records.shard-*.txt")))
+
+def load_energy_records():
+    """Load IoT energy tile records, including segments written by ingest shards"""
+    sources = []
+    for path in energy_record_logs():
+        records = []
+        try:
+            with open(path, "r") as f:
+                for line in f:
+                    if line.strip():
+                        records.append(json.loads(line))
+        except:
+            pass
+        sources.append(records)
+    if len(sources) == 1:
+        return sources[0]
+    return list(heapq.merge(*sources, key=lambda r: r["timestamp"]))
+
+def save_energy_record(record):
+    """Save IoT sensor data"""
+    save_energy_records([record])
+
+def save_energy_records(records):
+    """Append a batch of IoT sensor records in a single write"""
+    with open("energy_records.txt", "a") as f:
+        f.write("".join(json.dumps(record) + "\n" for record in records))
+
+def calculate_reward_points(electricity_wh):
+    """Convert electricity generated to reward points
+    Formula: 1 Wh = 100 reward points"""
+    return round(electricity_wh * 100, 2)
+
+def get_tier(reward_points):
+    """Get user tier based on reward points"""
+    if reward_points >= 100000:
+        return "💎 Platinum Contributor"
+    elif reward_points >= 50000:
+        return "🏆 Gold Contributor"
+    elif reward_points >= 20000:
+        return "🥈 Silver Contributor"
+    elif reward_points >= 10000:
+        return "🥉 Bronze Contributor"
+    elif reward_points >= 5000:
+        return "⚡ Energy Generator"
+    else:
+        return "🔋 Starter"
+
+
+# ============= MAPPED READ PATH =============
+# Single-user reads (dashboard, ingestion lookups) do not need every row of
+# user_data.txt or every energy record parsed. The files are memory-mapped
+# and a username -> byte offset index points at the rows to decode.
+# The user_data index is kept in a sidecar file (user_data.idx) stamped with
+# the user_data.txt version it describes, so a new worker reuses it instead
+# of rescanning. Energy record logs are append-only, so their per-user
+# offset index is built once and then only extended over the new tail.
+USER_INDEX_FILE = "user_data.idx"
+USER_INDEX_MAGIC = b"EFUIDX01"
+RECORD_USERNAME_PATTERN = re.compile(rb'"username": ("(?:[^"\\]|\\.)*")')
+RECORD_TIMESTAMP_PATTERN = re.compile(rb'"timestamp": "([^"]*)"')
+
+class MappedUserData:
+    """Read-only mapping over one version of user_data.txt. Rows are parsed
+    on access; each access returns a fresh dict."""
+
+    def __init__(self, path="user_data.txt", index_path=USER_INDEX_FILE):
+        with open(path, "rb") as f:
+            st = os.fstat(f.fileno())
+            self.stamp = (st.st_ino, st.st_mtime_ns, st.st_size)
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if st.st_size else b""
+        self.offsets = self._load_index(index_path)
+        if self.offsets is None:
+            self.offsets = self._build_index()
+            self._save_index(index_path)
+
+    def _build_index(self):
+        offsets = {}
+        data = self._map
+        pos = 0
+        size = len(data)
+        while pos < size:
+            end = data.find(b"\n", pos)
+            if end == -1:
+                end = size
+            line = data[pos:end]
+            if line.count(b"|") >= 6:
+                offsets[line[:line.index(b"|")].decode().strip()] = pos
+            pos = end + 1
+        return offsets
+
+    def _load_index(self, index_path):
+        try:
+            with open(index_path, "rb") as f:
+                blob = f.read()
+        except OSError:
+            return None
+        header_len = len(USER_INDEX_MAGIC) + struct.calcsize("<qqqI")
+        if blob[:len(USER_INDEX_MAGIC)] != USER_INDEX_MAGIC:
+            return None
+        ino, mtime_ns, size, count = struct.unpack_from("<qqqI", blob, len(USER_INDEX_MAGIC))
+        if (ino, mtime_ns, size) != self.stamp:
+            return None
+        positions = array("Q")
+        positions.frombytes(blob[header_len:header_len + count * positions.itemsize])
+        names = blob[header_len + count * positions.itemsize:].decode().split("\n") if count else []
+        return dict(zip(names, positions))
+
+    def _save_index(self, index_path):
+        positions = array("Q", self.offsets.values())
+        tmp_path = f"{index_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(USER_INDEX_MAGIC + struct.pack("<qqqI", *self.stamp, len(positions)))
+                f.write(positions.tobytes())
+                f.write("\n".join(self.offsets).encode())
+            os.replace(tmp_path, index_path)
+        except OSError as e:
+            print(f"User Index Error: {e}")
+
+    def get(self, username, default=None):
+        offset = self.offsets.get(username)
+        if offset is None:
+            return default
+        end = self._map.find(b"\n", offset)
+        line = self._map[offset:end if end != -1 else len(self._map)]
+        try:
+            return parse_user_fields(line.decode().strip().split("|"))
+        except (ValueError, IndexError):
+            return default
+
+    def __getitem__(self, username):
+        user = self.get(username)
+        if user is None:
+            raise KeyError(username)
+        return user
+
+    def __contains__(self, username):
+        return username in self.offsets
+
+    def __iter__(self):
+        return iter(self.offsets)
+
+    def __len__(self):
+        return len(self.offsets)
+
+_mapped_user_data = {"view": None}
+_mapped_user_data_lock = threading.Lock()
+
+def get_mapped_user_data():
+    """Memory-mapped view of the current user_data.txt (empty dict if there is none)"""
+    replica = current_replica()
+    if replica is not None:
+        return replica["users"]
+    stamp = get_user_data_stamp()
+    view = _mapped_user_data["view"]
+    if stamp is None:
+        return {}
+    if view is None or view.stamp != stamp:
+        with _mapped_user_data_lock:
+            view = _mapped_user_data["view"]
+            if view is None or view.stamp != get_user_data_stamp():
+                try:
+                    view = MappedUserData()
+                except OSError:
+                    return {}
+                _mapped_user_data["view"] = view
+    return view
+
+class EnergyRecordIndex:
+    """Per-user byte offsets into one append-only energy record log.
+    Records are stamped before they are appended, so concurrent writers can
+    leave a user's timestamps slightly out of log order; those users are
+    tracked in `unordered`."""
+
+    def __init__(self, path):
+        self.path = path
+        self.inode = None
+        self.indexed_upto = 0
+        self.offsets = {}
+        self.stamps = {}
+        self.unordered = set()
+        self.lock = threading.Lock()
+
+    def refresh(self):
+        """Index any complete lines appended since the last call"""
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            st = None
+        with self.lock:
+            if st is None or st.st_ino != self.inode or st.st_size < self.indexed_upto:
+                self.inode = st.st_ino if st else None
+                self.indexed_upto = 0
+                self.offsets = {}
+                self.stamps = {}
+                self.unordered = set()
+            if st is None or st.st_size == self.indexed_upto:
+                return
+            with open(self.path, "rb") as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    pos = self.indexed_upto
+                    while True:
+                        end = data.find(b"\n", pos)
+                        if end == -1:
+                            break
+                        match = RECORD_USERNAME_PATTERN.search(data, pos, end)
+                        if match:
+                            username = json.loads(match.group(1))
+                            stamps = self.stamps.setdefault(username, array("d"))
+                            stamp = RECORD_TIMESTAMP_PATTERN.search(data, pos, end)
+                            try:
+                                when = datetime.fromisoformat(stamp.group(1).decode()).timestamp()
+                            except (AttributeError, ValueError):
+                                when = stamps[-1] if stamps else 0.0
+                            if stamps and when < stamps[-1]:
+                                self.unordered.add(username)
+                            self.offsets.setdefault(username, array("Q")).append(pos)
+                            stamps.append(when)
+                        pos = end + 1
+                    self.indexed_upto = pos
+
+    def user_offsets(self, username):
+        self.refresh()
+        return self.offsets.get(username, ())
+
+    def user_entries(self, username):
+        """A user's record offsets and their timestamps (epoch seconds), ordered
+        by timestamp: log order, unless the user's records were appended out of order"""
+        self.refresh()
+        with self.lock:
+            offsets, stamps = self.offsets.get(username, ()), self.stamps.get(username, ())
+            if username not in self.unordered:
+                return offsets, stamps
+            order = sorted(range(len(stamps)), key=stamps.__getitem__)
+            return array("Q", (offsets[i] for i in order)), array("d", (stamps[i] for i in order))
+
+    def read_records(self, offsets):
+        """Decode the records starting at the given offsets"""
+        if not offsets:
+            return []
+        records = []
+        with open(self.path, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                for offset in offsets:
+                    records.append(json.loads(data[offset:data.find(b"\n", offset)]))
+        return records
+
+_record_indexes = {}
+
+def get_record_index(path):
+    index = _record_indexes.get(path)
+    if index is None:
+        index = _record_indexes.setdefault(path, EnergyRecordIndex(path))
+    return index
+
+def recent_user_records(username, limit):
+    """A user's last `limit` energy records (by timestamp) across all record logs"""
+    sources = []
+    for path in energy_record_logs():
+        index = get_record_index(path)
+        offsets = index.user_offsets(username)
+        sources.append(index.read_records(offsets[-limit:] if limit else []))
+    return list(heapq.merge(*sources, key=lambda r: r["timestamp"]))[-limit:] if limit else []
+
+# ============= ENERGY HISTORY =============
+# A page walks each log's per-user offsets from a saved position and merges
+# the logs by timestamp, so it reads about `limit` records however long the
+# history is. Positions move away from newly appended records, so paging
+# stays stable while the user keeps generating energy.
+
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE = 500
+HISTORY_EXPORT_FIELDS = ["timestamp", "tile_id", "tile_name", "electricity_wh", "lat", "lon", "footsteps"]
+
+def encode_history_cursor(order, positions):
+    raw = json.dumps({"o": order, "p": positions}, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_history_cursor(cursor, order):
+    """Per-log positions from an opaque cursor; ValueError if it is malformed"""
+    try:
+        state = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        positions = {str(path): int(pos) for path, pos in state["p"].items()}
+    except Exception:
+        raise ValueError("invalid cursor")
+    if state.get("o") != order:
+        raise ValueError(f"cursor was not issued for order={order}")
+    return positions
+
+def parse_history_bound(value, upper):
+    """Epoch seconds for a from/to bound; a bare date as `to` covers that whole day"""
+    if not value:
+        return None
+    when = datetime.fromisoformat(value)
+    if upper and len(value) == 10:
+        when += timedelta(days=1)
+    return when.timestamp()
+
+def user_history_page(username, limit, order="desc", start=None, end=None, positions=None):
+    """One page of a user's energy records, newest first unless order is "asc".
+
+    start/end bound the record timestamps (end exclusive). Returns the records
+    and the positions to continue from, or None once the history is exhausted."""
+    desc = order == "desc"
+    positions = positions or {}
+    logs, heads, resume = [], [], {}
+    for i, path in enumerate(energy_record_logs()):
+        index = get_record_index(path)
+        offsets, stamps = index.user_entries(username)
+        count = min(len(offsets), len(stamps))
+        low = bisect.bisect_left(stamps, start, 0, count) if start is not None else 0
+        high = bisect.bisect_left(stamps, end, 0, count) if end is not None else count
+        pos = min(max(positions.get(path, high if desc else low), low), high)
+        logs.append((path, index, offsets, stamps, low, high))
+        resume[path] = pos
+        if desc and pos > low:
+            heads.append(((-stamps[pos - 1], -i), i))
+        elif not desc and pos < high:
+            heads.append(((stamps[pos], i), i))
+    heapq.heapify(heads)
+    
+    picked = []
+    while heads and len(picked) < limit:
+        _, i = heapq.heappop(heads)
+        path, index, offsets, stamps, low, high = logs[i]
+        pos = resume[path]
+        if desc:
+            picked.append((i, offsets[pos - 1]))
+            pos -= 1
+            if pos > low:
+                heapq.heappush(heads, ((-stamps[pos - 1], -i), i))
+        else:
+            picked.append((i, offsets[pos]))
+            pos += 1
+            if pos < high:
+                heapq.heappush(heads, ((stamps[pos], i), i))
+        resume[path] = pos
+    
+    by_log = {}
+    for i, offset in picked:
+        by_log.setdefault(i, []).append(offset)
+    decoded = {}
+    for i, offsets in by_log.items():
+        for offset, record in zip(offsets, logs[i][1].read_records(offsets)):
+            decoded[(i, offset)] = record
+    return [decoded[key] for key in picked], (resume if heads else None)
+
+def iter_user_history(username, start=None, end=None):
+    """Every energy record of a user, oldest first, one page in memory at a time"""
+    records, positions = user_history_page(username, HISTORY_MAX_PAGE, "asc", start, end)
+    yield from records
+    while positions is not None:
+        records, positions = user_history_page(username, HISTORY_MAX_PAGE, "asc", start, end, positions)
+        yield from records
+
+def iter_history_export(username, fmt="csv", start=None, end=None):
+    """Stream a user's energy history as CSV or NDJSON lines"""
+    if fmt == "ndjson":
+        for record in iter_user_history(username, start, end):
+            yield json.dumps(record) + "\n"
+        return
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(HISTORY_EXPORT_FIELDS)
+    for record in iter_user_history(username, start, end):
+        location = record.get("location") or {}
+        writer.writerow([record["timestamp"], record["tile_id"], record.get("tile_name", ""),
+                         record["electricity_wh"], location.get("lat", ""), location.get("lon", ""),
+                         record.get("footsteps", "")])
+        if buffer.tell() > 65536:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+# ============= RESPONSE CACHE =============
+# Pages built from user data and tiles are cached against a data version
+# derived from the data files, so repeat views between writes skip the
+# load-sort-render cycle and clients can revalidate with If-None-Match.
+DATA_VERSION_FILES = ("user_data.txt", "energy_tiles.txt")
+FRAGMENT_CACHE_SIZE = 20000
+
+_response_cache = {}
+_fragment_cache = OrderedDict()
+
+def get_data_version():
+    """Return a version stamp that changes whenever user data or tiles change.
+    Built from file stats so writes made by other workers are seen too."""
+    replica = current_replica()
+    if replica is not None:
+        return replica["version"]
+    stamps = []
+    for path in DATA_VERSION_FILES:
+        try:
+            st = os.stat(path)
+            stamps.append((st.st_ino, st.st_mtime_ns, st.st_size))
+        except OSError:
+            stamps.append(None)
+    return tuple(stamps)
+
+def cached_page(cache_key, build_page):
+    """Serve a rendered page from cache, answering 304 when the client's ETag is current"""
+    version = get_data_version()
+    etag = hashlib.sha1(repr((cache_key, version)).encode()).hexdigest()
+    if request.if_none_match.contains_weak(etag):
+        response = current_app.response_class(status=304)
+    else:
+        entry = _response_cache.get(cache_key)
+        if entry is None or entry[0] != version:
+            entry = (version, build_page())
+            _response_cache[cache_key] = entry
+        response = make_response(entry[1])
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+def render_fragment(template_name, **context):
+    """Render a table row/card fragment, reusing the cached HTML for unchanged rows"""
+    key = (template_name, repr(sorted(context.items())))
+    html = _fragment_cache.get(key)
+    if html is None:
+        html = Markup(render_template(template_name, **context))
+        _fragment_cache[key] = html
+        if len(_fragment_cache) > FRAGMENT_CACHE_SIZE:
+            _fragment_cache.popitem(last=False)
+    else:
+        _fragment_cache.move_to_end(key)
+    return html
+
+
+# ============= TILE SNAPSHOTS & CHANGE LOG =============
+# Every tile add/update/remove is appended to tile_changes.txt with a
+# monotonically increasing version. Map clients poll /api/get-tiles with
+# ETag/If-Modified-Since or ask for a delta with ?since=<version>.
+TILE_CHANGES_FILE = "tile_changes.txt"
+
+_tile_changes = {"stamp": None, "entries": []}
+_tile_snapshots = {}
+
+def load_tile_changes():
+    """Load the tile change log, re-reading only when the file changed"""
+    try:
+        st = os.stat(TILE_CHANGES_FILE)
+        stamp = (st.st_ino, st.st_mtime_ns, st.st_size)
+    except OSError:
+        return []
+    if _tile_changes["stamp"] != stamp:
+        entries = []
+        with open(TILE_CHANGES_FILE, "r") as f:
+            for line in f:
+                if line.strip():
+                    entries.append(json.loads(line))
+        _tile_changes["stamp"] = stamp
+        _tile_changes["entries"] = entries
+    return _tile_changes["entries"]
+
+def get_tile_version():
+    """Current tile registry version (0 before any logged change)"""
+    entries = load_tile_changes()
+    return entries[-1]["version"] if entries else 0
+
+def record_tile_changes(changes):
+    """Append (op, tile_id, tile) changes to the log, returning the new version.
+    op is "add", "update" or "remove"; the file lock keeps versions unique across workers."""
+    with open(TILE_CHANGES_FILE, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            version = get_tile_version()
+            timestamp = datetime.now().isoformat()
+            for op, tile_id, tile in changes:
+                version += 1
+                f.write(json.dumps({
+                    "version": version,
+                    "op": op,
+                    "tile_id": tile_id,
+                    "tile": tile,
+                    "timestamp": timestamp
+                }) + "\n")
+            f.flush()
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+    return version
+
+def tile_to_json(tile_id, tile):
+    """Public JSON shape of a tile"""
+    return {
+        "id": tile_id,
+        "name": tile["name"],
+        "lat": tile["lat"],
+        "lon": tile["lon"],
+        "radius": tile["radius"],
+        "capacity": tile["capacity"]
+    }
+
+def get_tile_registry_key():
+    """Cache key for anything derived from the tile registry"""
+    try:
+        st = os.stat("energy_tiles.txt")
+        stamp = (st.st_ino, st.st_mtime_ns, st.st_size)
+    except OSError:
+        stamp = None
+    return (get_tile_version(), stamp)
+
+def get_tile_snapshot():
+    """Serialized (and pre-compressed) tile list for the current tile version"""
+    key = get_tile_registry_key()
+    try:
+        last_modified = datetime.fromtimestamp(os.stat("energy_tiles.txt").st_mtime, timezone.utc)
+    except OSError:
+        last_modified = None
+    snapshot = _tile_snapshots.get(key)
+    if snapshot is None:
+        tiles_list = [tile_to_json(tile_id, tile) for tile_id, tile in load_energy_tiles().items()]
+        body = json.dumps(tiles_list).encode()
+        snapshot = {
+            "version": key[0],
+            "etag": hashlib.sha1(repr(key).encode()).hexdigest(),
+            "last_modified": last_modified,
+            "identity": body,
+            "gzip": gzip.compress(body),
+            "br": brotli.compress(body) if brotli else None
+        }
+        # Only the latest snapshot is worth keeping
+        _tile_snapshots.clear()
+        _tile_snapshots[key] = snapshot
+    return snapshot
+
+def get_tile_delta(since):
+    """Collapse logged changes after `since` into added/changed/removed sets"""
+    first_op = {}
+    final = {}
+    for entry in load_tile_changes():
+        if entry["version"] <= since:
+            continue
+        first_op.setdefault(entry["tile_id"], entry["op"])
+        final[entry["tile_id"]] = entry
+    added, changed, removed = [], [], []
+    for tile_id, entry in final.items():
+        if entry["op"] == "remove":
+            if first_op[tile_id] != "add":
+                removed.append(tile_id)
+        elif first_op[tile_id] == "add":
+            added.append(tile_to_json(tile_id, entry["tile"]))
+        else:
+            changed.append(tile_to_json(tile_id, entry["tile"]))
+    return {"added": added, "changed": changed, "removed": removed}
+
+
+# ============= TILE SPATIAL INDEX =============
+# Uniform lat/lon grid over the tile registry. Viewport and nearest-tile
+# queries only touch the cells they overlap; calculate_distance is used for
+# the final ranking. Rebuilt once per tile registry version.
+TILE_GRID_CELL_DEG = 0.01  # ~1.1 km cells
+MAX_TILE_RESULTS = 500
+
+class TileSpatialIndex:
+    """Grid index of tiles keyed by (lat cell, lon cell)"""
+
+    def __init__(self, tiles, cell_deg=TILE_GRID_CELL_DEG):
+        self.cell_deg = cell_deg
+        self.tiles = tiles
+        self.cells = {}
+        for tile_id, tile in tiles.items():
+            self.cells.setdefault(self.cell_of(tile["lat"], tile["lon"]), []).append(tile_id)
+        if self.cells:
+            self.min_cy = min(c[0] for c in self.cells)
+            self.max_cy = max(c[0] for c in self.cells)
+            self.min_cx = min(c[1] for c in self.cells)
+            self.max_cx = max(c[1] for c in self.cells)
+
+    def cell_of(self, lat, lon):
+        return (int(math.floor(lat / self.cell_deg)), int(math.floor(lon / self.cell_deg)))
+
+    def in_bbox(self, min_lat, min_lon, max_lat, max_lon, limit=MAX_TILE_RESULTS):
+        """Tile ids inside the bounding box, at most `limit`"""
+        if not self.cells:
+            return []
+        lo_cy, lo_cx = self.cell_of(min_lat, min_lon)
+        hi_cy, hi_cx = self.cell_of(max_lat, max_lon)
+        lo_cy, hi_cy = max(lo_cy, self.min_cy), min(hi_cy, self.max_cy)
+        lo_cx, hi_cx = max(lo_cx, self.min_cx), min(hi_cx, self.max_cx)
+        if (hi_cy - lo_cy + 1) * (hi_cx - lo_cx + 1) > len(self.cells):
+            # Viewport covers more cells than are occupied - walk occupied cells instead
+            candidate_cells = [c for c in self.cells if lo_cy <= c[0] <= hi_cy and lo_cx <= c[1] <= hi_cx]
+        else:
+            candidate_cells = [(cy, cx) for cy in range(lo_cy, hi_cy + 1) for cx in range(lo_cx, hi_cx + 1)]
+        results = []
+        for cell in candidate_cells:
+            for tile_id in self.cells.get(cell, ()):
+                tile = self.tiles[tile_id]
+                if min_lat <= tile["lat"] <= max_lat and min_lon <= tile["lon"] <= max_lon:
+                    results.append(tile_id)
+                    if len(results) >= limit:
+                        return results
+        return results
+
+    def nearest(self, lat, lon, k):
+        """[(distance_km, tile_id)] for the k closest tiles, searched ring by ring"""
+        if not self.cells:
+            return []
+        cy, cx = self.cell_of(lat, lon)
+        max_ring = max(abs(cy - self.min_cy), abs(cy - self.max_cy),
+                       abs(cx - self.min_cx), abs(cx - self.max_cx))
+        found = []
+        cells_visited = 0
+        for ring in range(max_ring + 1):
+            cells_visited += max(1, 8 * ring)
+            if cells_visited > 4 * len(self.cells):
+                # Sparse registry - ranking every tile is cheaper than more rings
+                found = [(calculate_distance(lat, lon, tile["lat"], tile["lon"]), tile_id)
+                         for tile_id, tile in self.tiles.items()]
+                break
+            for dy in range(-ring, ring + 1):
+                row_cells = (-ring, ring) if abs(dy) != ring else range(-ring, ring + 1)
+                for dx in row_cells:
+                    for tile_id in self.cells.get((cy + dy, cx + dx), ()):
+                        tile = self.tiles[tile_id]
+                        found.append((calculate_distance(lat, lon, tile["lat"], tile["lon"]), tile_id))
+            if len(found) >= k:
+                found.sort()
+                # Anything outside this ring is at least `ring` whole cells away
+                edge_lat = min(89.0, abs(lat) + (ring + 1) * self.cell_deg)
+                ring_km = ring * self.cell_deg * 111 * math.cos(math.radians(edge_lat))
+                if found[k - 1][0] <= ring_km:
+                    break
+        found.sort()
+        return found[:k]
+
+_tile_index_cache = {}
+
+def get_tile_index():
+    """Spatial index for the current tile registry version"""
+    key = get_tile_registry_key()
+    index = _tile_index_cache.get(key)
+    if index is None:
+        index = TileSpatialIndex(load_energy_tiles())
+        _tile_index_cache.clear()
+        _tile_index_cache[key] = index
+    return index
+
+def parse_result_limit(value, default):
+    """Clamp a client-supplied result limit to MAX_TILE_RESULTS"""
+    if value is None:
+        return default
+    return max(1, min(int(value), MAX_TILE_RESULTS))
+
+
+# ============= BULK TILE IMPORT / EXPORT =============
+# Rows are validated one at a time with the same rules as /add-tile. The
+# registry is written once (under energy_tiles_lock), only if every row is
+# valid, and the derived caches are rebuilt once afterwards.
+TILE_EXPORT_FIELDS = ["tile_id", "name", "lat", "lon", "radius", "capacity"]
+
+def iter_tile_rows(lines, fmt):
+    """Yield (row_number, row dict) from CSV (with header) or NDJSON lines"""
+    if fmt == "ndjson":
+        for row_number, line in enumerate(lines, 1):
+            if line.strip():
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    row = None
+                yield row_number, row if isinstance(row, dict) else None
+    else:
+        for row_number, row in enumerate(csv.DictReader(lines), 1):
+            yield row_number, row
+
+def next_tile_number(tiles):
+    """Smallest tile_NNN number above every existing one"""
+    highest = 0
+    for tile_id in tiles:
+        if tile_id.startswith("tile_") and tile_id[5:].isdigit():
+            highest = max(highest, int(tile_id[5:]))
+    return highest + 1
+
+def tile_row_field(row, *names, default=None):
+    """First of `names` present in a row as a string, like a form field.
+    Only a missing (or null) field falls back, so "" or 0 is validated as given."""
+    for name in names:
+        value = row.get(name)
+        if value is not None:
+            return value if isinstance(value, str) else str(value)
+    return default
+
+def import_tiles(lines, fmt="csv", dry_run=False):
+    """Validate and import tile rows atomically. Rows with a known tile_id
+    update that tile, other rows are added with the next free id."""
+    valid_rows = []
+    seen = set()
+    errors = []
+    rows = 0
+    for row_number, row in iter_tile_rows(lines, fmt):
+        rows += 1
+        if row is None:
+            errors.append({"row": row_number, "message": "Malformed row"})
+            continue
+        tile, error = validate_tile_fields(
+            tile_row_field(row, "name", "tile_name"),
+            tile_row_field(row, "lat", "latitude"),
+            tile_row_field(row, "lon", "longitude"),
+            tile_row_field(row, "radius", default="0.001"),
+            tile_row_field(row, "capacity", default="1000")
+        )
+        tile_id = tile_row_field(row, "tile_id", default="").strip()
+        if not error and tile_id and (any(c in tile_id for c in "|\r\n") or tile_id in seen):
+            error = "Duplicate or invalid tile_id"
+        if error:
+            errors.append({"row": row_number, "message": error})
+            continue
+        seen.add(tile_id)
+        valid_rows.append((tile_id, tile))
+    
+    result = {"rows": rows, "added": 0, "updated": 0, "errors": errors, "committed": False}
+    with energy_tiles_lock():
+        energy_tiles = load_energy_tiles()
+        tile_num = next_tile_number(set(energy_tiles) | seen)
+        changes = []
+        for tile_id, tile in valid_rows:
+            if not tile_id:
+                tile_id = f"tile_{str(tile_num).zfill(3)}"
+                tile_num += 1
+            changes.append(("update" if tile_id in energy_tiles else "add", tile_id, tile))
+        result["added"] = sum(1 for op, _, _ in changes if op == "add")
+        result["updated"] = len(changes) - result["added"]
+        if errors or dry_run or not changes:
+            return result
+        
+        for _, tile_id, tile in changes:
+            energy_tiles[tile_id] = tile
+        save_energy_tiles(energy_tiles)
+        result["version"] = record_tile_changes(changes)
+        result["committed"] = True
+    
+    # Rebuild the derived tile caches once for the whole batch
+    get_tile_snapshot()
+    get_tile_index()
+    return result
+
+def iter_tile_export(fmt="csv"):
+    """Stream the tile registry as CSV or NDJSON lines"""
+    energy_tiles = load_energy_tiles()
+    if fmt == "ndjson":
+        for tile_id, tile in energy_tiles.items():
+            yield json.dumps(dict(tile, tile_id=tile_id)) + "\n"
+        return
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(TILE_EXPORT_FIELDS)
+    for tile_id, tile in energy_tiles.items():
+        writer.writerow([tile_id, tile["name"], tile["lat"], tile["lon"], tile["radius"], tile["capacity"]])
+        if buffer.tell() > 65536:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+@bp.cli.command("import-tiles")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "fmt", type=click.Choice(["csv", "ndjson"]), default=None,
+              help="Input format (default: from the file extension)")
+@click.option("--dry-run", is_flag=True, help="Validate only, do not commit")
+def import_tiles_command(path, fmt, dry_run):
+    """Bulk import energy tiles from a CSV or NDJSON file"""
+    fmt = fmt or ("ndjson" if path.endswith((".ndjson", ".jsonl")) else "csv")
+    with open(path, "r", newline="") as f:
+        result = import_tiles(f, fmt, dry_run)
+    for error in result["errors"]:
+        click.echo(f"row {error['row']}: {error['message']}", err=True)
+    click.echo(f"{result['rows']} rows, {result['added']} to add, {result['updated']} to update, "
+               f"{len(result['errors'])} errors, committed={result['committed']}")
+    if result["errors"]:
+        raise SystemExit(1)
+
+@bp.cli.command("export-tiles")
+@click.argument("path", required=False)
+@click.option("--format", "fmt", type=click.Choice(["csv", "ndjson"]), default="csv")
+def export_tiles_command(path, fmt):
+    """Export energy tiles as CSV or NDJSON (to stdout without PATH)"""
+    out = open(path, "w", newline="") if path else click.get_text_stream("stdout")
+    try:
+        for chunk in iter_tile_export(fmt):
+            out.write(chunk)
+    finally:
+        if path:
+            out.close()
+
+
+# ============= BULK USER ASSIGNMENT =============
+# Users are distributed over tiles by proximity without exceeding each tile's
+# capacity (counted in assigned users). Each user's position is, in order:
+# the one supplied with the request, the last recorded fix, or the centre of
+# the region. Greedy nearest-first: every user's k nearest tiles (from the
+# spatial index) go on one heap of (distance, user, tile); the globally
+# closest pairs are taken while the tile has room, and users left over once
+# their candidates are full retry with a larger k. user_data.txt is written
+# once, only if every requested user is valid.
+ASSIGNMENT_CANDIDATES = 8
+
+def parse_bbox(value):
+    """(min_lat, min_lon, max_lat, max_lon) from "a,b,c,d" or a 4-item list.
+    Raises ValueError for malformed, non-finite or out-of-range boxes."""
+    try:
+        parts = value.split(",") if isinstance(value, str) else list(value)
+        min_lat, min_lon, max_lat, max_lon = [float(v) for v in parts]
+    except (TypeError, ValueError):
+        raise ValueError("bbox must be minLat,minLon,maxLat,maxLon")
+    if not all(math.isfinite(v) for v in (min_lat, min_lon, max_lat, max_lon)):
+        raise ValueError("bbox values must be finite numbers")
+    if min_lat < -90 or max_lat > 90 or min_lon < -180 or max_lon > 180:
+        raise ValueError("bbox must lie within latitudes -90..90 and longitudes -180..180")
+    if min_lat > max_lat or min_lon > max_lon:
+        raise ValueError("bbox minimums must not exceed maximums")
+    return min_lat, min_lon, max_lat, max_lon
+
+def last_known_position(username):
+    records = recent_user_records(username, 1)
+    return record_position(records[0]) if records else None
+
+def greedy_assign(positions, index, remaining):
+    """{username: (tile_id, distance_km)} for users placed within capacity.
+    positions: {username: (lat, lon)}; remaining: {tile_id: free slots}, updated in place."""
+    assignments = {}
+    pending = sorted(positions)
+    k = min(ASSIGNMENT_CANDIDATES, len(index.tiles))
+    while pending and k and any(remaining.values()):
+        heap = []
+        for username in pending:
+            lat, lon = positions[username]
+            for distance, tile_id in index.nearest(lat, lon, k):
+                if remaining[tile_id] > 0:
+                    heap.append((distance, username, tile_id))
+        heapq.heapify(heap)
+        while heap:
+            distance, username, tile_id = heapq.heappop(heap)
+            if username not in assignments and remaining[tile_id] > 0:
+                assignments[username] = (tile_id, distance)
+                remaining[tile_id] -= 1
+        pending = [username for username in pending if username not in assignments]
+        if k >= len(index.tiles):
+            break
+        k = min(k * 4, len(index.tiles))
+    return assignments
+
+def tile_free_slots(tiles, user_data, moving):
+    """Free slots per tile, not counting users in `moving` (about to be (re)assigned)"""
+    remaining = {tile_id: tile["capacity"] for tile_id, tile in tiles.items()}
+    for username in user_data:
+        tile_id = user_data[username].get("assigned_location")
+        if tile_id in remaining and username not in moving:
+            remaining[tile_id] -= 1
+    return {tile_id: max(free, 0) for tile_id, free in remaining.items()}
+
+def assignment_summary(result, positions, assignments):
+    """Fill in the counts of an assign_users_to_tiles result"""
+    result.update({
+        "requested": len(positions),
+        "assigned": len(assignments),
+        "unassigned": sorted(set(positions) - set(assignments) - set(result["skipped_already_assigned"])),
+        "mean_distance_km": round(sum(d for _, d in assignments.values()) / len(assignments), 3) if assignments else None,
+        "assignments": {username: tile_id for username, (tile_id, _) in assignments.items()}
+    })
+    return result
+
+def assign_users_to_tiles(users=None, bbox=None, reassign=False, dry_run=False):
+    """Assign a list of users (names or {"username", "lat", "lon"}), or with
+    users=None every unassigned user last seen inside bbox, to tiles."""
+    registered = load_users()
+    current = load_user_data_cached()
+    index = get_tile_index()
+    if bbox is not None:
+        index = TileSpatialIndex({tile_id: index.tiles[tile_id]
+                                  for tile_id in index.in_bbox(*bbox, limit=len(index.tiles))})
+    errors = []
+    positions = {}
+    skipped = []
+    if users is None:
+        if bbox is None:
+            raise ValueError("users or bbox required")
+        for username in registered:
+            user = current.get(username)
+            if user is not None and user["assigned_location"] not in (None, "", "None") and not reassign:
+                continue
+            position = last_known_position(username)
+            if position is not None and bbox[0] <= position[0] <= bbox[2] and bbox[1] <= position[1] <= bbox[3]:
+                positions[username] = position
+    else:
+        for row, entry in enumerate(users, 1):
+            if isinstance(entry, dict):
+                username = entry.get("username")
+                try:
+                    position = (float(entry["lat"]), float(entry["lon"])) if entry.get("lat") is not None else None
+                except (TypeError, ValueError):
+                    errors.append({"row": row, "username": username, "message": "Invalid lat/lon"})
+                    continue
+            else:
+                username, position = entry, None
+            if username not in registered:
+                errors.append({"row": row, "username": username, "message": "User not found"})
+                continue
+            user = current.get(username)
+            if user is not None and user["assigned_location"] not in (None, "", "None") and not reassign:
+                skipped.append(username)
+                continue
+            positions[username] = position or last_known_position(username)
+    
+    if bbox is not None:
+        fallback = ((bbox[0] + bbox[2]) / 2, (bbox[1] + bbox[3]) / 2)
+    elif index.tiles:
+        fallback = (sum(t["lat"] for t in index.tiles.values()) / len(index.tiles),
+                    sum(t["lon"] for t in index.tiles.values()) / len(index.tiles))
+    else:
+        fallback = (0.0, 0.0)
+    for username, position in positions.items():
+        if position is None:
+            positions[username] = fallback
+    
+    assignments = greedy_assign(positions, index, tile_free_slots(index.tiles, current, positions))
+    result = {"skipped_already_assigned": skipped, "errors": errors, "committed": False}
+    if errors or dry_run or not assignments:
+        return assignment_summary(result, positions, assignments)
+    
+    with user_data_lock():
+        # The plan was made without the lock: re-check it against the file,
+        # keeping the closest assignments where a tile has filled up since
+        user_data = load_user_data()
+        if not reassign:
+            for username in list(assignments):
+                if user_data.get(username, {}).get("assigned_location") not in (None, "", "None"):
+                    del assignments[username]
+                    skipped.append(username)
+        free = tile_free_slots(index.tiles, user_data, assignments)
+        for username, (tile_id, _) in sorted(assignments.items(), key=lambda item: item[1][1]):
+            if free[tile_id] > 0:
+                free[tile_id] -= 1
+            else:
+                del assignments[username]
+        for username, (tile_id, _) in assignments.items():
+            user_data.setdefault(username, new_user_record())["assigned_location"] = tile_id
+        if assignments:
+            save_user_data(user_data)
+    result["committed"] = bool(assignments)
+    return assignment_summary(result, positions, assignments)
+
+@bp.cli.command("assign-tiles")
+@click.argument("path", required=False, type=click.Path(exists=True, dir_okay=False))
+@click.option("--bbox", help="Region minLat,minLon,maxLat,maxLon: only its tiles are used; "
+                             "without PATH, assigns every unassigned user last seen inside it")
+@click.option("--reassign", is_flag=True, help="Also move users that already have a tile")
+@click.option("--dry-run", is_flag=True, help="Plan only, do not commit")
+def assign_tiles_command(path, bbox, reassign, dry_run):
+    """Bulk assign users to tiles by proximity and capacity. PATH lists one
+    user per line, optionally as username,lat,lon."""
+    users = None
+    if path:
+        users = []
+        with open(path, "r", newline="") as f:
+            for row in csv.reader(f):
+                if row and row[0].strip() and row[0].strip() != "username":
+                    users.append({"username": row[0].strip(), "lat": row[1], "lon": row[2]} if len(row) >= 3
+                                 else row[0].strip())
+    try:
+        result = assign_users_to_tiles(users, parse_bbox(bbox) if bbox else None, reassign, dry_run)
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    for error in result["errors"]:
+        click.echo(f"row {error['row']} ({error['username']}): {error['message']}", err=True)
+    click.echo(f"{result['requested']} users, {result['assigned']} assigned, {len(result['unassigned'])} without capacity, "
+               f"{len(result['skipped_already_assigned'])} already assigned, mean distance {result['mean_distance_km']} km, "
+               f"committed={result['committed']}")
+    if result["errors"]:
+        raise SystemExit(1)
+
+
+# ============= REWARD RECALCULATION =============
+# Recomputes every user's reward_points from the energy record history with
+# the current calculate_reward_points, e.g. after changing the conversion.
+# The logs are cut at their current length and split into byte ranges that
+# a process pool totals per user (a regex pulls username and electricity_wh
+# out of each line; ranges that do not match cleanly fall back to json).
+# The per-user totals are reduced, records appended while the pool ran are
+# added under the user data lock, and user_data.txt is swapped in one atomic
+# write. Users with no records keep their points. With sharded ingestion
+# (INGEST_SHARDS) records whose deltas are still pending would be counted
+# twice: a router in this process is merged first, otherwise committing is
+# refused unless forced (stop the server first - its shutdown merges).
+RECALC_CHUNK_BYTES = 64 * 1024 * 1024
+RECORD_ENERGY_PATTERN = re.compile(rb'"username": ("[^"\\]*(?:\\.[^"\\]*)*")[^\n]*"electricity_wh": ([-0-9.eE+]+)')
+
+def record_chunks(cut, chunk_bytes):
+    """[(path, start, end)] byte ranges covering each log up to its cut length"""
+    return [(path, start, min(start + chunk_bytes, size))
+            for path, size in cut.items() for start in range(0, size, chunk_bytes)]
+
+def total_record_chunk(task):
+    """Per-user [energy_wh, reward_points, records] for the lines that start in
+    [start, end) of a log. Returns (totals, bytes covered, records)."""
+    path, start, end = task
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            if start:
+                start = mapped.find(b"\n", start - 1) + 1 or len(mapped)
+            if end < len(mapped):
+                end = mapped.find(b"\n", end - 1) + 1 or len(mapped)
+            data = mapped[start:end] if end > start else b""
+    by_key = {}
+    records = 0
+    for match in RECORD_ENERGY_PATTERN.finditer(data):
+        energy = float(match.group(2))
+        totals = by_key.get(match.group(1))
+        if totals is None:
+            totals = by_key[match.group(1)] = [0.0, 0.0, 0]
+        totals[0] += energy
+        totals[1] += calculate_reward_points(energy)
+        totals[2] += 1
+        records += 1
+    if records != data.count(b'"username": '):
+        # Unexpected layout somewhere in this range - parse it properly
+        by_key = {}
+        records = 0
+        for line in data.splitlines():
+            if line.strip():
+                record = json.loads(line)
+                totals = by_key.setdefault(json.dumps(record["username"]).encode(), [0.0, 0.0, 0])
+                totals[0] += record["electricity_wh"]
+                totals[1] += calculate_reward_points(record["electricity_wh"])
+                totals[2] += 1
+                records += 1
+    totals = {(key[1:-1].decode() if b"\\" not in key else json.loads(key)): values
+              for key, values in by_key.items()}
+    return totals, task[2] - task[1], records
+
+def merge_record_totals(into, totals):
+    for username, (energy, points, count) in totals.items():
+        current = into.get(username)
+        if current is None:
+            into[username] = [energy, points, count]
+        else:
+            current[0] += energy
+            current[1] += points
+            current[2] += count
+
+def recalculate_rewards(processes=None, dry_run=False, chunk_bytes=RECALC_CHUNK_BYTES, progress=None, force=False):
+    """Recompute reward_points from the record history. progress(bytes done,
+    bytes total, records) is called as ranges finish. Returns a diff report
+    with every changed user under "changes"."""
+    if INGEST_SHARDS > 0 and not dry_run:
+        router = _ingest_router["router"] if _ingest_router["pid"] == os.getpid() else None
+        if router is not None:
+            router.merge()
+        elif not force:
+            raise RuntimeError("INGEST_SHARDS is set and shard deltas the server has not merged yet would be "
+                               "counted twice; stop the server first (it merges on shutdown) or force")
+    with user_data_lock():
+        cut = {}
+        for path in energy_record_logs():
+            try:
+                cut[path] = os.path.getsize(path)
+            except OSError:
+                pass
+    tasks = record_chunks(cut, chunk_bytes)
+    total_bytes = sum(cut.values())
+    totals = {}
+    done_bytes = 0
+    records = 0
+    
+    def collect(results):
+        nonlocal done_bytes, records
+        for chunk_totals, chunk_bytes_done, chunk_records in results:
+            merge_record_totals(totals, chunk_totals)
+            done_bytes += chunk_bytes_done
+            records += chunk_records
+            if progress:
+                progress(done_bytes, total_bytes, records)
+    
+    if len(tasks) > 1 and processes != 1:
+        with multiprocessing.Pool(processes) as pool:
+            collect(pool.imap_unordered(total_record_chunk, tasks))
+    else:
+        collect(map(total_record_chunk, tasks))
+    
+    with user_data_lock():
+        # Records appended while the pool was running
+        for path in energy_record_logs():
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                continue
+            if size > cut.get(path, 0):
+                collect([total_record_chunk((path, cut.get(path, 0), size))])
+        
+        user_data = load_user_data()
+        changes = []
+        energy_mismatches = 0
+        for username, (energy, points, _) in totals.items():
+            user = user_data.get(username)
+            before = user["reward_points"] if user is not None else 0
+            points = round(points, 2)
+            if user is not None and abs(user["total_energy_wh"] - energy) > 1e-6 * max(1.0, abs(energy)):
+                energy_mismatches += 1
+            if user is None or abs(before - points) > 0.005:
+                changes.append({
+                    "username": username,
+                    "before": before,
+                    "after": points,
+                    "delta": round(points - before, 2),
+                    "tier_before": get_tier(before),
+                    "tier_after": get_tier(points),
+                    "new_user": user is None
+                })
+        report = {
+            "records": records,
+            "users_with_records": len(totals),
+            "users_without_records": sum(1 for username in user_data if username not in totals),
+            "users_changed": len(changes),
+            "tier_changes": sum(1 for change in changes if change["tier_before"] != change["tier_after"]),
+            "points_delta": round(sum(change["delta"] for change in changes), 2),
+            "energy_mismatches": energy_mismatches,
+            "changes": sorted(changes, key=lambda change: -abs(change["delta"])),
+            "committed": False
+        }
+        if dry_run or not changes:
+            return report
+        for change in changes:
+            user = user_data.get(change["username"])
+            if user is None:
+                user = user_data[change["username"]] = new_user_record()
+                user["total_energy_wh"] = totals[change["username"]][0]
+            user["reward_points"] = change["after"]
+        save_user_data(user_data)
+    report["committed"] = True
+    return report
+
+@bp.cli.command("recalculate-rewards")
+@click.option("--processes", type=int, default=None, help="Worker processes (default: CPU count)")
+@click.option("--dry-run", is_flag=True, help="Report the differences without writing them")
+@click.option("--report", "report_path", type=click.Path(dir_okay=False, writable=True),
+              help="Write every per-user change to this CSV file")
+@click.option("--chunk-mb", type=int, default=RECALC_CHUNK_BYTES // (1024 * 1024), help="Record range per task")
+@click.option("--force", is_flag=True, help="Commit even though INGEST_SHARDS is set (the server is stopped)")
+def recalculate_rewards_command(processes, dry_run, report_path, chunk_mb, force):
+    """Recompute everyone's reward_points from the energy record history"""
+    started = time.monotonic()
+    
+    def progress(done, total, records):
+        elapsed = time.monotonic() - started
+        click.echo(f"\r{done / max(total, 1):6.1%} {done / 1e6:,.0f}/{total / 1e6:,.0f} MB, "
+                   f"{records:,} records, {records / max(elapsed, 1e-9):,.0f} records/s", nl=False, err=True)
+    
+    try:
+        report = recalculate_rewards(processes, dry_run, chunk_mb * 1024 * 1024, progress, force)
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    click.echo("", err=True)
+    if report_path:
+        with open(report_path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=["username", "before", "after", "delta", "tier_before", "tier_after", "new_user"])
+            writer.writeheader()
+            writer.writerows(report["changes"])
+    for change in report["changes"][:10]:
+        click.echo(f"  {change['username']}: {change['before']} -> {change['after']} ({change['delta']:+})")
+    click.echo(f"{report['records']:,} records, {report['users_with_records']:,} users with records, "
+               f"{report['users_changed']:,} changed ({report['tier_changes']:,} change tier, "
+               f"{report['points_delta']:+,} points), {report['energy_mismatches']:,} energy mismatches, "
+               f"committed={report['committed']} in {time.monotonic() - started:.1f}s")
+
+
+# ============= SHARDED INGESTION =============
+# With INGEST_SHARDS > 0, sensor readings are routed to a pool of worker
+# processes partitioned by tile_id on a consistent hash ring. Each shard
+# appends to its own record segment and keeps its tiles' running state plus
+# pending per-user deltas; the merge layer folds those deltas into
+# user_data.txt with one write per SHARD_MERGE_INTERVAL. The pool belongs to
+# the process that starts it, so run gunicorn with one worker (and threads)
+# in this mode.
+INGEST_SHARDS = int(os.environ.get("INGEST_SHARDS", "0"))
+SHARD_DIR = "shards"
+SHARD_MERGE_INTERVAL = float(os.environ.get("SHARD_MERGE_INTERVAL", "2.0"))
+SHARD_BATCH_SIZE = 256
+SHARD_REPLY_TIMEOUT = 10.0  # seconds to wait for a shard to answer a control message
+
+class ConsistentHashRing:
+    """Consistent hash ring with virtual nodes; adding or removing a node
+    only moves the keys that node owns"""
+
+    def __init__(self, nodes=(), replicas=64):
+        self.replicas = replicas
+        self._hashes = []
+        self._owners = {}
+        for node in nodes:
+            self.add_node(node)
+
+    @staticmethod
+    def _hash(key):
+        return int.from_bytes(hashlib.md5(str(key).encode()).digest()[:8], "big")
+
+    def add_node(self, node):
+        for i in range(self.replicas):
+            h = self._hash(f"{node}#{i}")
+            self._owners[h] = node
+            bisect.insort(self._hashes, h)
+
+    def remove_node(self, node):
+        for i in range(self.replicas):
+            h = self._hash(f"{node}#{i}")
+            if self._owners.pop(h, None) is not None:
+                self._hashes.remove(h)
+
+    def node_for(self, key):
+        if not self._hashes:
+            raise LookupError("Hash ring has no nodes")
+        i = bisect.bisect(self._hashes, self._hash(key)) % len(self._hashes)
+        return self._owners[self._hashes[i]]
+
+def shard_segment_path(shard_id):
+    """Record segment owned by one ingest shard"""
+    return os.path.join(SHARD_DIR, f"energy_records.shard-{shard_id}.txt")
+
+def new_pending_deltas():
+    """Empty accumulator of per-user deltas awaiting merge"""
+    return {"add": {}, "set": {}, "max": {}}
+
+def apply_user_deltas(pending, seq, deltas):
+    """Fold one reading's deltas into a pending-delta dict. "add" fields
+    accumulate, "set" fields keep the value with the highest seq and
+    "max" fields keep the largest value."""
+    for field, value in deltas.get("add", {}).items():
+        pending["add"][field] = pending["add"].get(field, 0) + value
+    for field, value in deltas.get("set", {}).items():
+        if field not in pending["set"] or pending["set"][field][0] < seq:
+            pending["set"][field] = (seq, value)
+    for field, value in deltas.get("max", {}).items():
+        pending["max"][field] = max(pending["max"].get(field, value), value)
+
+def combine_pending_deltas(target, pending):
+    """Fold one pending-delta dict into another"""
+    for field, value in pending["add"].items():
+        target["add"][field] = target["add"].get(field, 0) + value
+    for field, (seq, value) in pending["set"].items():
+        apply_user_deltas(target, seq, {"set": {field: value}})
+    apply_user_deltas(target, 0, {"max": pending["max"]})
+
+def combine_user_deltas(target, user_deltas):
+    """Fold {username: pending deltas} into another such dict"""
+    for username, pending in user_deltas.items():
+        combine_pending_deltas(target.setdefault(username, new_pending_deltas()), pending)
+
+def apply_pending_to_user(user, pending):
+    """Apply a pending-delta dict to a user_data entry"""
+    for field, value in pending["add"].items():
+        user[field] = user.get(field, 0) + value
+    for field, (_, value) in pending["set"].items():
+        user[field] = value
+    for field, value in pending["max"].items():
+        user[field] = max(user.get(field, 0), value)
+
+def run_ingest_shard(shard_id, inbox, outbox):
+    """Shard worker loop. Owns its record segment, the running state of the
+    tiles hashed to it, and the per-user deltas not yet merged."""
+    os.makedirs(SHARD_DIR, exist_ok=True)
+    tile_state = {}
+    user_deltas = {}
+    with open(shard_segment_path(shard_id), "a") as segment:
+        running = True
+        while running:
+            batch = [inbox.get()]
+            while len(batch) < SHARD_BATCH_SIZE:
+                try:
+                    batch.append(inbox.get_nowait())
+                except queue.Empty:
+                    break
+            
+            lines = []
+            for message in batch:
+                kind = message[0]
+                if kind == "reading":
+                    _, seq, username, record, deltas = message
+                    if record is not None:
+                        lines.append(json.dumps(record) + "\n")
+                        tile = tile_state.setdefault(record["tile_id"], {"energy_wh": 0.0, "readings": 0})
+                        tile["energy_wh"] += record["electricity_wh"]
+                        tile["readings"] += 1
+                    pending = user_deltas.setdefault(username, new_pending_deltas())
+                    apply_user_deltas(pending, seq, deltas)
+                    continue
+                
+                # Control messages see every reading queued before them
+                if lines:
+                    segment.write("".join(lines))
+                    segment.flush()
+                    lines = []
+                if kind == "drain":
+                    outbox.put(("deltas", shard_id, user_deltas))
+                    user_deltas = {}
+                elif kind == "release":
+                    released = {tile_id: tile_state.pop(tile_id) for tile_id in message[1] if tile_id in tile_state}
+                    outbox.put(("released", shard_id, released))
+                elif kind == "adopt":
+                    for tile_id, state in message[1].items():
+                        tile = tile_state.setdefault(tile_id, {"energy_wh": 0.0, "readings": 0})
+                        tile["energy_wh"] += state["energy_wh"]
+                        tile["readings"] += state["readings"]
+                elif kind == "retain":
+                    for tile_id in list(tile_state):
+                        if tile_id not in message[1]:
+                            del tile_state[tile_id]
+                elif kind == "stats":
+                    outbox.put(("stats", shard_id, {"tiles": tile_state, "pending_users": len(user_deltas)}))
+                elif kind == "stop":
+                    outbox.put(("stopped", shard_id, (user_deltas, tile_state)))
+                    running = False
+                    break
+            
+            if lines:
+                segment.write("".join(lines))
+                segment.flush()
+
+class IngestRouter:
+    """Routes readings to shard processes by tile_id and merges their per-user deltas.
+    `mirror` holds deltas accepted since the last drain; `unmerged` holds
+    drained deltas until they are saved, so a failed save is retried by the
+    next merge and reads see both in the meantime."""
+
+    def __init__(self, num_shards):
+        self.ctx = multiprocessing.get_context("fork")
+        self.outbox = self.ctx.Queue()
+        self.shards = {}
+        self.ring = ConsistentHashRing()
+        self.lock = threading.Lock()
+        self.merge_lock = threading.Lock()  # one merge at a time; taken before self.lock
+        self.seq = itertools.count(1)
+        self.mirror = {}
+        self.unmerged = {}
+        self.leftovers = {}  # deltas of stopped shards, still covered by mirror
+        self.tile_key = None
+        self.merges = 0
+        for shard_id in range(num_shards):
+            self._start_shard(shard_id)
+        self._stop = threading.Event()
+        self._merger = threading.Thread(target=self._merge_loop, name="shard-merger", daemon=True)
+        self._merger.start()
+
+    def _start_shard(self, shard_id):
+        inbox = self.ctx.Queue()
+        process = self.ctx.Process(target=run_ingest_shard, args=(shard_id, inbox, self.outbox),
+                                   name=f"ingest-shard-{shard_id}", daemon=True)
+        process.start()
+        self.shards[shard_id] = (process, inbox)
+        self.ring.add_node(shard_id)
+
+    def _ask(self, shard_ids, message):
+        """Send a control message to shards and collect one reply from each.
+        Raises RuntimeError if a shard has exited or does not answer within
+        SHARD_REPLY_TIMEOUT; call with self.lock held."""
+        for shard_id in shard_ids:
+            self.shards[shard_id][1].put(message)
+        replies = {}
+        deadline = time.monotonic() + SHARD_REPLY_TIMEOUT
+        while len(replies) < len(shard_ids):
+            try:
+                kind, shard_id, payload = self.outbox.get(timeout=0.5)
+            except queue.Empty:
+                waiting = [shard_id for shard_id in shard_ids if shard_id not in replies]
+                dead = [shard_id for shard_id in waiting if not self.shards[shard_id][0].is_alive()]
+                if dead:
+                    raise RuntimeError(f"Ingest shard {dead[0]} has exited")
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"Ingest shards {waiting} did not answer {message[0]!r}")
+                continue
+            if shard_id not in shard_ids or shard_id in replies:
+                # Late answer to an earlier request that timed out
+                if kind == "deltas":
+                    combine_user_deltas(self.leftovers, payload)
+                continue
+            replies[shard_id] = payload
+        return replies
+
+    def queue_depth(self):
+        """Readings waiting in shard inboxes (approximate)"""
+        depth = 0
+        for _, inbox in self.shards.values():
+            try:
+                depth += inbox.qsize()
+            except NotImplementedError:
+                pass
+        return depth
+
+    def submit(self, route_key, username, record, deltas):
+        """Queue a reading on the shard that owns route_key (normally its tile_id)"""
+        with self.lock:
+            self._check_tiles()
+            seq = next(self.seq)
+            apply_user_deltas(self.mirror.setdefault(username, new_pending_deltas()), seq, deltas)
+            shard_id = self.ring.node_for(route_key)
+            self.shards[shard_id][1].put(("reading", seq, username, record, deltas))
+
+    def pending_for(self, username):
+        """Deltas for username accepted but not yet merged into user_data.txt"""
+        with self.lock:
+            combined = new_pending_deltas()
+            for deltas in (self.unmerged, self.mirror):
+                if username in deltas:
+                    combine_pending_deltas(combined, deltas[username])
+            return combined
+
+    def _check_tiles(self):
+        """Let shards drop state for tiles removed from the registry"""
+        key = get_tile_registry_key()
+        if key != self.tile_key:
+            self.tile_key = key
+            live = set(load_energy_tiles())
+            for _, inbox in self.shards.values():
+                inbox.put(("retain", live))
+
+    def resize(self, num_shards):
+        """Grow or shrink the pool, handing moved tiles' state to their new owners.
+        Stopped shards' deltas are saved by the next merge."""
+        with self.lock:
+            tile_ids = list(load_energy_tiles())
+            old_owner = {tile_id: self.ring.node_for(tile_id) for tile_id in tile_ids}
+            for shard_id in range(len(self.shards), num_shards):
+                self._start_shard(shard_id)
+            for shard_id in sorted(self.shards):
+                if shard_id >= num_shards:
+                    self.ring.remove_node(shard_id)
+                    deltas, tiles = self._ask([shard_id], ("stop",))[shard_id]
+                    self.shards.pop(shard_id)[0].join(timeout=5)
+                    combine_user_deltas(self.leftovers, deltas)
+                    for tile_id, state in tiles.items():
+                        self.shards[self.ring.node_for(tile_id)][1].put(("adopt", {tile_id: state}))
+            moves = {}
+            for tile_id in tile_ids:
+                new_owner = self.ring.node_for(tile_id)
+                if old_owner[tile_id] != new_owner and old_owner[tile_id] in self.shards:
+                    moves.setdefault(old_owner[tile_id], []).append(tile_id)
+            for shard_id, moved in moves.items():
+                released = self._ask([shard_id], ("release", moved))[shard_id]
+                for tile_id, state in released.items():
+                    self.shards[self.ring.node_for(tile_id)][1].put(("adopt", {tile_id: state}))
+
+    def merge(self):
+        """Fold every shard's pending deltas into user_data.txt in a single write.
+        Only the drain holds self.lock; readings keep flowing during the write."""
+        with self.merge_lock:
+            with self.lock:
+                replies = self._ask(list(self.shards), ("drain",))
+                self._take_drained(replies.values())
+            self._save_unmerged()
+
+    def _take_drained(self, drained):
+        """Move drained deltas (which mirror covered until now) to unmerged"""
+        for user_deltas in drained:
+            combine_user_deltas(self.unmerged, user_deltas)
+        combine_user_deltas(self.unmerged, self.leftovers)
+        self.leftovers = {}
+        self.mirror = {}
+
+    def _save_unmerged(self):
+        """Write unmerged deltas; on failure they stay queued for the next merge"""
+        if not self.unmerged:
+            return
+        with user_data_lock():
+            user_data = load_user_data()
+            for username, pending in self.unmerged.items():
+                apply_pending_to_user(user_data.setdefault(username, new_user_record()), pending)
+            save_user_data(user_data)
+        with self.lock:
+            self.unmerged = {}
+        self.merges += 1
+
+    def stats(self):
+        with self.lock:
+            replies = self._ask(list(self.shards), ("stats",))
+        return {
+            "shards": {str(shard_id): replies[shard_id] for shard_id in sorted(replies)},
+            "queue_depth": self.queue_depth(),
+            "merges": self.merges
+        }
+
+    def _merge_loop(self):
+        while not self._stop.wait(SHARD_MERGE_INTERVAL):
+            try:
+                self.merge()
+            except Exception as e:
+                print(f"Shard Merge Error: {e}")
+
+    def shutdown(self):
+        self._stop.set()
+        with self.merge_lock:
+            with self.lock:
+                replies = self._ask(list(self.shards), ("stop",))
+                self._take_drained(deltas for deltas, _ in replies.values())
+                for process, _ in self.shards.values():
+                    process.join(timeout=5)
+                self.shards = {}
+            self._save_unmerged()
+
+_ingest_router = {"router": None, "pid": None}
+_ingest_router_lock = threading.Lock()
+
+def get_ingest_router():
+    """Shard router for this process, started on first use; None when sharding is off"""
+    if INGEST_SHARDS <= 0:
+        return None
+    if _ingest_router["pid"] != os.getpid():
+        with _ingest_router_lock:
+            if _ingest_router["pid"] != os.getpid():
+                _ingest_router["router"] = IngestRouter(INGEST_SHARDS)
+                _ingest_router["pid"] = os.getpid()
+                atexit.register(_ingest_router["router"].shutdown)
+    return _ingest_router["router"]
+
+def merged_user_totals(username, user):
+    """User totals including readings still pending in ingest shards"""
+    router = get_ingest_router()
+    if router is None:
+        return user
+    merged = dict(user)
+    apply_pending_to_user(merged, router.pending_for(username))
+    return merged
+
+
+# ============= FOOTSTEP PHYSICS =============
+# Sensors may post raw piezo samples per footstep instead of a precomputed
+# electricity_wh. Energy is the trapezoidal integral of instantaneous power
+# over each footstep; without a current trace, power is taken from the
+# voltage across the harvester load, P = V^2 / R. Uses numpy when installed.
+PIEZO_LOAD_OHMS = float(os.environ.get("PIEZO_LOAD_OHMS", "1000"))
+MAX_SAMPLES_PER_REQUEST = 200000
+
+def integrate_footstep_wh(voltage, current=None, sample_rate_hz=1000.0, load_ohms=PIEZO_LOAD_OHMS):
+    """Energy in Wh of one footstep from voltage (V) and optional current (A) samples"""
+    if len(voltage) < 2:
+        return 0.0
+    dt = 1.0 / sample_rate_hz
+    numpy = optional_numpy()
+    if numpy is not None:
+        v = numpy.asarray(voltage, dtype=float)
+        power = v * numpy.asarray(current, dtype=float) if current is not None else v * v / load_ohms
+        joules = (float(power.sum()) - 0.5 * (power[0] + power[-1])) * dt
+    else:
+        if current is not None:
+            total = math.fsum(map(operator.mul, voltage, current))
+            ends = voltage[0] * current[0] + voltage[-1] * current[-1]
+        else:
+            total = math.fsum(map(operator.mul, voltage, voltage)) / load_ohms
+            ends = (voltage[0] ** 2 + voltage[-1] ** 2) / load_ohms
+        joules = (total - 0.5 * ends) * dt
+    return joules / 3600.0
+
+def summarize_footsteps(footsteps, sample_rate_hz, load_ohms=PIEZO_LOAD_OHMS):
+    """Integrate a batch of footsteps. Returns (electricity_wh, aggregate deltas):
+    pressure_given accumulates each footstep's peak pressure, voltage and
+    ampere keep the highest peak seen."""
+    if sample_rate_hz <= 0:
+        raise ValueError("sample_rate_hz must be positive")
+    if sum(len(footstep.get("voltage") or ()) for footstep in footsteps) > MAX_SAMPLES_PER_REQUEST:
+        raise ValueError(f"At most {MAX_SAMPLES_PER_REQUEST} samples per request")
+    
+    electricity_wh = 0.0
+    pressure_given = 0.0
+    peak_voltage = 0.0
+    peak_ampere = 0.0
+    for footstep in footsteps:
+        voltage = footstep.get("voltage") or []
+        current = footstep.get("current")
+        if current is not None and len(current) != len(voltage):
+            raise ValueError("current and voltage must have the same number of samples")
+        electricity_wh += integrate_footstep_wh(voltage, current, sample_rate_hz, load_ohms)
+        if footstep.get("pressure"):
+            pressure_given += max(footstep["pressure"])
+        if voltage:
+            step_voltage = max(max(voltage), -min(voltage))
+            peak_voltage = max(peak_voltage, step_voltage)
+            if current:
+                peak_ampere = max(peak_ampere, max(current), -min(current))
+            else:
+                peak_ampere = max(peak_ampere, step_voltage / load_ohms)
+    return electricity_wh, {
+        "add": {"pressure_given": pressure_given},
+        "max": {"voltage": peak_voltage, "ampere": peak_ampere}
+    }
+
+
+# ============= SENSOR INGESTION PIPELINE =============
+# /api/iot-sensor, /add-energy and /api/submit-sensor-data are thin adapters
+# over one staged pipeline: decode -> validate -> geo-match -> reward ->
+# persist. Stages are plain functions over a reading dict, and persistence
+# goes through a pluggable backend: direct writes (default), group commit
+# (INGEST_BACKEND=batch) or the tile shards (INGEST_SHARDS > 0).
+INGEST_BACKEND = os.environ.get("INGEST_BACKEND", "direct")
+GROUP_COMMIT_MAX_BATCH = 512
+GROUP_COMMIT_MAX_DELAY = 0.005  # seconds a commit waits for the batch to fill
+
+class IngestError(Exception):
+    """Reading rejected by a pipeline stage. `reason` is a stable code the
+    endpoint adapters can map to their own messages."""
+
+    def __init__(self, reason, message=None, status=400, headers=None):
+        super().__init__(message or reason)
+        self.reason = reason
+        self.message = message or reason
+        self.status = status
+        self.headers = headers or {}
+
+def decode_iot_payload(data):
+    """/api/iot-sensor: reading for an explicit tile"""
+    return {
+        "username": data.get("username"),
+        "tile_id": data.get("tile_id"),
+        "electricity_wh": float(data.get("electricity_wh", 0)),
+        "latitude": data.get("latitude"),
+        "longitude": data.get("longitude"),
+        "total_steps": None,
+        "count_tile_visit": False,
+        "match_assigned_tile": False
+    }
+
+def decode_add_energy_payload(data):
+    """/add-energy: reading for the tile picked in the UI, counts a tile visit"""
+    return {
+        "username": data.get("username"),
+        "tile_id": data.get("selectedTile"),
+        "electricity_wh": float(data.get("electricity", 0)),
+        "latitude": data.get("latitude"),
+        "longitude": data.get("longitude"),
+        "total_steps": None,
+        "count_tile_visit": True,
+        "match_assigned_tile": False
+    }
+
+def decode_sensor_payload(data):
+    """/api/submit-sensor-data: hardware fix matched against the user's assigned tile"""
+    return {
+        "username": data.get("username"),
+        "tile_id": None,
+        "electricity_wh": float(data.get("electricity_wh", 0)),
+        "latitude": float(data.get("latitude", 0)),
+        "longitude": float(data.get("longitude", 0)),
+        "total_steps": int(data.get("total_steps", 0)),
+        "count_tile_visit": False,
+        "match_assigned_tile": True
+    }
+
+def decode_footstep_payload(data):
+    """/api/footstep-samples: raw piezo samples for an explicit tile"""
+    footsteps = data.get("footsteps") or []
+    electricity_wh, extra_deltas = summarize_footsteps(footsteps, float(data.get("sample_rate_hz", 1000)))
+    return {
+        "username": data.get("username"),
+        "tile_id": data.get("tile_id"),
+        "electricity_wh": electricity_wh,
+        "latitude": data.get("latitude"),
+        "longitude": data.get("longitude"),
+        "total_steps": None,
+        "count_tile_visit": False,
+        "match_assigned_tile": False,
+        "footsteps": len(footsteps),
+        "extra_deltas": extra_deltas
+    }
+
+SENSOR_DECODERS = {
+    "iot": decode_iot_payload,
+    "footsteps": decode_footstep_payload,
+    "add_energy": decode_add_energy_payload,
+    "sensor": decode_sensor_payload
+}
+
+def decode_stage(reading, pipeline):
+    payload = reading.pop("payload")
+    reading.update(SENSOR_DECODERS[reading["source"]](payload))
+    # Optional client-supplied identity used to drop retried readings
+    reading["device_id"] = payload.get("device_id")
+    reading["reading_id"] = payload.get("reading_id", payload.get("seq"))
+
+def validate_stage(reading, pipeline):
+    if not reading["username"]:
+        raise IngestError("missing_fields")
+    if not reading["match_assigned_tile"] and not reading["tile_id"]:
+        raise IngestError("missing_fields")
+
+class DedupWindow:
+    """Recently seen reading ids, expired after a time window, in a fixed-size
+    hash table on anonymous shared memory (like TokenBucketLimiter). Created
+    at import time, so with `gunicorn --preload` a retry is recognised by
+    whichever worker it reaches; otherwise each worker deduplicates on its own.
+    Each slot holds the outcome of the original reading, for retries to replay."""
+
+    SLOT = struct.Struct("<QdII")  # key hash, expires (monotonic), state, summary length
+    SLOT_SIZE = 512
+    SUMMARY_BYTES = SLOT_SIZE - SLOT.size
+    CLAIMED, DONE = 1, 2
+    PROBES = 8
+
+    def __init__(self, window_seconds, slots):
+        self.window_seconds = window_seconds
+        self.slots = slots
+        self.table = mmap.mmap(-1, self.SLOT_SIZE * slots)
+        self.lock = multiprocessing.Lock()
+
+    def _key_hash(self, device, reading_id):
+        key = f"{device}|{reading_id}".encode()
+        return int.from_bytes(hashlib.blake2b(key, digest_size=8).digest(), "big") or 1
+
+    def _find(self, key_hash):
+        """Offset of key_hash's slot, or None; call with self.lock held"""
+        home = key_hash % self.slots
+        for probe in range(self.PROBES):
+            offset = ((home + probe) % self.slots) * self.SLOT_SIZE
+            if self.SLOT.unpack_from(self.table, offset)[0] == key_hash:
+                return offset
+        return None
+
+    def claim(self, device, reading_id):
+        """Claim an id for a new reading. Returns True if the id is new,
+        False if an earlier reading with that id is in flight or done."""
+        key_hash = self._key_hash(device, reading_id)
+        now = time.monotonic()
+        with self.lock:
+            home = key_hash % self.slots
+            target, oldest = None, None
+            for probe in range(self.PROBES):
+                offset = ((home + probe) % self.slots) * self.SLOT_SIZE
+                slot_hash, expires, state, _ = self.SLOT.unpack_from(self.table, offset)
+                if slot_hash == key_hash and expires >= now:
+                    return False
+                if slot_hash == key_hash or slot_hash == 0 or expires < now:
+                    target = target if target is not None else offset
+                elif oldest is None or expires < oldest[1]:
+                    oldest = (offset, expires)
+            if target is None:
+                # Probe window full of live ids - recycle the one closest to expiry
+                target = oldest[0]
+            self.SLOT.pack_into(self.table, target, key_hash, now + self.window_seconds, self.CLAIMED, 0)
+            return True
+
+    def complete(self, device, reading_id, summary):
+        """Store the outcome of a claimed reading for retries to replay. An
+        outcome too large for a slot is not stored; retries then get a 409."""
+        blob = json.dumps(summary).encode()
+        if len(blob) > self.SUMMARY_BYTES:
+            blob = b""
+        with self.lock:
+            offset = self._find(self._key_hash(device, reading_id))
+            if offset is not None:
+                slot_hash, expires, _, _ = self.SLOT.unpack_from(self.table, offset)
+                self.table[offset + self.SLOT.size:offset + self.SLOT.size + len(blob)] = blob
+                self.SLOT.pack_into(self.table, offset, slot_hash, expires, self.DONE, len(blob))
+
+    def release(self, device, reading_id):
+        """Forget a claimed id whose reading failed, so a retry is processed"""
+        with self.lock:
+            offset = self._find(self._key_hash(device, reading_id))
+            if offset is not None:
+                self.SLOT.pack_into(self.table, offset, 0, 0.0, 0, 0)
+
+    def outcome(self, device, reading_id, timeout):
+        """Wait up to `timeout` for the original reading to finish. Returns
+        (done, summary); summary is None if it was not stored."""
+        key_hash = self._key_hash(device, reading_id)
+        deadline = time.monotonic() + timeout
+        while True:
+            with self.lock:
+                offset = self._find(key_hash)
+                if offset is None:
+                    return False, None  # the original failed and was released
+                _, _, state, length = self.SLOT.unpack_from(self.table, offset)
+                if state == self.DONE:
+                    start = offset + self.SLOT.size
+                    return True, json.loads(self.table[start:start + length]) if length else None
+            if time.monotonic() >= deadline:
+                return False, None
+            time.sleep(0.01)
+
+DEDUP_WINDOW_SECONDS = 600
+DEDUP_SLOTS = int(os.environ.get("DEDUP_SLOTS", "65536"))  # 512 bytes each
+DEDUP_WAIT_SECONDS = 5
+DEDUP_SUMMARY_FIELDS = ("username", "electricity_wh", "reward_points", "credited",
+                        "location_match", "total_steps", "quarantined")
+
+INGEST_DEDUP = DedupWindow(DEDUP_WINDOW_SECONDS, DEDUP_SLOTS)
+
+def dedup_summary(reading):
+    """What a retry needs to rebuild the original response, kept small enough for a slot"""
+    summary = {field: reading.get(field) for field in DEDUP_SUMMARY_FIELDS}
+    tile, user = reading.get("tile"), reading.get("user")
+    summary["tile"] = {"name": tile["name"]} if tile else None
+    summary["user"] = ({"total_energy_wh": user["total_energy_wh"], "reward_points": user["reward_points"]}
+                       if user else None)
+    return summary
+
+def dedup_stage(reading, pipeline):
+    """Turn a retried reading (same device and reading_id/seq) into a no-op that
+    replays the original outcome"""
+    if reading["reading_id"] is None:
+        return
+    device = str(reading["device_id"] or reading["username"])
+    # Keyed per endpoint too: a replayed summary only fits the response shape it came from
+    reading_id = f"{reading['source']}:{reading['reading_id']}"
+    if INGEST_DEDUP.claim(device, reading_id):
+        reading["on_success"].append(lambda r: INGEST_DEDUP.complete(device, reading_id, dedup_summary(r)))
+        reading["on_failure"].append(lambda r: INGEST_DEDUP.release(device, reading_id))
+        return
+    
+    # Retry of a reading that is in flight (possibly on another worker) or done
+    done, summary = INGEST_DEDUP.outcome(device, reading_id, DEDUP_WAIT_SECONDS)
+    if not done:
+        raise IngestError("duplicate_in_flight", "Reading is already being processed", status=409)
+    if summary is None:
+        raise IngestError("duplicate", "Reading was already processed", status=409)
+    reading.update(summary)
+    reading["duplicate"] = True
+    reading["done"] = True
+
+class TokenBucketLimiter:
+    """Token buckets in a fixed-size hash table on anonymous shared memory.
+    Created at import time, so with `gunicorn --preload` every forked worker
+    shares the same buckets; otherwise each worker limits on its own."""
+
+    SLOT = struct.Struct("<Qdd")  # key hash, tokens, last refill (monotonic)
+    PROBES = 8
+
+    def __init__(self, rate, burst, slots=65536):
+        self.rate = rate
+        self.burst = burst
+        self.slots = slots
+        self.table = mmap.mmap(-1, self.SLOT.size * slots)
+        self.lock = multiprocessing.Lock()
+
+    def _key_hash(self, key):
+        return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big") or 1
+
+    def acquire(self, key, cost=1.0):
+        """Take `cost` tokens for key. Returns (allowed, retry_after_seconds)."""
+        key_hash = self._key_hash(key)
+        now = time.monotonic()
+        with self.lock:
+            home = key_hash % self.slots
+            target, oldest = None, None
+            for probe in range(self.PROBES):
+                offset = ((home + probe) % self.slots) * self.SLOT.size
+                slot_hash, tokens, updated = self.SLOT.unpack_from(self.table, offset)
+                if slot_hash == key_hash:
+                    target = offset
+                    tokens = min(self.burst, tokens + (now - updated) * self.rate)
+                    break
+                if slot_hash == 0 and target is None:
+                    target, tokens = offset, self.burst
+                    break
+                if oldest is None or updated < oldest[1]:
+                    oldest = (offset, updated)
+            if target is None:
+                # Probe window full - recycle the least recently used bucket
+                target, tokens = oldest[0], self.burst
+            if tokens >= cost:
+                self.SLOT.pack_into(self.table, target, key_hash, tokens - cost, now)
+                return True, 0
+            self.SLOT.pack_into(self.table, target, key_hash, tokens, now)
+            return False, (cost - tokens) / self.rate
+
+SENSOR_RATE_LIMIT = float(os.environ.get("SENSOR_RATE_LIMIT", "5"))  # readings/second per device and tile
+SENSOR_RATE_BURST = float(os.environ.get("SENSOR_RATE_BURST", "20"))
+INGEST_MAX_QUEUE_DEPTH = int(os.environ.get("INGEST_MAX_QUEUE_DEPTH", "5000"))
+
+SENSOR_RATE_LIMITER = TokenBucketLimiter(SENSOR_RATE_LIMIT, SENSOR_RATE_BURST)
+
+def backpressure_stage(reading, pipeline):
+    """Shed load before any work when the persistence backlog is too deep"""
+    if pipeline.backend.queue_depth() > INGEST_MAX_QUEUE_DEPTH:
+        raise IngestError("overloaded", "Ingestion is overloaded, retry shortly",
+                          status=503, headers={"Retry-After": "1"})
+
+def rate_limit_stage(reading, pipeline):
+    """Per device (or user) and tile token bucket"""
+    device = reading["device_id"] or reading["username"]
+    allowed, retry_after = SENSOR_RATE_LIMITER.acquire(f"{device}|{reading['tile_id'] or ''}")
+    if not allowed:
+        raise IngestError("rate_limited", "Too many readings from this device",
+                          status=429, headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+
+class EwmaStats:
+    """Exponentially weighted mean/variance of a reading stream plus the
+    EWMA of its step-to-step change. O(1) memory per tracked key; keys are
+    capped and the least recently updated are forgotten."""
+
+    def __init__(self, alpha, max_keys, min_spread=0.0):
+        self.alpha = alpha
+        self.max_keys = max_keys
+        self.min_spread = min_spread
+        self.state = OrderedDict()  # key -> [count, mean, variance, last value, mean abs change]
+        self.lock = threading.Lock()
+
+    def score(self, key, value):
+        """(count, z-score of value, z-score of the change from the last value)"""
+        with self.lock:
+            state = self.state.get(key)
+        if state is None:
+            return 0, 0.0, 0.0
+        count, mean, variance, last, change = state
+        # Floor the spread at a fraction of the mean, and absolutely, so steady
+        # (or all-zero) streams do not flag ordinary small variations
+        spread = math.sqrt(variance) + 0.1 * abs(mean) + self.min_spread + 1e-9
+        z = (value - mean) / spread
+        change_z = abs(value - last) / (change + spread)
+        return count, z, change_z
+
+    def update(self, key, value):
+        alpha = self.alpha
+        with self.lock:
+            state = self.state.get(key)
+            if state is None:
+                self.state[key] = [1, value, 0.0, value, 0.0]
+                if len(self.state) > self.max_keys:
+                    self.state.popitem(last=False)
+                return
+            self.state.move_to_end(key)
+            count, mean, variance, last, change = state
+            diff = value - mean
+            increment = alpha * diff
+            state[0] = count + 1
+            state[1] = mean + increment
+            state[2] = (1 - alpha) * (variance + diff * increment)
+            state[3] = value
+            state[4] = change + alpha * (abs(value - last) - change)
+
+ANOMALY_EWMA_ALPHA = 0.05
+ANOMALY_WARMUP = 20            # readings per key before statistical checks apply
+ANOMALY_Z_THRESHOLD = 8.0
+ANOMALY_CHANGE_THRESHOLD = 50.0  # jump vs. typical step-to-step change
+ANOMALY_MAX_READING_WH = float(os.environ.get("ANOMALY_MAX_READING_WH", "1000"))
+ANOMALY_MIN_SPREAD_WH = float(os.environ.get("ANOMALY_MIN_SPREAD_WH", "0.5"))
+ANOMALY_MAX_KEYS = 200000
+QUARANTINE_FILE = "quarantined_readings.txt"
+
+TILE_READING_STATS = EwmaStats(ANOMALY_EWMA_ALPHA, ANOMALY_MAX_KEYS, ANOMALY_MIN_SPREAD_WH)
+USER_READING_STATS = EwmaStats(ANOMALY_EWMA_ALPHA, ANOMALY_MAX_KEYS, ANOMALY_MIN_SPREAD_WH)
+
+def quarantine_reading(reading, reasons):
+    """Keep a flagged reading out of the credited totals, for admin review"""
+    with open(QUARANTINE_FILE, "a") as f:
+        f.write(json.dumps({
+            "timestamp": datetime.now().isoformat(),
+            "source": reading["source"],
+            "username": reading["username"],
+            "tile_id": reading["tile_id"],
+            "electricity_wh": reading["electricity_wh"],
+            "reasons": reasons
+        }) + "\n")
+
+def load_quarantined_readings(limit=200):
+    """Most recent quarantined readings, newest first"""
+    readings = []
+    try:
+        with open(QUARANTINE_FILE, "r") as f:
+            for line in f:
+                if line.strip():
+                    readings.append(json.loads(line))
+    except:
+        pass
+    return readings[::-1][:limit]
+
+def anomaly_stage(reading, pipeline):
+    """Flag absurd readings before they are credited. Readings are scored
+    against running statistics of their tile and of their user; only readings
+    that pass feed the statistics, so outliers cannot drag the baseline."""
+    if not reading["location_match"]:
+        return
+    value = reading["electricity_wh"]
+    reasons = []
+    if not math.isfinite(value):
+        reasons.append("not_finite")
+    elif value < 0:
+        reasons.append("negative")
+    elif value > ANOMALY_MAX_READING_WH:
+        reasons.append("above_max")
+    else:
+        for label, stats, key in (("tile", TILE_READING_STATS, reading["tile_id"]),
+                                  ("user", USER_READING_STATS, reading["username"])):
+            count, z, change_z = stats.score(key, value)
+            if count >= ANOMALY_WARMUP:
+                if z > ANOMALY_Z_THRESHOLD:
+                    reasons.append(f"{label}_outlier")
+                elif change_z > ANOMALY_CHANGE_THRESHOLD:
+                    reasons.append(f"{label}_spike")
+    if reasons:
+        reading["quarantined"] = True
+        quarantine_reading(reading, reasons)
+        return
+    if reading["match_assigned_tile"] and value <= 0:
+        return  # not credited by reward_stage, so not part of the baseline
+    TILE_READING_STATS.update(reading["tile_id"], value)
+    USER_READING_STATS.update(reading["username"], value)
+
+class TrajectoryMatcher:
+    """Streaming tile-presence check for walkers reporting noisy GPS fixes.
+    Per user it keeps the last few fixes in a ring buffer (with a running
+    count of those inside the tile) and an EWMA-smoothed position. A user is
+    present while the smoothed position or most recent fixes are on the tile,
+    and stays present until the smoothed position drifts well outside it.
+    A fix on the tile always matches; a fix just off it (within radius *
+    exit_factor) matches once the user has been present for the dwell time.
+    O(1) per fix; users are
+    capped and idle trajectories are forgotten."""
+
+    def __init__(self, window, dwell_seconds, max_gap_seconds, alpha, exit_factor, max_users):
+        self.window = window
+        self.dwell_seconds = dwell_seconds
+        self.max_gap_seconds = max_gap_seconds
+        self.alpha = alpha
+        self.exit_factor = exit_factor
+        self.max_users = max_users
+        self.users = OrderedDict()  # username -> trajectory state
+        self.lock = threading.Lock()
+
+    def new_state(self, tile_id, lat, lon):
+        return {"tile_id": tile_id, "fixes": deque(maxlen=self.window), "inside": 0,
+                "lat": lat, "lon": lon, "present_since": None, "last_seen": None}
+
+    def observe(self, username, tile_id, tile, lat, lon, now=None):
+        """Record a fix; returns (matched, dwell seconds)"""
+        now = time.monotonic() if now is None else now
+        radius_km = tile["radius"] * 111  # 1 degree ≈ 111 km
+        fix_km = calculate_distance(lat, lon, tile["lat"], tile["lon"])
+        fix_inside = fix_km < radius_km
+        with self.lock:
+            state = self.users.get(username)
+            if (state is None or state["tile_id"] != tile_id
+                    or now - state["last_seen"] > self.max_gap_seconds):
+                state = self.users[username] = self.new_state(tile_id, lat, lon)
+                if len(self.users) > self.max_users:
+                    self.users.popitem(last=False)
+            else:
+                self.users.move_to_end(username)
+            
+            fixes = state["fixes"]
+            if len(fixes) == fixes.maxlen:
+                state["inside"] -= fixes[0]
+            fixes.append(fix_inside)
+            state["inside"] += fix_inside
+            state["lat"] += self.alpha * (lat - state["lat"])
+            state["lon"] += self.alpha * (lon - state["lon"])
+            state["last_seen"] = now
+            
+            smoothed_km = calculate_distance(state["lat"], state["lon"], tile["lat"], tile["lon"])
+            mostly_inside = state["inside"] * 2 >= len(fixes)
+            if state["present_since"] is None:
+                if smoothed_km < radius_km or (fix_inside and mostly_inside):
+                    state["present_since"] = now
+            elif smoothed_km > radius_km * self.exit_factor and not mostly_inside:
+                state["present_since"] = None
+            dwell = now - state["present_since"] if state["present_since"] is not None else 0.0
+        if fix_inside:
+            return True, dwell
+        near = fix_km < radius_km * self.exit_factor
+        return near and state["present_since"] is not None and dwell >= self.dwell_seconds, dwell
+
+    def __len__(self):
+        return len(self.users)
+
+TRAJECTORY_MATCHING = os.environ.get("TRAJECTORY_MATCHING", "on") != "off"
+TRAJECTORY_WINDOW = 8             # recent fixes kept per user
+TRAJECTORY_DWELL_SECONDS = 20     # presence needed before an off-tile fix is credited
+TRAJECTORY_MAX_GAP_SECONDS = 120  # a longer silence starts a new trajectory
+TRAJECTORY_ALPHA = 0.3            # EWMA weight of the newest fix
+TRAJECTORY_EXIT_FACTOR = 1.5      # smoothed position must leave radius * factor to end presence
+TRAJECTORY_MAX_USERS = 100000
+
+TRAJECTORIES = TrajectoryMatcher(TRAJECTORY_WINDOW, TRAJECTORY_DWELL_SECONDS, TRAJECTORY_MAX_GAP_SECONDS,
+                                 TRAJECTORY_ALPHA, TRAJECTORY_EXIT_FACTOR, TRAJECTORY_MAX_USERS)
+
+def geo_match_stage(reading, pipeline):
+    """Resolve the tile (shared per-version registry cache) and check location"""
+    tiles = get_tile_index().tiles
+    if not reading["match_assigned_tile"]:
+        tile = tiles.get(reading["tile_id"])
+        if tile is None:
+            raise IngestError("invalid_tile")
+        reading["tile"] = tile
+        reading["location_match"] = True
+        return
+    
+    user = pipeline.backend.get_user(reading["username"]) or {}
+    assigned_location = user.get("assigned_location")
+    reading["assigned_location"] = assigned_location
+    reading["tile"] = tiles.get(assigned_location) if assigned_location else None
+    reading["location_match"] = False
+    if reading["tile"] is not None:
+        tile = reading["tile"]
+        if TRAJECTORY_MATCHING:
+            matched, reading["dwell_seconds"] = TRAJECTORIES.observe(
+                reading["username"], assigned_location, tile, reading["latitude"], reading["longitude"])
+        else:
+            # Check if hardware location is within tile radius
+            distance = calculate_distance(reading["latitude"], reading["longitude"], tile["lat"], tile["lon"])
+            matched = distance < (tile["radius"] * 111)  # 1 degree ≈ 111 km
+        if matched:
+            reading["location_match"] = True
+            reading["tile_id"] = assigned_location
+
+def reward_stage(reading, pipeline):
+    """Decide what is credited and build the energy record and user deltas"""
+    electricity_wh = reading["electricity_wh"]
+    credited = (reading["location_match"] and not reading.get("quarantined")
+                and (not reading["match_assigned_tile"] or electricity_wh > 0))
+    deltas = {"add": {}, "set": {}, "max": {}}
+    reading["credited"] = credited
+    reading["reward_points"] = 0
+    reading["record"] = None
+    if credited:
+        tile = reading["tile"]
+        lat, lon = reading["latitude"], reading["longitude"]
+        reading["reward_points"] = calculate_reward_points(electricity_wh)
+        reading["record"] = {
+            "timestamp": datetime.now().isoformat(),
+            "username": reading["username"],
+            "tile_id": reading["tile_id"],
+            "tile_name": tile["name"],
+            "location": {"lat": lat, "lon": lon} if reading["match_assigned_tile"] or (lat and lon) else {},
+            "electricity_wh": round(electricity_wh, 4),
+            "tile_lat": tile["lat"],
+            "tile_lon": tile["lon"]
+        }
+        if reading.get("footsteps") is not None:
+            # Single footsteps yield micro-Wh, keep the precision
+            reading["record"]["electricity_wh"] = round(electricity_wh, 8)
+            reading["record"]["footsteps"] = reading["footsteps"]
+        deltas["add"]["total_energy_wh"] = electricity_wh
+        deltas["add"]["reward_points"] = reading["reward_points"]
+        if reading["count_tile_visit"]:
+            deltas["add"]["tiles_visited"] = 1
+        for kind, fields in reading.get("extra_deltas", {}).items():
+            deltas[kind].update(fields)
+    if reading["total_steps"] is not None and (credited or reading["total_steps"] > 0):
+        deltas["set"]["total_steps"] = reading["total_steps"]
+    reading["deltas"] = deltas
+
+def persist_stage(reading, pipeline):
+    if reading["record"] is None and not any(reading["deltas"].values()):
+        reading["user"] = pipeline.backend.get_user(reading["username"])
+        return
+    reading["user"] = pipeline.backend.persist(reading)
+
+DEFAULT_INGEST_STAGES = [
+    ("backpressure", backpressure_stage),
+    ("decode", decode_stage),
+    ("validate", validate_stage),
+    ("rate_limit", rate_limit_stage),
+    ("dedup", dedup_stage),
+    ("geo_match", geo_match_stage),
+    ("anomaly", anomaly_stage),
+    ("reward", reward_stage),
+    ("persist", persist_stage)
+]
+
+def apply_deltas_to_user(user, deltas):
+    """Apply a reading's "add"/"set"/"max" deltas to a user_data entry"""
+    for field, value in deltas["add"].items():
+        user[field] = user.get(field, 0) + value
+    for field, value in deltas["set"].items():
+        user[field] = value
+    for field, value in deltas.get("max", {}).items():
+        user[field] = max(user.get(field, 0), value)
+
+class DirectBackend:
+    """Persist each reading as it arrives (one record append, one user_data rewrite)"""
+
+    def __init__(self):
+        self.in_flight = 0
+        self.in_flight_lock = threading.Lock()
+
+    def get_user(self, username):
+        return get_mapped_user_data().get(username)
+
+    def persist(self, reading):
+        with self.in_flight_lock:
+            self.in_flight += 1
+        try:
+            with user_data_lock():
+                if reading["record"] is not None:
+                    save_energy_record(reading["record"])
+                user_data = load_user_data()
+                user = user_data.setdefault(reading["username"], new_user_record())
+                apply_deltas_to_user(user, reading["deltas"])
+                save_user_data(user_data)
+                return dict(user)
+        finally:
+            with self.in_flight_lock:
+                self.in_flight -= 1
+
+    def queue_depth(self):
+        """This worker's requests waiting on (or holding) the user data lock.
+        Like the group commit queue it is per worker, not summed across workers."""
+        return self.in_flight
+
+class GroupCommitBackend:
+    """Group commit: concurrent readings are persisted together with one record
+    append and one user_data rewrite; each request returns once its batch is durable."""
+
+    def __init__(self, max_batch=GROUP_COMMIT_MAX_BATCH, max_delay=GROUP_COMMIT_MAX_DELAY):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.pending = []
+        self.cond = threading.Condition()
+        self.commits = 0
+        self._thread = threading.Thread(target=self._run, name="group-commit", daemon=True)
+        self._thread.start()
+
+    def get_user(self, username):
+        return get_mapped_user_data().get(username)
+
+    def persist(self, reading):
+        slot = {"reading": reading, "done": threading.Event(), "user": None, "error": None}
+        with self.cond:
+            self.pending.append(slot)
+            self.cond.notify()
+        slot["done"].wait()
+        if slot["error"] is not None:
+            raise slot["error"]
+        return slot["user"]
+
+    def queue_depth(self):
+        return len(self.pending)
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.pending:
+                    self.cond.wait()
+            time.sleep(self.max_delay)
+            with self.cond:
+                batch = self.pending[:self.max_batch]
+                del self.pending[:self.max_batch]
+            try:
+                self.commit(batch)
+            except Exception as e:
+                print(f"Group Commit Error: {e}")
+                for slot in batch:
+                    slot["error"] = e
+            for slot in batch:
+                slot["done"].set()
+
+    def commit(self, batch):
+        with user_data_lock():
+            records = [slot["reading"]["record"] for slot in batch if slot["reading"]["record"] is not None]
+            if records:
+                save_energy_records(records)
+            user_data = load_user_data()
+            for slot in batch:
+                reading = slot["reading"]
+                user = user_data.setdefault(reading["username"], new_user_record())
+                apply_deltas_to_user(user, reading["deltas"])
+                slot["user"] = dict(user)
+            save_user_data(user_data)
+        self.commits += 1
+
+class ShardedBackend:
+    """Hand readings to the tile-sharded workers; totals come from the merge layer"""
+
+    def __init__(self, router):
+        self.router = router
+
+    def get_user(self, username):
+        user = get_mapped_user_data().get(username)
+        return merged_user_totals(username, user) if user is not None else None
+
+    def persist(self, reading):
+        route_key = reading["tile_id"] or reading.get("assigned_location") or reading["username"]
+        self.router.submit(route_key, reading["username"], reading["record"], reading["deltas"])
+        base = get_mapped_user_data().get(reading["username"]) or new_user_record()
+        return merged_user_totals(reading["username"], base)
+
+    def queue_depth(self):
+        return self.router.queue_depth()
+
+class IngestPipeline:
+    """Runs a reading through named stages and a persistence backend"""
+
+    def __init__(self, stages, backend):
+        self.stages = list(stages)
+        self.backend = backend
+
+    def insert_stage(self, before, name, stage):
+        """Add a stage ahead of an existing one"""
+        position = [stage_name for stage_name, _ in self.stages].index(before)
+        self.stages.insert(position, (name, stage))
+
+    def run(self, source, payload):
+        """Run a payload through the stages. A stage can end processing early
+        by setting reading["done"], and can register on_success/on_failure callbacks."""
+        reading = {"source": source, "payload": payload, "done": False,
+                   "duplicate": False, "on_success": [], "on_failure": []}
+        try:
+            for _, stage in self.stages:
+                if reading["done"]:
+                    break
+                stage(reading, self)
+        except Exception:
+            for callback in reading["on_failure"]:
+                callback(reading)
+            raise
+        for callback in reading["on_success"]:
+            callback(reading)
+        return reading
+
+_ingest_pipeline = {"pipeline": None, "pid": None}
+_ingest_pipeline_lock = threading.Lock()
+
+def get_ingest_pipeline():
+    """Pipeline for this process, built on first use with the configured backend"""
+    if _ingest_pipeline["pid"] != os.getpid():
+        with _ingest_pipeline_lock:
+            if _ingest_pipeline["pid"] != os.getpid():
+                router = get_ingest_router()
+                if router is not None:
+                    backend = ShardedBackend(router)
+                elif INGEST_BACKEND == "batch":
+                    backend = GroupCommitBackend()
+                else:
+                    backend = DirectBackend()
+                _ingest_pipeline["pipeline"] = IngestPipeline(DEFAULT_INGEST_STAGES, backend)
+                _ingest_pipeline["pid"] = os.getpid()
+    return _ingest_pipeline["pipeline"]
+
+def ingest_response(reading, body):
+    """JSON response for an accepted reading; replayed retries are flagged"""
+    if reading["duplicate"]:
+        body["duplicate"] = True
+    if reading.get("quarantined"):
+        body["quarantined"] = True
+        body["reward_points"] = 0
+    return jsonify(body)
+
+def ingest_error_response(error, messages, body):
+    """JSON error response for a rejected reading, in the adapter's own shape"""
+    body = dict(body, message=messages.get(error.reason, error.message))
+    response = jsonify(body)
+    response.status_code = error.status
+    for header, value in error.headers.items():
+        response.headers[header] = value
+    return response
+
+
+# ============= CHECKPOINTS =============
+# A checkpoint is a compact binary image of the in-memory state: user
+# aggregates (columnar arrays plus a name table), the leaderboard order and
+# the tile registry, together with the user_data.txt version it was taken
+# from and the length of every energy record log at that moment.
+# On startup the newest checkpoint is mmapped:
+#   - if user_data.txt is unchanged since the checkpoint, the caches are
+#     seeded directly and the text file is never parsed;
+#   - if user_data.txt is missing or lost users (e.g. a crash mid-write),
+#     the surviving rows are kept as they are (they are newer), the lost
+#     users are rebuilt from the checkpoint plus a replay of the record log
+#     tail, and user_data.txt is rewritten;
+#   - otherwise user_data.txt is newer and is parsed as usual.
+CHECKPOINT_DIR = "checkpoints"
+CHECKPOINT_INTERVAL = float(os.environ.get("CHECKPOINT_INTERVAL", "300"))
+CHECKPOINT_KEEP = 2
+CHECKPOINT_MAGIC = b"EFSNAP01"
+
+def write_checkpoint():
+    """Write a checkpoint of the current state. Returns its path."""
+    with user_data_lock():
+        stamp = get_user_data_stamp()
+        user_data = load_user_data_cached()
+        record_offsets = {}
+        for path in energy_record_logs():
+            try:
+                record_offsets[path] = os.path.getsize(path)
+            except OSError:
+                pass
+    tiles = load_energy_tiles()
+    
+    sections = [
+        ("usernames", "\n".join(user_data.usernames).encode()),
+        ("assigned", "\n".join("" if location is None else location for location in user_data.assigned).encode())
+    ]
+    for field in USER_FLOAT_FIELDS + USER_INT_FIELDS:
+        sections.append((field, user_data.columns[field].tobytes()))
+    sections.append(("leaderboard", array("I", map(user_data.row_of.__getitem__, get_leaderboard_order())).tobytes()))
+    sections.append(("tiles", json.dumps(tiles).encode()))
+    
+    layout = {}
+    offset = 0
+    for name, blob in sections:
+        layout[name] = [offset, len(blob)]
+        offset += len(blob)
+    header = json.dumps({
+        "created": datetime.now().isoformat(),
+        "user_data_stamp": list(stamp) if stamp else None,
+        "record_offsets": record_offsets,
+        "users": len(user_data),
+        "sections": layout
+    }).encode()
+    
+    os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+    path = os.path.join(CHECKPOINT_DIR, f"state-{time.time_ns()}.snap")
+    with open(path + ".tmp", "wb") as f:
+        f.write(CHECKPOINT_MAGIC + struct.pack("<I", len(header)) + header)
+        for _, blob in sections:
+            f.write(blob)
+    os.replace(path + ".tmp", path)
+    for old_path in sorted(glob.glob(os.path.join(CHECKPOINT_DIR, "state-*.snap")))[:-CHECKPOINT_KEEP]:
+        os.remove(old_path)
+    return path
+
+def read_checkpoint(path):
+    """Decode a checkpoint file (mmapped). Returns (header, UserTable, leaderboard order, tiles)."""
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)
+            try:
+                if bytes(view[:8]) != CHECKPOINT_MAGIC:
+                    raise ValueError(f"{path} is not a checkpoint")
+                header_len = struct.unpack_from("<I", mapped, 8)[0]
+                header = json.loads(bytes(view[12:12 + header_len]))
+                base = 12 + header_len
+                
+                def section(name):
+                    start, length = header["sections"][name]
+                    return view[base + start:base + start + length]
+                
+                count = header["users"]
+                usernames = bytes(section("usernames")).decode().split("\n") if count else []
+                assigned = bytes(section("assigned")).decode().split("\n") if count else []
+                columns = {}
+                for field in USER_FLOAT_FIELDS + USER_INT_FIELDS:
+                    columns[field] = array("d" if field in USER_FLOAT_FIELDS else "q")
+                    columns[field].frombytes(section(field))
+                order = array("I")
+                order.frombytes(section("leaderboard"))
+                tiles = json.loads(bytes(section("tiles")))
+            finally:
+                view.release()
+    
+    locations = {}
+    assigned = [locations.setdefault(location, location) for location in assigned]
+    return header, UserTable(usernames, columns, assigned), [usernames[row] for row in order], tiles
+
+def replay_record_tail(user_data, record_offsets, skip=()):
+    """Apply energy records appended after a checkpoint to its user aggregates,
+    except for users in `skip`. Records carry energy only, so points are
+    re-derived with calculate_reward_points and other fields keep their
+    checkpoint values."""
+    replayed = 0
+    for path in energy_record_logs():
+        try:
+            with open(path, "rb") as f:
+                f.seek(record_offsets.get(path, 0))
+                for line in f:
+                    if not line.strip():
+                        continue
+                    record = json.loads(line)
+                    if record["username"] in skip:
+                        continue
+                    user = user_data.setdefault(record["username"], new_user_record())
+                    user["total_energy_wh"] += record["electricity_wh"]
+                    user["reward_points"] += calculate_reward_points(record["electricity_wh"])
+                    replayed += 1
+        except OSError:
+            pass
+    return replayed
+
+def latest_checkpoint_path():
+    paths = sorted(glob.glob(os.path.join(CHECKPOINT_DIR, "state-*.snap")))
+    return paths[-1] if paths else None
+
+def restore_from_checkpoint():
+    """Seed the in-memory caches from the newest checkpoint. Returns how state was restored."""
+    path = latest_checkpoint_path()
+    if path is None:
+        return "none"
+    header, user_data, order, tiles = read_checkpoint(path)
+    stamp = get_user_data_stamp()
+    if header["user_data_stamp"] is not None and stamp == tuple(header["user_data_stamp"]):
+        _user_data_cache["data"] = user_data
+        _user_data_cache["stamp"] = stamp
+        _leaderboard_cache["order"] = order
+        _leaderboard_cache["stamp"] = stamp
+        return "checkpoint"
+    
+    with user_data_lock():
+        current = load_user_data() if stamp is not None else {}
+        if stamp is not None and not (set(user_data) - set(current)):
+            return "text"
+        # user_data.txt is gone or lost users - keep the surviving rows and
+        # rebuild the rest from checkpoint + log tail
+        rebuilt = {username: user for username, user in user_data.to_dict().items() if username not in current}
+        replay_record_tail(rebuilt, header["record_offsets"], skip=current)
+        current.update(rebuilt)
+        save_user_data(current)
+        if not os.path.exists("energy_tiles.txt"):
+            save_energy_tiles(tiles)
+    return "replayed"
+
+_last_checkpoint_stamp = {"stamp": None}
+
+def checkpoint_job(budget):
+    """Scheduled job: write a checkpoint when user data changed since the last one"""
+    stamp = get_user_data_stamp()
+    if stamp == _last_checkpoint_stamp["stamp"]:
+        return {"written": False}
+    path = write_checkpoint()
+    _last_checkpoint_stamp["stamp"] = stamp
+    return {"written": True, "path": path}
+
+
+# ============= READ REPLICAS =============
+# Optional read/write split (WORKER_ROLE, default "mixed" = both in one pool).
+# The writer pool's leader publishes a checkpoint whenever user data or
+# tiles change (at most every SNAPSHOT_PUBLISH_INTERVAL) and then points
+# checkpoints/published.json at it, re-confirming it each interval while
+# nothing changes. Reader workers adopt each newly published checkpoint on
+# their scheduler thread and serve user aggregates, the leaderboard and the
+# page cache from it, so ingest bursts never reach their request path.
+# A snapshot not confirmed for READ_MAX_STALENESS seconds (writers down or
+# stuck) is not served; readers fall back to the live files until it is.
+WORKER_ROLE = os.environ.get("WORKER_ROLE", "mixed")
+SNAPSHOT_PUBLISH_INTERVAL = float(os.environ.get("SNAPSHOT_PUBLISH_INTERVAL", "2"))
+READ_MAX_STALENESS = float(os.environ.get("READ_MAX_STALENESS", "10"))
+REPLICA_REFRESH_INTERVAL = 0.5
+PUBLISHED_SNAPSHOT_FILE = os.path.join(CHECKPOINT_DIR, "published.json")
+
+_published = {"version": None, "path": None}
+
+def publish_snapshot(budget):
+    """Scheduled job (writer role): publish a snapshot of the current data, or
+    re-confirm the published one when nothing changed"""
+    confirmed_at = time.time()
+    version = get_data_version()
+    path = _published["path"]
+    written = version != _published["version"] or path is None or not os.path.exists(path)
+    if written:
+        path = write_checkpoint()
+        _published.update(version=version, path=path)
+    with open(PUBLISHED_SNAPSHOT_FILE + ".tmp", "w") as f:
+        json.dump({"path": path, "confirmed_at": confirmed_at}, f)
+    os.replace(PUBLISHED_SNAPSHOT_FILE + ".tmp", PUBLISHED_SNAPSHOT_FILE)
+    return {"written": written, "path": path}
+
+_replica = {"snapshot": None, "loads": 0, "fallbacks": 0, "last_error": None}
+
+def refresh_replica(budget=None):
+    """Scheduled job (reader role): adopt the latest published snapshot"""
+    try:
+        with open(PUBLISHED_SNAPSHOT_FILE, "r") as f:
+            published = json.load(f)
+    except (OSError, ValueError):
+        return {"path": None}
+    snapshot = _replica["snapshot"]
+    if snapshot is None or snapshot["path"] != published["path"]:
+        try:
+            header, users, order, tiles = read_checkpoint(published["path"])
+        except (OSError, ValueError) as e:
+            # Superseded and removed between reading the pointer and opening it
+            _replica["last_error"] = str(e)
+            return {"path": None}
+        snapshot = {
+            "path": published["path"],
+            "version": ("replica", published["path"]),
+            "users": users,
+            "order": order,
+            "created": header["created"],
+            "confirmed_at": published["confirmed_at"]
+        }
+        _replica["snapshot"] = snapshot
+        _replica["loads"] += 1
+    else:
+        snapshot["confirmed_at"] = published["confirmed_at"]
+    return {"path": snapshot["path"], "staleness": round(time.time() - snapshot["confirmed_at"], 3)}
+
+def current_replica():
+    """The snapshot a reader serves from; None in other roles, and for a reader
+    whose snapshot is missing or staler than READ_MAX_STALENESS"""
+    if WORKER_ROLE != "reader":
+        return None
+    snapshot = _replica["snapshot"]
+    if snapshot is None or time.time() - snapshot["confirmed_at"] > READ_MAX_STALENESS:
+        _replica["fallbacks"] += 1
+        return None
+    return snapshot
+
+
+# ============= PERIOD LEADERBOARDS =============
+# Daily, weekly (ISO week) and monthly leaderboards. Every worker tails the
+# energy record logs written by the ingest path and adds each new record's
+# points to the current period's board, so boards never rescan history.
+# When a record (or the clock) moves past the current period, the board is
+# frozen into an immutable snapshot file (periods/<kind>-<key>.json) and a
+# new one starts; records arriving for an already frozen period are counted
+# as late and not applied. Boards keep (-points, username) in a sorted list
+# (sortedcontainers.SortedList when installed), so rank lookups are a bisect
+# and top-N is a slice.
+LEADERBOARD_PERIODS = ("day", "week", "month")
+PERIOD_DIR = "periods"
+PERIOD_STATE_FILE = os.path.join(PERIOD_DIR, "current.json")
+FROZEN_BOARD_CACHE_SIZE = 16
+PERIOD_REFRESH_INTERVAL = 60
+
+class RecordLogTail:
+    """Follows the append-only energy record logs for derived views"""
+
+    def __init__(self):
+        self.logs = {}  # path -> [inode, bytes consumed]
+
+    def read_new(self):
+        """(records appended since the last call, sorted by timestamp; rewound).
+        If a log was rewritten (compaction), every record is returned again
+        with rewound=True and the caller must rebuild from scratch."""
+        records = []
+        for path in energy_record_logs():
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            inode, consumed = self.logs.get(path, [st.st_ino, 0])
+            if inode != st.st_ino or st.st_size < consumed:
+                self.logs = {}
+                return self.read_new()[0], True
+            if st.st_size == consumed:
+                continue
+            with open(path, "rb") as f:
+                f.seek(consumed)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    consumed += len(line)
+                    if line.strip():
+                        records.append(json.loads(line))
+            self.logs[path] = [st.st_ino, consumed]
+        records.sort(key=lambda r: r["timestamp"])
+        return records, False
+
+def period_key(kind, when):
+    """Key of the period containing `when`, e.g. 2026-10-19, 2026-W42, 2026-10"""
+    if kind == "day":
+        return when.strftime("%Y-%m-%d")
+    if kind == "week":
+        year, week, _ = when.isocalendar()
+        return f"{year}-W{week:02d}"
+    return when.strftime("%Y-%m")
+
+class RankedBoard:
+    """Points per user for one period, ordered for O(log n) rank lookups.
+    With sortedcontainers installed, score updates are O(log n) as well.
+    Without it the order is a plain list and each update shifts it, O(n):
+    cheap at tens of thousands of users per period, but the first thing
+    to fix for much larger boards."""
+
+    def __init__(self, scores=None):
+        self.scores = dict(scores or {})
+        ranked = ((-points, username) for username, points in self.scores.items())
+        self.ranked = SortedList(ranked) if SortedList is not None else sorted(ranked)
+
+    def add(self, username, points):
+        old = self.scores.get(username)
+        if old is not None:
+            if SortedList is not None:
+                self.ranked.remove((-old, username))
+            else:
+                del self.ranked[bisect.bisect_left(self.ranked, (-old, username))]
+            points += old
+        self.scores[username] = points
+        if SortedList is not None:
+            self.ranked.add((-points, username))
+        else:
+            bisect.insort(self.ranked, (-points, username))
+
+    def rank(self, username):
+        points = self.scores.get(username)
+        if points is None:
+            return None
+        if SortedList is not None:
+            return self.ranked.bisect_left((-points, username)) + 1
+        return bisect.bisect_left(self.ranked, (-points, username)) + 1
+
+    def top(self, limit):
+        return [(username, -negated) for negated, username in self.ranked[:limit]]
+
+    def __len__(self):
+        return len(self.scores)
+
+class PeriodLeaderboards:
+    """Current boards per period kind, fed from the energy record logs"""
+
+    def __init__(self, state_dir=PERIOD_DIR):
+        self.state_dir = state_dir
+        self.state_path = os.path.join(state_dir, "current.json")
+        self.current = {}  # kind -> [key, RankedBoard]
+        self.tail = RecordLogTail()
+        self.late_records = 0
+        self.frozen = OrderedDict()
+        self.lock = threading.RLock()
+        self.loaded = False
+        self.dirty = False
+
+    def load(self):
+        try:
+            with open(self.state_path, "r") as f:
+                state = json.load(f)
+            self.tail.logs = state["logs"]
+            self.late_records = state.get("late_records", 0)
+            self.current = {kind: [board["key"], RankedBoard(board["scores"])] for kind, board in state["boards"].items()}
+        except (OSError, ValueError, KeyError):
+            self.tail.logs = {}
+            self.current = {}
+        self.loaded = True
+
+    def save_state(self):
+        with self.lock:
+            if not self.dirty:
+                return False
+            os.makedirs(self.state_dir, exist_ok=True)
+            tmp_path = f"{self.state_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({
+                    "logs": self.tail.logs,
+                    "late_records": self.late_records,
+                    "boards": {kind: {"key": key, "scores": board.scores} for kind, (key, board) in self.current.items()}
+                }, f)
+            os.replace(tmp_path, self.state_path)
+            self.dirty = False
+            return True
+
+    def refresh(self):
+        """Apply new records and roll periods over by the clock"""
+        with self.lock:
+            if not self.loaded:
+                self.load()
+            records, rewound = self.tail.read_new()
+            if rewound:
+                self.current = {}
+            for record in records:
+                when = datetime.fromisoformat(record["timestamp"])
+                points = calculate_reward_points(record["electricity_wh"])
+                for kind in LEADERBOARD_PERIODS:
+                    board = self.board_for(kind, period_key(kind, when))
+                    if board is None:
+                        self.late_records += 1
+                        continue
+                    board.add(record["username"], points)
+                self.dirty = True
+            now = datetime.now()
+            for kind in LEADERBOARD_PERIODS:
+                self.board_for(kind, period_key(kind, now))
+
+    def board_for(self, kind, key):
+        """The live board for a period key, rolling over if the key is newer
+        than the current period; None if that period is already frozen"""
+        current = self.current.get(kind)
+        if current is not None and key < current[0]:
+            return None
+        if current is None or key > current[0]:
+            if current is not None:
+                self.freeze(kind, *current)
+            current = self.current[kind] = [key, RankedBoard()]
+            self.dirty = True
+        return current[1]
+
+    def freeze(self, kind, key, board):
+        """Write a finished period's final standings; existing snapshots are never rewritten"""
+        os.makedirs(self.state_dir, exist_ok=True)
+        path = os.path.join(self.state_dir, f"{kind}-{key}.json")
+        if os.path.exists(path):
+            return
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({
+                "kind": kind,
+                "key": key,
+                "frozen_at": datetime.now().isoformat(),
+                "entries": board.top(len(board))
+            }, f)
+        os.replace(tmp_path, path)
+
+    def frozen_board(self, kind, key):
+        """(entries, rank by username) of a frozen period, or None"""
+        cache_key = (kind, key)
+        if cache_key in self.frozen:
+            self.frozen.move_to_end(cache_key)
+            return self.frozen[cache_key]
+        try:
+            with open(os.path.join(self.state_dir, f"{kind}-{key}.json"), "r") as f:
+                entries = [tuple(entry) for entry in json.load(f)["entries"]]
+        except (OSError, ValueError):
+            return None
+        frozen = (entries, {username: rank for rank, (username, _) in enumerate(entries, 1)})
+        self.frozen[cache_key] = frozen
+        if len(self.frozen) > FROZEN_BOARD_CACHE_SIZE:
+            self.frozen.popitem(last=False)
+        return frozen
+
+    def standings(self, kind, key=None, limit=100):
+        """(key, frozen, [(username, points)]) for the current or a given period"""
+        self.refresh()
+        with self.lock:
+            current_key, board = self.current[kind]
+            if key is None or key == current_key:
+                return current_key, False, board.top(limit)
+        frozen = self.frozen_board(kind, key)
+        if frozen is None:
+            return key, True, None
+        return key, True, frozen[0][:limit]
+
+    def user_rank(self, kind, username, key=None):
+        """(key, rank, points, board size); rank is None when the user has no points"""
+        self.refresh()
+        with self.lock:
+            current_key, board = self.current[kind]
+            if key is None or key == current_key:
+                return current_key, board.rank(username), board.scores.get(username, 0), len(board)
+        frozen = self.frozen_board(kind, key)
+        if frozen is None:
+            return key, None, 0, 0
+        entries, ranks = frozen
+        rank = ranks.get(username)
+        return key, rank, entries[rank - 1][1] if rank else 0, len(entries)
+
+    def frozen_keys(self, kind):
+        prefix = os.path.join(self.state_dir, f"{kind}-")
+        return sorted(path[len(prefix):-len(".json")] for path in glob.glob(prefix + "*.json"))
+
+_period_leaderboards = {"boards": None}
+_period_leaderboards_lock = threading.Lock()
+
+def get_period_leaderboards():
+    with _period_leaderboards_lock:
+        if _period_leaderboards["boards"] is None:
+            _period_leaderboards["boards"] = PeriodLeaderboards()
+        return _period_leaderboards["boards"]
 
-def save_admin_credentials(credentials):
-    """Save admin credentials to storage"""
-    with open("admin_credentials.txt", "w") as f:
-        for username in credentials:
-            admin = credentials[username]
-            f.write(f"{username}|{admin['password_hash']}|{admin['email']}\n")
+def roll_leaderboard_periods(budget):
+    """Scheduled job (every worker): apply new records, roll periods, persist board state"""
+    boards = get_period_leaderboards()
+    boards.refresh()
+    saved = boards.save_state()
+    return {kind: key for kind, (key, _) in boards.current.items()} | {"saved": saved}
 
-# ============= AUTHENTICATION DATABASE FUNCTIONS =============
-def load_users():
-    """Load user accounts with credentials"""
-    users = {}
-    try:
-        with open("users.txt", "r") as f:
-            for line in f:
-                if line.strip():
-                    parts = line.strip().split("|")
-                    if len(parts) >= 5:
-                        username = parts[0]
-                        users[username] = {
-                            "password_hash": parts[1],
-                            "email": parts[2],
-                            "mfa_secret": parts[3],
-                            "otp_secret": parts[4] if len(parts) > 4 else None
-                        }
-    except:
-        pass
-    return users
 
-def save_users(users):
-    """Save user accounts"""
-    with open("users.txt", "w") as f:
-        for username in users:
-            user = users[username]
-            f.write(f"{username}|{user['password_hash']}|{user['email']}|{user['mfa_secret']}|{user.get('otp_secret', '')}\n")
+# ============= ENERGY HEATMAP =============
+# Energy and reading counts per grid cell, at every zoom level from 0 (one
+# cell per 360 degrees) to HEATMAP_MAX_ZOOM, kept both all-time and per day.
+# Like the period leaderboards it is fed incrementally from the record logs
+# that save_energy_records appends to, so every worker sees all records.
+# A query only touches the cells of one zoom level inside the viewport (and
+# the days in its date range), never the record history. Per-day layers are
+# kept for HEATMAP_RETENTION_DAYS; older days only count towards all-time.
+# The state file is a restart shortcut, so it is rewritten at most every
+# HEATMAP_SAVE_INTERVAL; a restart replays the records logged since.
+HEATMAP_MAX_ZOOM = 16
+HEATMAP_MAX_CELLS = 4096  # cells a response may cover; zoom is lowered to fit
+HEATMAP_STATE_FILE = "heatmap_state.json"
+HEATMAP_REFRESH_INTERVAL = 60
+HEATMAP_SAVE_INTERVAL = 600
+HEATMAP_RETENTION_DAYS = int(os.environ.get("HEATMAP_RETENTION_DAYS", "90"))
 
-def hash_password(password):
-    """Hash password using SHA256"""
-    return hashlib.sha256(password.encode()).hexdigest()
+def heatmap_cell_size(zoom):
+    return 360.0 / (1 << zoom)
 
-def verify_password(stored_hash, password):
-    """Verify password hash"""
-    return stored_hash == hash_password(password)
+def heatmap_cell(lat, lon, zoom):
+    size = heatmap_cell_size(zoom)
+    return int((lat + 90) // size), int((lon + 180) // size)
 
-def generate_mfa_secret():
-    """Generate TOTP secret for user"""
-    return pyotp.random_base32()
+def record_position(record):
+    """Where a record was generated: the reported fix, else its tile"""
+    location = record.get("location") or {}
+    if location.get("lat") is not None and location.get("lon") is not None:
+        return float(location["lat"]), float(location["lon"])
+    if record.get("tile_lat") is not None and record.get("tile_lon") is not None:
+        return float(record["tile_lat"]), float(record["tile_lon"])
+    return None
 
-def load_mfa_sessions():
-    """Load pending MFA sessions"""
-    sessions = {}
-    try:
-        with open("mfa_sessions.txt", "r") as f:
-            for line in f:
-                if line.strip():
-                    parts = line.strip().split("|")
-                    if len(parts) >= 4:
-                        session_id = parts[0]
-                        sessions[session_id] = {
-                            "username": parts[1],
-                            "user_type": parts[2],
-                            "otp": parts[3],
-                            "timestamp": float(parts[4]) if len(parts) > 4 else 0
-                        }
-    except:
-        pass
-    return sessions
+class EnergyHeatmap:
+    """Multi-resolution grid aggregate of energy records"""
 
-def save_mfa_sessions(sessions):
-    """Save MFA sessions"""
-    with open("mfa_sessions.txt", "w") as f:
-        for session_id in sessions:
-            s = sessions[session_id]
-            f.write(f"{session_id}|{s['username']}|{s['user_type']}|{s['otp']}|{s['timestamp']}\n")
+    def __init__(self, state_path=HEATMAP_STATE_FILE):
+        self.state_path = state_path
+        self.tail = RecordLogTail()
+        self.all_time = self.new_layers()
+        self.days = {}  # YYYY-MM-DD -> layers
+        self.day_keys = []  # sorted
+        self.first_day = None  # oldest day with a per-day layer
+        self.lock = threading.RLock()
+        self.loaded = False
+        self.dirty = False
+        self.saved_at = None
 
-# ============= ENERGY TILE DATABASE =============
-# Default tiles - will be created on first run
-DEFAULT_ENERGY_TILES = {
-    "tile_001": {"name": "Shibuya Crossing", "lat": 35.6595, "lon": 139.7004, "radius": 0.001, "capacity": 1000},
-    "tile_002": {"name": "Tokyo Station", "lat": 35.6762, "lon": 139.7674, "radius": 0.001, "capacity": 800},
-    "tile_003": {"name": "Shinjuku Station", "lat": 35.5308, "lon": 139.7100, "radius": 0.001, "capacity": 900},
-    "tile_004": {"name": "Harajuku", "lat": 35.6654, "lon": 139.7033, "radius": 0.0015, "capacity": 700},
-    "tile_005": {"name": "Ginza", "lat": 35.6730, "lon": 139.7725, "radius": 0.0012, "capacity": 600},
-}
+    @staticmethod
+    def new_layers():
+        return [{} for _ in range(HEATMAP_MAX_ZOOM + 1)]  # zoom -> {(row, col): [energy_wh, readings]}
 
-def load_energy_tiles():
-    """Load energy tiles from storage"""
-    tiles = {}
-    try:
-        with open("energy_tiles.txt", "r") as f:
-            for line in f:
-                if line.strip():
-                    parts = line.strip().split("|")
-                    if len(parts) >= 6:
-                        tile_id = parts[0]
-                        tiles[tile_id] = {
-                            "name": parts[1],
-                            "lat": float(parts[2]),
-                            "lon": float(parts[3]),
-                            "radius": float(parts[4]),
-                            "capacity": int(parts[5])
-                        }
-    except:
-        # Initialize with default tiles if file doesn't exist
-        tiles = DEFAULT_ENERGY_TILES.copy()
-        save_energy_tiles(tiles)
-    return tiles
+    def add(self, record):
+        position = record_position(record)
+        if position is None:
+            return
+        lat, lon = position
+        day = record["timestamp"][:10]
+        grids = [self.all_time]
+        if day >= self.first_day:
+            layers = self.days.get(day)
+            if layers is None:
+                layers = self.days[day] = self.new_layers()
+                bisect.insort(self.day_keys, day)
+            grids.append(layers)
+        energy = record["electricity_wh"]
+        for zoom in range(HEATMAP_MAX_ZOOM + 1):
+            cell = heatmap_cell(lat, lon, zoom)
+            for grid in (layers[zoom] for layers in grids):
+                totals = grid.get(cell)
+                if totals is None:
+                    grid[cell] = [energy, 1]
+                else:
+                    totals[0] += energy
+                    totals[1] += 1
 
-def save_energy_tiles(tiles):
-    """Save energy tiles to storage"""
-    with open("energy_tiles.txt", "w") as f:
-        for tile_id in tiles:
-            tile = tiles[tile_id]
-            f.write(f"{tile_id}|{tile['name']}|{tile['lat']}|{tile['lon']}|{tile['radius']}|{tile['capacity']}\n")
+    def refresh(self):
+        with self.lock:
+            if not self.loaded:
+                self.load()
+            records, rewound = self.tail.read_new()
+            if rewound:
+                self.all_time = self.new_layers()
+                self.days = {}
+                self.day_keys = []
+            pruned = self.prune()
+            for record in records:
+                self.add(record)
+            if records or rewound or pruned:
+                self.dirty = True
 
-def calculate_distance(lat1, lon1, lat2, lon2):
-    """Calculate distance between two GPS coordinates in kilometers"""
-    R = 6371  # Earth's radius in km
-    dlat = math.radians(lat2 - lat1)
-    dlon = math.radians(lon2 - lon1)
-    a = math.sin(dlat/2)**2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlon/2)**2
-    c = 2 * math.asin(math.sqrt(a))
-    return R * c
+    def prune(self):
+        """Drop per-day layers older than HEATMAP_RETENTION_DAYS"""
+        self.first_day = (datetime.now() - timedelta(days=HEATMAP_RETENTION_DAYS - 1)).date().isoformat()
+        expired = self.day_keys[:bisect.bisect_left(self.day_keys, self.first_day)]
+        for day in expired:
+            del self.days[day]
+        del self.day_keys[:len(expired)]
+        return len(expired)
 
-def is_on_energy_tile(user_lat, user_lon):
-    """Check if user is on an energy tile and return tile info"""
-    energy_tiles = load_energy_tiles()
-    for tile_id, tile_info in energy_tiles.items():
-        distance = calculate_distance(user_lat, user_lon, tile_info["lat"], tile_info["lon"])
-        # Convert radius from degrees to km (approximately)
-        if distance < (tile_info["radius"] * 111):  # 1 degree ≈ 111 km
-            return tile_id, tile_info
-    return None, None
+    def load(self):
+        try:
+            with open(self.state_path, "r") as f:
+                state = json.load(f)
+            self.tail.logs = state["logs"]
+            self.all_time = self.decode_layers(state["all_time"])
+            self.days = {day: self.decode_layers(layers) for day, layers in state["days"].items()}
+            self.day_keys = sorted(self.days)
+        except (OSError, ValueError, KeyError):
+            self.tail.logs = {}
+        self.loaded = True
 
-def load_user_data():
-    """Load all user data including energy records and rewards"""
-    data = {}
+    @staticmethod
+    def decode_layers(layers):
+        return [{(row, col): [energy, readings] for row, col, energy, readings in cells} for cells in layers]
+
+    @staticmethod
+    def encode_layers(layers):
+        return [[[row, col, energy, readings] for (row, col), (energy, readings) in grid.items()] for grid in layers]
+
+    def save_state(self, force=False):
+        with self.lock:
+            if not self.dirty:
+                return False
+            if not force and self.saved_at is not None and time.monotonic() - self.saved_at < HEATMAP_SAVE_INTERVAL:
+                return False
+            tmp_path = f"{self.state_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({
+                    "logs": self.tail.logs,
+                    "all_time": self.encode_layers(self.all_time),
+                    "days": {day: self.encode_layers(layers) for day, layers in self.days.items()}
+                }, f)
+            os.replace(tmp_path, self.state_path)
+            self.dirty = False
+            self.saved_at = time.monotonic()
+            return True
+
+    def query(self, min_lat, min_lon, max_lat, max_lon, zoom, date_from=None, date_to=None):
+        """Cells overlapping a viewport, summed over an optional day range.
+        Returns (zoom used, [(row, col, energy_wh, readings)])."""
+        self.refresh()
+        # Coarsen until the viewport spans at most HEATMAP_MAX_CELLS cells
+        while zoom > 0:
+            first, last = heatmap_cell(min_lat, min_lon, zoom), heatmap_cell(max_lat, max_lon, zoom)
+            if (last[0] - first[0] + 1) * (last[1] - first[1] + 1) <= HEATMAP_MAX_CELLS:
+                break
+            zoom -= 1
+        first, last = heatmap_cell(min_lat, min_lon, zoom), heatmap_cell(max_lat, max_lon, zoom)
+        span = (last[0] - first[0] + 1) * (last[1] - first[1] + 1)
+        with self.lock:
+            if date_from is None and date_to is None:
+                grids = [self.all_time[zoom]]
+            else:
+                start = bisect.bisect_left(self.day_keys, date_from) if date_from else 0
+                stop = bisect.bisect_right(self.day_keys, date_to) if date_to else len(self.day_keys)
+                grids = [self.days[day][zoom] for day in self.day_keys[start:stop]]
+            totals = {}
+            for grid in grids:
+                if span <= len(grid):
+                    cells = (((row, col), grid.get((row, col)))
+                             for row in range(first[0], last[0] + 1) for col in range(first[1], last[1] + 1))
+                else:
+                    cells = grid.items()
+                for (row, col), values in cells:
+                    if values is None or not (first[0] <= row <= last[0] and first[1] <= col <= last[1]):
+                        continue
+                    cell_totals = totals.setdefault((row, col), [0.0, 0])
+                    cell_totals[0] += values[0]
+                    cell_totals[1] += values[1]
+        return zoom, [(row, col, energy, readings) for (row, col), (energy, readings) in totals.items()]
+
+_energy_heatmap = {"heatmap": None}
+_energy_heatmap_lock = threading.Lock()
+
+def get_energy_heatmap():
+    with _energy_heatmap_lock:
+        if _energy_heatmap["heatmap"] is None:
+            _energy_heatmap["heatmap"] = EnergyHeatmap()
+        return _energy_heatmap["heatmap"]
+
+def refresh_heatmap(budget):
+    """Scheduled job (every worker): fold new records into the heatmap and persist it"""
+    heatmap = get_energy_heatmap()
+    heatmap.refresh()
+    return {"days": len(heatmap.day_keys), "saved": heatmap.save_state()}
+
+
+# ============= EMAIL OUTBOX =============
+# Logins never wait on SMTP: OTP emails go into an in-process outbox and
+# sender threads deliver them in batches over a small pool of reused SMTP
+# connections, retrying transient failures with exponential backoff.
+# Without SMTP_HOST nothing is sent and the admin OTP stays 000000.
+SMTP_HOST = os.environ.get("SMTP_HOST", "")
+SMTP_PORT = int(os.environ.get("SMTP_PORT", "25"))
+SMTP_USERNAME = os.environ.get("SMTP_USERNAME", "")
+SMTP_PASSWORD = os.environ.get("SMTP_PASSWORD", "")
+SMTP_STARTTLS = os.environ.get("SMTP_STARTTLS", "off") == "on"
+SMTP_SENDER = os.environ.get("SMTP_SENDER", "no-reply@energy.com")
+SMTP_TIMEOUT = 10
+SMTP_POOL_SIZE = int(os.environ.get("SMTP_POOL_SIZE", "2"))
+SMTP_IDLE_TIMEOUT = 60  # seconds a pooled connection may sit unused
+OUTBOX_BATCH = 20
+OUTBOX_MAX_PENDING = 10000
+OUTBOX_MAX_ATTEMPTS = 5
+OUTBOX_BACKOFF = 2.0  # first retry delay, doubled per attempt
+OUTBOX_MAX_BACKOFF = 60.0
+OTP_RESEND_INTERVAL = 30
+
+class SmtpPool:
+    """Open SMTP connections kept for reuse, checked with NOOP before handing out"""
+
+    def __init__(self, host=SMTP_HOST, port=SMTP_PORT, size=SMTP_POOL_SIZE, idle_timeout=SMTP_IDLE_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self.idle = []
+        self.lock = threading.Lock()
+        self.opened = 0
+        self.reused = 0
+
+    def connect(self):
+        import smtplib
+        conn = smtplib.SMTP(self.host, self.port, timeout=SMTP_TIMEOUT)
+        if SMTP_STARTTLS:
+            conn.starttls()
+        if SMTP_USERNAME:
+            conn.login(SMTP_USERNAME, SMTP_PASSWORD)
+        self.opened += 1
+        return conn
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                if not self.idle:
+                    break
+                conn, last_used = self.idle.pop()
+            if time.monotonic() - last_used < self.idle_timeout:
+                try:
+                    if conn.noop()[0] == 250:
+                        self.reused += 1
+                        return conn
+                except OSError:
+                    pass
+            self.discard(conn)
+        return self.connect()
+
+    def release(self, conn):
+        with self.lock:
+            if len(self.idle) < self.size:
+                self.idle.append((conn, time.monotonic()))
+                return
+        self.discard(conn)
+
+    def discard(self, conn):
+        try:
+            conn.quit()
+        except Exception:
+            conn.close()
+
+    def stats(self):
+        return {"idle": len(self.idle), "opened": self.opened, "reused": self.reused}
+
+def is_permanent_smtp_error(error):
+    """5xx replies (bad recipient, rejected message) will not succeed on retry"""
+    import smtplib
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in error.recipients.values())
+    return isinstance(error, smtplib.SMTPResponseException) and error.smtp_code >= 500
+
+class EmailOutbox:
+    """Queue of outgoing emails drained by SMTP_POOL_SIZE sender threads"""
+
+    def __init__(self, pool, workers=SMTP_POOL_SIZE, batch=OUTBOX_BATCH):
+        self.pool = pool
+        self.batch = batch
+        self.pending = []  # heap of (due, seq, message)
+        self.in_flight = 0
+        self.seq = itertools.count()
+        self.cond = threading.Condition()
+        self.metrics = {
+            "queued": 0, "sent": 0, "retries": 0, "failed": 0, "dropped": 0,
+            "last_lag": None, "max_lag": 0.0, "total_lag": 0.0, "last_error": None
+        }
+        self._threads = [threading.Thread(target=self._run, name=f"email-outbox-{i}", daemon=True)
+                         for i in range(max(workers, 1))]
+        for thread in self._threads:
+            thread.start()
+
+    def enqueue(self, to, subject, body):
+        """Queue an email; False when the outbox is full"""
+        message = {"to": to, "subject": subject, "body": body,
+                   "queued": time.monotonic(), "attempts": 0}
+        with self.cond:
+            if len(self.pending) >= OUTBOX_MAX_PENDING:
+                self.metrics["dropped"] += 1
+                return False
+            heapq.heappush(self.pending, (message["queued"], next(self.seq), message))
+            self.metrics["queued"] += 1
+            self.cond.notify()
+        return True
+
+    def take(self):
+        """Block until messages are due, then claim up to `batch` of them"""
+        with self.cond:
+            while True:
+                now = time.monotonic()
+                if self.pending and self.pending[0][0] <= now:
+                    break
+                self.cond.wait(self.pending[0][0] - now if self.pending else None)
+            batch = []
+            while self.pending and self.pending[0][0] <= now and len(batch) < self.batch:
+                batch.append(heapq.heappop(self.pending)[2])
+            self.in_flight += len(batch)
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self.take()
+            conn = None
+            for message in batch:
+                try:
+                    if conn is None:
+                        conn = self.pool.acquire()
+                    self.deliver(conn, message)
+                except Exception as e:
+                    if conn is not None:
+                        self.pool.discard(conn)
+                        conn = None
+                    self.failed(message, e)
+                else:
+                    self.delivered(message)
+            if conn is not None:
+                self.pool.release(conn)
+            with self.cond:
+                self.in_flight -= len(batch)
+                self.cond.notify_all()
+
+    def deliver(self, conn, message):
+        from email.mime.text import MIMEText
+        mime = MIMEText(message["body"])
+        mime["Subject"] = message["subject"]
+        mime["From"] = SMTP_SENDER
+        mime["To"] = message["to"]
+        conn.sendmail(SMTP_SENDER, [message["to"]], mime.as_string())
+
+    def delivered(self, message):
+        lag = time.monotonic() - message["queued"]
+        with self.cond:
+            self.metrics["sent"] += 1
+            self.metrics["last_lag"] = round(lag, 4)
+            self.metrics["max_lag"] = round(max(self.metrics["max_lag"], lag), 4)
+            self.metrics["total_lag"] += lag
+
+    def failed(self, message, error):
+        message["attempts"] += 1
+        with self.cond:
+            self.metrics["last_error"] = str(error)
+            if message["attempts"] >= OUTBOX_MAX_ATTEMPTS or is_permanent_smtp_error(error):
+                self.metrics["failed"] += 1
+                print(f"Email Outbox Error: giving up on {message['to']}: {error}")
+                return
+            delay = min(OUTBOX_BACKOFF * 2 ** (message["attempts"] - 1), OUTBOX_MAX_BACKOFF)
+            delay *= random.uniform(0.8, 1.2)
+            heapq.heappush(self.pending, (time.monotonic() + delay, next(self.seq), message))
+            self.metrics["retries"] += 1
+            self.cond.notify()
+
+    def flush(self, timeout=None):
+        """Wait until nothing is pending or in flight; returns whether that happened"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.cond:
+            while self.pending or self.in_flight:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.cond.wait(remaining)
+        return True
+
+    def stats(self):
+        with self.cond:
+            now = time.monotonic()
+            metrics = dict(self.metrics)
+            total_lag = metrics.pop("total_lag")
+            metrics["avg_lag"] = round(total_lag / metrics["sent"], 4) if metrics["sent"] else None
+            metrics["pending"] = len(self.pending)
+            metrics["in_flight"] = self.in_flight
+            metrics["oldest_pending_age"] = round(max((now - m["queued"] for _, _, m in self.pending), default=0), 4)
+        metrics["pool"] = self.pool.stats()
+        return metrics
+
+def send_otp_email(to, otp_code):
+    """Queue an OTP email; False when there is no outbox or it is full"""
+    outbox = _background_services["outbox"]
+    if outbox is None or not to:
+        return False
+    return outbox.enqueue(to, "Your Energy Tiles login code",
+                          f"Your one-time login code is {otp_code}.\n\n"
+                          f"It expires in {MFA_SESSION_TTL // 60} minutes. "
+                          f"If you did not try to log in, change your password.")
+
+
+# ============= BACKGROUND SCHEDULER =============
+# Maintenance runs on a scheduler thread in each worker, never in a request.
+# Jobs marked leader_only run in one worker at a time: the leader is whichever
+# process holds an exclusive lock on scheduler.lock; when it exits the OS
+# drops the lock and another worker takes over on its next tick.
+# Each run gets a time budget - long jobs check it and resume next time -
+# and run times, failures and overruns are kept per job (/api/scheduler).
+SCHEDULER_ENABLED = os.environ.get("SCHEDULER", "on") != "off"
+SCHEDULER_LOCK_FILE = "scheduler.lock"
+SCHEDULER_TICK = 1.0
+SCHEDULER_JITTER = 0.1  # +/- fraction of the interval
+MFA_SESSION_TTL = 600  # seconds an unverified MFA session stays valid
+COMPACTION_INTERVAL = 3600
+SESSION_PRUNE_INTERVAL = 900
+AGGREGATE_REFRESH_INTERVAL = 30
+
+class JobBudget:
+    """Time allowance for one job run"""
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.started = time.monotonic()
+
+    def remaining(self):
+        return self.seconds - (time.monotonic() - self.started)
+
+    def expired(self):
+        return self.remaining() <= 0
+
+class Scheduler:
+    """Runs registered jobs periodically, with jitter, on a daemon thread"""
+
+    def __init__(self, lock_path=SCHEDULER_LOCK_FILE, tick=SCHEDULER_TICK):
+        self.lock_path = lock_path
+        self.tick = tick
+        self.jobs = {}
+        self.startup = []
+        self.is_leader = False
+        self._lock_file = None
+        self._thread = None
+
+    def add_job(self, name, func, interval, budget, leader_only=True):
+        """func(budget) runs every `interval` seconds; its return value is kept as last_result"""
+        self.jobs[name] = {
+            "func": func,
+            "interval": interval,
+            "budget": budget,
+            "leader_only": leader_only,
+            "next_run": time.monotonic() + self.jittered(interval) * random.random(),
+            "metrics": {
+                "runs": 0, "failures": 0, "over_budget": 0,
+                "last_started": None, "last_duration": None, "max_duration": 0.0,
+                "last_error": None, "last_result": None
+            }
+        }
+
+    def on_start(self, func):
+        """Run func once on the scheduler thread before any periodic job"""
+        self.startup.append(func)
+
+    def jittered(self, interval):
+        return interval * (1 + random.uniform(-SCHEDULER_JITTER, SCHEDULER_JITTER))
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="scheduler", daemon=True)
+        self._thread.start()
+
+    def try_lead(self):
+        """Take (or keep) leadership; returns whether this worker is the leader"""
+        if self.is_leader:
+            return True
+        lock_file = open(self.lock_path, "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        self.is_leader = True
+        return True
+
+    def _run(self):
+        for func in self.startup:
+            try:
+                func()
+            except Exception as e:
+                print(f"Scheduler Startup Error: {e}")
+        needs_leader = any(job["leader_only"] for job in self.jobs.values())
+        while True:
+            leader = self.try_lead() if needs_leader else False
+            now = time.monotonic()
+            for name, job in self.jobs.items():
+                if job["next_run"] > now:
+                    continue
+                if job["leader_only"] and not leader:
+                    job["next_run"] = now + self.jittered(job["interval"])
+                    continue
+                self.run_job(name)
+            next_due = min((job["next_run"] for job in self.jobs.values()), default=now + self.tick)
+            time.sleep(min(self.tick, max(next_due - time.monotonic(), 0.05)))
+
+    def run_job(self, name):
+        job = self.jobs[name]
+        metrics = job["metrics"]
+        budget = JobBudget(job["budget"])
+        metrics["last_started"] = datetime.now().isoformat()
+        try:
+            metrics["last_result"] = job["func"](budget)
+            metrics["last_error"] = None
+        except Exception as e:
+            metrics["failures"] += 1
+            metrics["last_error"] = str(e)
+            print(f"Scheduled Job Error ({name}): {e}")
+        duration = time.monotonic() - budget.started
+        metrics["runs"] += 1
+        metrics["last_duration"] = round(duration, 4)
+        metrics["max_duration"] = round(max(metrics["max_duration"], duration), 4)
+        if duration > job["budget"]:
+            metrics["over_budget"] += 1
+        job["next_run"] = time.monotonic() + self.jittered(job["interval"])
+
+    def stats(self):
+        now = time.monotonic()
+        return {
+            "pid": os.getpid(),
+            "leader": self.is_leader,
+            "jobs": {
+                name: dict(job["metrics"], interval=job["interval"], budget=job["budget"],
+                           leader_only=job["leader_only"], next_run_in=round(max(job["next_run"] - now, 0), 1))
+                for name, job in self.jobs.items()
+            }
+        }
+
+_compaction_state = {"inode": None, "clean_upto": 0}
+
+def compact_energy_records(budget):
+    """Scheduled job: drop blank and corrupt lines (e.g. a write torn by a crash)
+    from energy_records.txt. Verified prefixes are remembered, so each run only
+    scans what was appended since and a scan cut short by the budget resumes."""
+    path = "energy_records.txt"
     try:
-        with open("user_data.txt", "r") as f:
-            for line in f:
+        st = os.stat(path)
+    except OSError:
+        return {"scanned": 0}
+    if st.st_ino != _compaction_state["inode"] or st.st_size < _compaction_state["clean_upto"]:
+        _compaction_state.update(inode=st.st_ino, clean_upto=0)
+    
+    bad_lines = 0
+    scanned = 0
+    with open(path, "rb") as f:
+        f.seek(_compaction_state["clean_upto"])
+        for line in f:
+            if not line.endswith(b"\n"):
+                break  # tail still being written or torn; decided under the lock below
+            scanned += 1
+            try:
                 if line.strip():
-                    parts = line.strip().split("|")
-                    if len(parts) >= 7:
-                        username = parts[0]
-                        data[username] = {
-                            "total_energy_wh": float(parts[1]),
-                            "reward_points": float(parts[2]),
-                            "pressure_given": float(parts[3]),
-                            "ampere": float(parts[4]),
-                            "voltage": float(parts[5]),
-                            "tiles_visited": int(parts[6]),
-                            "total_steps": int(parts[7]) if len(parts) > 7 else 0,
-                            "assigned_location": parts[8] if len(parts) > 8 else None
-                        }
-    except:
-        pass
-    return data
+                    json.loads(line)
+                else:
+                    bad_lines += 1
+            except ValueError:
+                bad_lines += 1
+            if not bad_lines:
+                _compaction_state["clean_upto"] += len(line)
+            if budget.expired():
+                return {"scanned": scanned, "complete": False}
+    if not bad_lines:
+        return {"scanned": scanned, "complete": True, "removed": 0}
+    
+    removed = 0
+    with user_data_lock():
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(path, "rb") as src, open(tmp_path, "wb") as dst:
+            for line in src:
+                try:
+                    if line.endswith(b"\n") and line.strip():
+                        json.loads(line)
+                        dst.write(line)
+                        continue
+                except ValueError:
+                    pass
+                removed += 1
+        # Checkpoints hold byte offsets into the old file; drop them until a new one is written
+        for old_path in glob.glob(os.path.join(CHECKPOINT_DIR, "state-*.snap")):
+            os.remove(old_path)
+        os.replace(tmp_path, path)
+    _last_checkpoint_stamp["stamp"] = None
+    write_checkpoint()
+    _compaction_state.update(inode=None, clean_upto=0)
+    return {"scanned": scanned, "complete": True, "removed": removed}
 
-def save_user_data(data):
-    """Save user data to persistent storage"""
-    with open("user_data.txt", "w") as f:
-        for username in data:
-            user = data[username]
-            f.write(f"{username}|{user['total_energy_wh']}|{user['reward_points']}|{user.get('pressure_given', 0)}|{user.get('ampere', 0)}|{user.get('voltage', 0)}|{user.get('tiles_visited', 0)}|{user.get('total_steps', 0)}|{user.get('assigned_location', '')}\n")
+def expire_mfa_sessions(budget):
+    """Scheduled job: drop MFA sessions older than MFA_SESSION_TTL"""
+    cutoff = datetime.now().timestamp() - MFA_SESSION_TTL
+    with mfa_sessions_lock():
+        sessions = load_mfa_sessions()
+        live = {sid: s for sid, s in sessions.items() if s["timestamp"] >= cutoff}
+        if len(live) != len(sessions):
+            save_mfa_sessions(live)
+    return {"expired": len(sessions) - len(live), "active": len(live)}
 
-def load_energy_records():
-    """Load IoT energy tile records"""
-    records = []
+def prune_flask_sessions(budget, session_dir):
+    """Scheduled job: delete expired server-side session files. Each file starts
+    with its expiry as a 4-byte timestamp (0 = never expires)."""
+    now = time.time()
+    removed = 0
+    kept = 0
     try:
-        with open("energy_records.txt", "r") as f:
-            for line in f:
-                if line.strip():
-                    records.append(json.loads(line))
-    except:
-        pass
-    return records
+        entries = os.scandir(session_dir)
+    except OSError:
+        return {"removed": 0, "kept": 0}
+    with entries:
+        for entry in entries:
+            if budget.expired():
+                break
+            if not entry.is_file() or entry.name.startswith("__"):
+                continue
+            try:
+                with open(entry.path, "rb") as f:
+                    expires = struct.unpack("I", f.read(4))[0]
+                if expires != 0 and expires < now:
+                    os.remove(entry.path)
+                    removed += 1
+                    continue
+            except (OSError, struct.error):
+                continue
+            kept += 1
+    return {"removed": removed, "kept": kept}
 
-def save_energy_record(record):
-    """Save IoT sensor data"""
-    with open("energy_records.txt", "a") as f:
-        f.write(json.dumps(record) + "\n")
+def refresh_aggregates(budget):
+    """Scheduled job (every worker): rebuild derived read models after data
+    changes so requests find them ready instead of rebuilding inline"""
+    load_user_data_cached()
+    get_leaderboard_order()
+    get_mapped_user_data()
+    get_tile_snapshot()
+    get_tile_index()
+    return {"users": len(load_user_data_cached())}
 
-def calculate_reward_points(electricity_wh):
-    """Convert electricity generated to reward points
-    Formula: 1 Wh = 100 reward points"""
-    return round(electricity_wh * 100, 2)
+def restore_state():
+    if _user_data_cache["stamp"] is not None and _user_data_cache["stamp"] == get_user_data_stamp():
+        return  # already warm, e.g. loaded before the fork with --preload
+    try:
+        restore_from_checkpoint()
+    except Exception as e:
+        print(f"Checkpoint Restore Error: {e}")
 
-def get_tier(reward_points):
-    """Get user tier based on reward points"""
-    if reward_points >= 100000:
-        return "💎 Platinum Contributor"
-    elif reward_points >= 50000:
-        return "🏆 Gold Contributor"
-    elif reward_points >= 20000:
-        return "🥈 Silver Contributor"
-    elif reward_points >= 10000:
-        return "🥉 Bronze Contributor"
-    elif reward_points >= 5000:
-        return "⚡ Energy Generator"
+def create_scheduler(session_dir):
+    scheduler = Scheduler()
+    if WORKER_ROLE == "reader":
+        # Readers only follow published snapshots; maintenance is the writers' job
+        scheduler.add_job("refresh_replica", refresh_replica, REPLICA_REFRESH_INTERVAL, budget=5, leader_only=False)
     else:
-        return "🔋 Starter"
+        scheduler.on_start(restore_state)
+        if CHECKPOINT_INTERVAL > 0:
+            scheduler.add_job("checkpoint", checkpoint_job, CHECKPOINT_INTERVAL, budget=60)
+        if WORKER_ROLE == "writer":
+            scheduler.add_job("publish_snapshot", publish_snapshot, SNAPSHOT_PUBLISH_INTERVAL, budget=30)
+        scheduler.add_job("compact_energy_records", compact_energy_records, COMPACTION_INTERVAL, budget=30)
+        scheduler.add_job("expire_mfa_sessions", expire_mfa_sessions, 60, budget=5)
+        scheduler.add_job("prune_flask_sessions", lambda budget: prune_flask_sessions(budget, session_dir),
+                          SESSION_PRUNE_INTERVAL, budget=10)
+        scheduler.add_job("refresh_aggregates", refresh_aggregates, AGGREGATE_REFRESH_INTERVAL, budget=10, leader_only=False)
+    scheduler.add_job("roll_leaderboard_periods", roll_leaderboard_periods, PERIOD_REFRESH_INTERVAL, budget=10, leader_only=False)
+    scheduler.add_job("refresh_heatmap", refresh_heatmap, HEATMAP_REFRESH_INTERVAL, budget=10, leader_only=False)
+    return scheduler
+
+_background_services = {"pid": None, "scheduler": None, "outbox": None}
+_background_services_lock = threading.Lock()
+
+@bp.before_app_request
+def ensure_background_services():
+    """Start the scheduler and email outbox once per worker process (they do the work, not the request)"""
+    if _background_services["pid"] == os.getpid():
+        return
+    with _background_services_lock:
+        if _background_services["pid"] == os.getpid():
+            return
+        _background_services["pid"] = os.getpid()
+        if SCHEDULER_ENABLED:
+            _background_services["scheduler"] = create_scheduler(current_app.config["SESSION_FILE_DIR"])
+            _background_services["scheduler"].start()
+        if SMTP_HOST:
+            _background_services["outbox"] = EmailOutbox(SmtpPool())
 
 
 # ============= AUTHENTICATION DECORATORS & UTILITIES =============
@@ -262,7 +4083,7 @@ def admin_login_required(f):
 
 
 # ============= AUTHENTICATION ROUTES =============
-@app.route("/login", methods=["GET", "POST"])
+@bp.route("/login", methods=["GET", "POST"])
 def login():
     """User login page"""
     if request.method == "POST":
@@ -284,7 +4105,7 @@ def login():
     return render_template("login.html")
 
 
-@app.route("/admin-login", methods=["GET", "POST"])
+@bp.route("/admin-login", methods=["GET", "POST"])
 def admin_login():
     """Admin login page"""
     if request.method == "POST":
@@ -294,22 +4115,28 @@ def admin_login():
         admin_credentials = load_admin_credentials()
         
         if admin_username in admin_credentials and verify_password(admin_credentials[admin_username]["password_hash"], admin_password):
-            # Generate OTP for MFA - Fixed OTP for admin: 000000
-            otp_code = "000000"
+            # Generate OTP for MFA - emailed when SMTP is configured, otherwise fixed: 000000
+            otp_code = f"{secrets.randbelow(1000000):06d}" if _background_services["outbox"] else "000000"
             mfa_session_id = secrets.token_hex(16)
             
-            mfa_sessions = load_mfa_sessions()
-            mfa_sessions[mfa_session_id] = {
-                "username": admin_username,
-                "user_type": "admin",
-                "otp": otp_code,
-                "timestamp": datetime.now().timestamp()
-            }
-            save_mfa_sessions(mfa_sessions)
+            with mfa_sessions_lock():
+                mfa_sessions = load_mfa_sessions()
+                mfa_sessions[mfa_session_id] = {
+                    "username": admin_username,
+                    "user_type": "admin",
+                    "otp": otp_code,
+                    "timestamp": datetime.now().timestamp()
+                }
+                save_mfa_sessions(mfa_sessions)
             
             session['mfa_session_id'] = mfa_session_id
+            session['mfa_sent_at'] = time.time()
             
-            print(f"[DEBUG] MFA OTP for admin {admin_username}: {otp_code}")
+            if _background_services["outbox"]:
+                if not send_otp_email(admin_credentials[admin_username]["email"], otp_code):
+                    return render_template("admin_login.html", error="Could not send the login code. Please try again.")
+            else:
+                print(f"[DEBUG] MFA OTP for admin {admin_username}: {otp_code}")
             
             return redirect('/verify-mfa?user_type=admin&username=' + admin_username)
         else:
@@ -318,7 +4145,7 @@ def admin_login():
     return render_template("admin_login.html")
 
 
-@app.route("/verify-mfa", methods=["GET", "POST"])
+@bp.route("/verify-mfa", methods=["GET", "POST"])
 def verify_mfa():
     """MFA verification page"""
     if request.method == "POST":
@@ -339,8 +4166,7 @@ def verify_mfa():
             email_otp = request.form.get("email_otp")
             if email_otp == mfa_data["otp"]:
                 # Clear MFA session
-                del mfa_sessions[mfa_session_id]
-                save_mfa_sessions(mfa_sessions)
+                consume_mfa_session(mfa_session_id)
                 
                 # Create user session
                 session['username'] = mfa_data['username']
@@ -362,11 +4188,11 @@ def verify_mfa():
             if mfa_data['user_type'] == 'user' and mfa_data['username'] in users:
                 user = users[mfa_data['username']]
                 if user.get('mfa_secret'):
+                    import pyotp
                     totp = pyotp.TOTP(user['mfa_secret'])
                     if totp.verify(totp_code):
                         # Clear MFA session
-                        del mfa_sessions[mfa_session_id]
-                        save_mfa_sessions(mfa_sessions)
+                        consume_mfa_session(mfa_session_id)
                         
                         # Create user session
                         session['username'] = mfa_data['username']
@@ -381,10 +4207,25 @@ def verify_mfa():
     user_type = request.args.get("user_type", "user")
     username = request.args.get("username", "")
     
-    return render_template("mfa.html", user_type=user_type, username=username)
+    can_resend = _background_services["outbox"] is not None
+    if request.args.get("resend") and can_resend:
+        # Email the pending OTP again, at most once per OTP_RESEND_INTERVAL
+        mfa_data = load_mfa_sessions().get(session.get('mfa_session_id'))
+        if mfa_data is None:
+            return render_template("mfa.html", user_type=user_type, username=username,
+                                 error="MFA session expired. Please login again.")
+        if time.time() - session.get('mfa_sent_at', 0) < OTP_RESEND_INTERVAL:
+            return render_template("mfa.html", user_type=user_type, username=username, can_resend=True,
+                                 error=f"Please wait {OTP_RESEND_INTERVAL} seconds before asking for another code.")
+        email = load_admin_credentials().get(mfa_data["username"], {}).get("email") if mfa_data["user_type"] == "admin" \
+            else load_users().get(mfa_data["username"], {}).get("email")
+        if send_otp_email(email, mfa_data["otp"]):
+            session['mfa_sent_at'] = time.time()
+    
+    return render_template("mfa.html", user_type=user_type, username=username, can_resend=can_resend)
 
 
-@app.route("/register", methods=["GET", "POST"])
+@bp.route("/register", methods=["GET", "POST"])
 def register():
     """User registration page"""
     if request.method == "POST":
@@ -435,7 +4276,7 @@ def register():
     return render_template("register.html")
 
 
-@app.route("/admin-register", methods=["GET", "POST"])
+@bp.route("/admin-register", methods=["GET", "POST"])
 def admin_register():
     """Admin registration page"""
     if request.method == "POST":
@@ -471,36 +4312,41 @@ def admin_register():
     return render_template("admin_register.html")
 
 
-@app.route("/logout")
+@bp.route("/logout")
 def logout():
     """Logout user"""
     session.clear()
     return redirect('/login')
 
 
-@app.route("/admin-logout")
+@bp.route("/admin-logout")
 def admin_logout():
     """Logout admin"""
     session.clear()
     return redirect('/admin-login')
 
 
-@app.route("/admin-panel")
+@bp.route("/admin-panel")
 @admin_login_required
 def admin_panel():
     """Admin dashboard"""
-    user_data = load_user_data()
+    return cached_page(("admin_panel", session.get('username')), build_admin_panel)
+
+
+def build_admin_panel():
+    """Render the admin dashboard from current user data and tiles"""
+    user_data = load_user_data_cached()
     
     total_users = len(user_data)
-    total_energy = sum(u["total_energy_wh"] for u in user_data.values())
-    total_points = sum(u["reward_points"] for u in user_data.values())
-    total_pressure = sum(u.get("pressure_given", 0) for u in user_data.values())
-    total_ampere = sum(u.get("ampere", 0) for u in user_data.values())
-    total_voltage = sum(u.get("voltage", 0) for u in user_data.values())
+    total_energy = user_data.total("total_energy_wh")
+    total_points = user_data.total("reward_points")
+    total_pressure = user_data.total("pressure_given")
+    total_ampere = user_data.total("ampere")
+    total_voltage = user_data.total("voltage")
     
-    sorted_users = sorted(user_data.items(), key=lambda x: x[1]["reward_points"], reverse=True)[:10]
-    top_users = []
-    for rank, (username, data) in enumerate(sorted_users, 1):
+    top_user_rows = []
+    for rank, username in enumerate(get_leaderboard_order()[:10], 1):
+        data = user_data[username]
         # Ensure all fields have defaults
         data_with_defaults = {
             "total_energy_wh": data.get("total_energy_wh", 0),
@@ -509,7 +4355,8 @@ def admin_panel():
             "ampere": data.get("ampere", 0),
             "voltage": data.get("voltage", 0)
         }
-        top_users.append((rank, username, data_with_defaults))
+        top_user_rows.append(render_fragment("fragments/admin_user_row.html",
+            rank=rank, username=username, data=data_with_defaults))
     
     # Convert tiles dict to list for template
     tiles_list = []
@@ -522,6 +4369,7 @@ def admin_panel():
             "radius": tile["radius"],
             "capacity": tile["capacity"]
         })
+    tile_rows = [render_fragment("fragments/admin_tile_row.html", tile=tile) for tile in tiles_list]
     
     return render_template("admin_panel.html",
         total_users=total_users,
@@ -530,27 +4378,41 @@ def admin_panel():
         total_pressure=round(total_pressure, 2),
         total_ampere=round(total_ampere, 2),
         total_voltage=round(total_voltage, 2),
-        top_users=top_users,
-        energy_tiles=tiles_list
+        top_user_rows=top_user_rows,
+        energy_tiles=tiles_list,
+        tile_rows=tile_rows
     )
 
 
-@app.route("/manage-locations")
+@bp.route("/admin/quarantine")
+@admin_login_required
+def quarantine_view():
+    """Admin view of readings held back by anomaly detection"""
+    try:
+        limit = parse_result_limit(request.args.get("limit"), 200)
+    except ValueError:
+        return jsonify({"status": "error", "message": "limit must be an integer"}), 400
+    readings = load_quarantined_readings(limit)
+    if request.args.get("format") == "json":
+        return jsonify(readings)
+    return render_template("quarantine.html", readings=readings)
+
+
+@bp.route("/manage-locations")
 @admin_login_required
 def manage_locations():
     """Admin location management page"""
     return render_template("manage_locations.html")
 
 
-@app.route("/choose-location")
+@bp.route("/choose-location")
 @login_required
 def choose_location():
     """User location selection page"""
     return render_template("choose_location.html", username=session['username'])
 
 
-
-@app.route("/", methods=["GET"])
+@bp.route("/", methods=["GET"])
 def home():
     # If not logged in, redirect to login
     if 'username' not in session or session.get('user_type') != 'user':
@@ -559,71 +4421,53 @@ def home():
     return render_template("home.html", username=session['username'])
 
 
-@app.route("/api/iot-sensor", methods=["POST"])
+@bp.route("/api/iot-sensor", methods=["POST"])
 def iot_sensor_endpoint():
     """IoT endpoint for sensors to submit energy data to a specific tile"""
     try:
-        data = request.get_json()
-        
-        username = data.get("username")
-        tile_id = data.get("tile_id")
-        electricity_wh = float(data.get("electricity_wh", 0))
-        user_lat = data.get("latitude")
-        user_lon = data.get("longitude")
-        
-        if not username or not tile_id:
-            return jsonify({"status": "error", "message": "Missing username or tile_id"}), 400
-        
-        # Load and verify tile exists
-        energy_tiles = load_energy_tiles()
-        if tile_id not in energy_tiles:
-            return jsonify({"status": "error", "message": "Invalid tile_id"}), 400
-        
-        tile_info = energy_tiles[tile_id]
-        
-        # Record sensor data
-        energy_record = {
-            "timestamp": datetime.now().isoformat(),
-            "username": username,
-            "tile_id": tile_id,
-            "tile_name": tile_info["name"],
-            "location": {"lat": user_lat, "lon": user_lon} if user_lat and user_lon else {},
-            "electricity_wh": round(electricity_wh, 4),
-            "tile_lat": tile_info["lat"],
-            "tile_lon": tile_info["lon"]
-        }
-        save_energy_record(energy_record)
-        
-        # Update user account
-        user_data = load_user_data()
-        if username not in user_data:
-            user_data[username] = {
-                "total_energy_wh": 0,
-                "reward_points": 0,
-                "pressure_given": 0,
-                "ampere": 0,
-                "voltage": 0,
-                "total_steps": 0
-            }
-        
-        reward_points = calculate_reward_points(electricity_wh)
-        user_data[username]["total_energy_wh"] += electricity_wh
-        user_data[username]["reward_points"] += reward_points
-        
-        save_user_data(user_data)
-        
-        return jsonify({
-            "status": "success",
-            "electricity_wh": round(electricity_wh, 4),
-            "reward_points": reward_points,
-            "tile_name": tile_info["name"]
-        })
+        reading = get_ingest_pipeline().run("iot", request.get_json())
+    except IngestError as e:
+        return ingest_error_response(e, {
+            "missing_fields": "Missing username or tile_id",
+            "invalid_tile": "Invalid tile_id"
+        }, {"status": "error"})
     except Exception as e:
         print(f"IoT Sensor Error: {e}")
         return jsonify({"status": "error", "message": str(e)}), 400
+    
+    return ingest_response(reading, {
+        "status": "success",
+        "electricity_wh": round(reading["electricity_wh"], 4),
+        "reward_points": reading["reward_points"],
+        "tile_name": reading["tile"]["name"]
+    })
+
+
+@bp.route("/api/footstep-samples", methods=["POST"])
+def footstep_samples_endpoint():
+    """IoT endpoint for raw piezo samples; the server integrates them into Wh
+    Sensors send: username, tile_id, sample_rate_hz, footsteps: [{voltage, current?, pressure?}]"""
+    try:
+        reading = get_ingest_pipeline().run("footsteps", request.get_json())
+    except IngestError as e:
+        return ingest_error_response(e, {
+            "missing_fields": "Missing username or tile_id",
+            "invalid_tile": "Invalid tile_id"
+        }, {"status": "error"})
+    except Exception as e:
+        print(f"Footstep Samples Error: {e}")
+        return jsonify({"status": "error", "message": str(e)}), 400
+    
+    return ingest_response(reading, {
+        "status": "success",
+        "footsteps": reading["footsteps"],
+        "electricity_wh": round(reading["electricity_wh"], 8),
+        "reward_points": reading["reward_points"],
+        "tile_name": reading["tile"]["name"]
+    })
 
 
-@app.route("/dashboard/<username>")
+@bp.route("/dashboard/<username>")
 @login_required
 def dashboard(username):
     """5️⃣ USER DASHBOARD - View energy, points, and rewards"""
@@ -631,17 +4475,15 @@ def dashboard(username):
     if session.get('username') != username:
         return redirect(f"/dashboard/{session['username']}")
     
-    user_data = load_user_data()
+    user = get_mapped_user_data().get(username)
     
-    if username not in user_data:
+    if user is None:
         return render_template("home.html", error="User not found")
     
-    user = user_data[username]
     tier = get_tier(user["reward_points"])
     
     # Get recent energy records
-    all_records = load_energy_records()
-    user_records = [r for r in all_records if r["username"] == username][-5:]
+    user_records = recent_user_records(username, 5)
     
     return render_template("dashboard.html", 
         username=username,
@@ -656,17 +4498,20 @@ def dashboard(username):
     )
 
 
-@app.route("/leaderboard")
+@bp.route("/leaderboard")
 def leaderboard():
     """Global leaderboard of top energy contributors"""
-    user_data = load_user_data()
-    
-    sorted_users = sorted(user_data.items(), 
-        key=lambda x: x[1]["reward_points"], reverse=True)
+    return cached_page(("leaderboard",), build_leaderboard)
+
+
+def build_leaderboard():
+    """Render the leaderboard page from current user data"""
+    user_data = load_user_data_cached()
     
-    leaderboard_data = []
-    for rank, (username, data) in enumerate(sorted_users, 1):
-        leaderboard_data.append({
+    leaderboard_rows = []
+    for rank, username in enumerate(get_leaderboard_order(), 1):
+        data = user_data[username]
+        leaderboard_rows.append(render_fragment("fragments/leaderboard_row.html", user={
             "rank": rank,
             "username": username,
             "energy_wh": round(data["total_energy_wh"], 2),
@@ -675,83 +4520,96 @@ def leaderboard():
             "ampere": data.get("ampere", 0),
             "voltage": data.get("voltage", 0),
             "tier": get_tier(data["reward_points"])
-        })
+        }))
     
-    return render_template("leaderboard.html", leaderboard=leaderboard_data)
+    return render_template("leaderboard.html", leaderboard_rows=leaderboard_rows)
+
+
+@bp.route("/api/leaderboard/<period>")
+def period_leaderboard(period):
+    """Top users for the current (or a past, ?key=) day, week or month"""
+    if period not in LEADERBOARD_PERIODS:
+        return jsonify({"status": "error", "message": f"period must be one of: {', '.join(LEADERBOARD_PERIODS)}"}), 404
+    try:
+        limit = parse_result_limit(request.args.get("limit"), 100)
+    except ValueError:
+        return jsonify({"status": "error", "message": "limit must be an integer"}), 400
+    boards = get_period_leaderboards()
+    key, frozen, entries = boards.standings(period, request.args.get("key"), limit)
+    if entries is None:
+        return jsonify({"status": "error", "message": f"No {period} leaderboard for {key}"}), 404
+    return jsonify({
+        "status": "success",
+        "period": period,
+        "key": key,
+        "frozen": frozen,
+        "past_periods": boards.frozen_keys(period),
+        "leaderboard": [{"rank": rank, "username": username, "points": round(points, 2)}
+                        for rank, (username, points) in enumerate(entries, 1)]
+    })
+
+
+@bp.route("/api/leaderboard/<period>/rank/<username>")
+def period_leaderboard_rank(period, username):
+    """A user's rank for the current (or a past, ?key=) day, week or month"""
+    if period not in LEADERBOARD_PERIODS:
+        return jsonify({"status": "error", "message": f"period must be one of: {', '.join(LEADERBOARD_PERIODS)}"}), 404
+    key, rank, points, total = get_period_leaderboards().user_rank(period, username, request.args.get("key"))
+    return jsonify({
+        "status": "success",
+        "period": period,
+        "key": key,
+        "username": username,
+        "rank": rank,
+        "points": round(points, 2),
+        "ranked_users": total
+    })
 
 
-@app.route("/energy-tiles")
+@bp.route("/energy-tiles")
 def energy_tiles():
     """View all available energy tile locations"""
-    tiles_list = []
+    return cached_page(("energy_tiles",), build_energy_tiles)
+
+
+def build_energy_tiles():
+    """Render the energy tiles page from the current tile registry"""
+    tile_cards = []
     energy_tiles_data = load_energy_tiles()
     for tile_id, info in energy_tiles_data.items():
-        tiles_list.append({
+        tile_cards.append(render_fragment("fragments/tile_card.html", tile={
             "id": tile_id,
             "name": info["name"],
             "lat": info["lat"],
             "lon": info["lon"],
             "capacity": info["capacity"]
-        })
-    return render_template("energy_tiles.html", tiles=tiles_list)
-
+        }))
+    return render_template("energy_tiles.html", tile_cards=tile_cards)
 
 
-@app.route("/add-tile", methods=["GET", "POST"])
+@bp.route("/add-tile", methods=["GET", "POST"])
 @admin_login_required
 def add_tile():
     """Admin route to add a new energy tile"""
     if request.method == "POST":
         try:
-            tile_name = request.form.get("tile_name")
-            latitude_str = request.form.get("latitude")
-            longitude_str = request.form.get("longitude")
-            radius_str = request.form.get("radius", "0.001")
-            capacity_str = request.form.get("capacity", "1000")
-            
-            if not tile_name or len(tile_name.strip()) == 0:
-                return jsonify({"status": "error", "message": "Tile name required"}), 400
-            
-            # Validate and convert coordinates
-            if not latitude_str or not longitude_str:
-                return jsonify({"status": "error", "message": "Latitude and Longitude are required"}), 400
-            
-            try:
-                latitude = float(latitude_str)
-                longitude = float(longitude_str)
-            except ValueError:
-                return jsonify({"status": "error", "message": "Latitude and Longitude must be numbers"}), 400
-            
-            if not (-90 <= latitude <= 90) or not (-180 <= longitude <= 180):
-                return jsonify({"status": "error", "message": "Invalid GPS coordinates"}), 400
-            
-            # Validate radius
-            try:
-                radius = float(radius_str)
-            except ValueError:
-                radius = 0.001
-            
-            # Validate capacity
-            try:
-                capacity = int(capacity_str)
-            except ValueError:
-                return jsonify({"status": "error", "message": "Capacity must be a whole number"}), 400
+            tile, error = validate_tile_fields(
+                request.form.get("tile_name"),
+                request.form.get("latitude"),
+                request.form.get("longitude"),
+                request.form.get("radius", "0.001"),
+                request.form.get("capacity", "1000")
+            )
+            if error:
+                return jsonify({"status": "error", "message": error}), 400
             
-            if capacity <= 0:
-                return jsonify({"status": "error", "message": "Capacity must be greater than 0"}), 400
-            
-            energy_tiles = load_energy_tiles()
-            tile_num = len(energy_tiles) + 1
-            tile_id = f"tile_{str(tile_num).zfill(3)}"
-            
-            energy_tiles[tile_id] = {
-                "name": tile_name,
-                "lat": latitude,
-                "lon": longitude,
-                "radius": radius,
-                "capacity": capacity
-            }
-            save_energy_tiles(energy_tiles)
+            with energy_tiles_lock():
+                energy_tiles = load_energy_tiles()
+                tile_id = f"tile_{str(next_tile_number(energy_tiles)).zfill(3)}"
+                
+                energy_tiles[tile_id] = tile
+                save_energy_tiles(energy_tiles)
+                record_tile_changes([("add", tile_id, tile)])
             
             return jsonify({"status": "success", "message": "Tile added successfully"})
         except Exception as e:
@@ -760,26 +4618,115 @@ def add_tile():
     return render_template("add_tile.html")
 
 
-@app.route("/remove-tile/<tile_id>", methods=["POST"])
+@bp.route("/api/tiles/import", methods=["POST"])
+@admin_login_required
+def bulk_import_tiles():
+    """Admin bulk tile import: CSV (default) or NDJSON body, ?dry_run=1 to validate only"""
+    fmt = request.args.get("format") or ("ndjson" if "ndjson" in (request.mimetype or "") else "csv")
+    if fmt not in ("csv", "ndjson"):
+        return jsonify({"status": "error", "message": "format must be csv or ndjson"}), 400
+    try:
+        lines = io.TextIOWrapper(request.stream, encoding="utf-8", newline="")
+        result = import_tiles(lines, fmt, dry_run=request.args.get("dry_run") == "1")
+    except Exception as e:
+        return jsonify({"status": "error", "message": f"Error importing tiles: {str(e)}"}), 500
+    result["status"] = "error" if result["errors"] else "success"
+    return jsonify(result), (400 if result["errors"] else 200)
+
+
+@bp.route("/api/tiles/export")
+@admin_login_required
+def bulk_export_tiles():
+    """Admin streaming tile export: ?format=csv|ndjson"""
+    fmt = request.args.get("format", "csv")
+    if fmt not in ("csv", "ndjson"):
+        return jsonify({"status": "error", "message": "format must be csv or ndjson"}), 400
+    mimetype = "application/x-ndjson" if fmt == "ndjson" else "text/csv"
+    response = Response(stream_with_context(iter_tile_export(fmt)), mimetype=mimetype)
+    response.headers["Content-Disposition"] = f"attachment; filename=energy_tiles.{fmt}"
+    return response
+
+
+@bp.route("/remove-tile/<tile_id>", methods=["POST"])
 @admin_login_required
 def remove_tile(tile_id):
     """Admin route to remove an energy tile"""
     try:
-        energy_tiles = load_energy_tiles()
-        
-        if tile_id not in energy_tiles:
-            return jsonify({"status": "error", "message": "Tile not found"}), 404
-        
-        tile_name = energy_tiles[tile_id]["name"]
-        del energy_tiles[tile_id]
-        save_energy_tiles(energy_tiles)
+        with energy_tiles_lock():
+            energy_tiles = load_energy_tiles()
+            
+            if tile_id not in energy_tiles:
+                return jsonify({"status": "error", "message": "Tile not found"}), 404
+            
+            tile_name = energy_tiles[tile_id]["name"]
+            del energy_tiles[tile_id]
+            save_energy_tiles(energy_tiles)
+            record_tile_changes([("remove", tile_id, None)])
         
         return jsonify({"status": "success", "message": f"Tile '{tile_name}' removed successfully"})
     except Exception as e:
         return jsonify({"status": "error", "message": f"Error removing tile: {str(e)}"}), 500
 
 
-@app.route("/api/user-info")
+@bp.route("/api/ingest-shards")
+@admin_login_required
+def ingest_shards():
+    """Admin view of the sharded ingestion pool"""
+    router = get_ingest_router()
+    if router is None:
+        return jsonify({"enabled": False})
+    stats = router.stats()
+    stats["enabled"] = True
+    return jsonify(stats)
+
+
+@bp.route("/api/scheduler")
+@admin_login_required
+def scheduler_status():
+    """Admin view of background jobs in this worker"""
+    scheduler = _background_services["scheduler"]
+    if scheduler is None:
+        return jsonify({"enabled": False})
+    stats = scheduler.stats()
+    stats["enabled"] = True
+    return jsonify(stats)
+
+
+@bp.route("/api/email-outbox")
+@admin_login_required
+def email_outbox_status():
+    """Admin view of this worker's OTP email queue: depth, lag, retries, pool reuse"""
+    outbox = _background_services["outbox"]
+    if outbox is None:
+        return jsonify({"enabled": False})
+    stats = outbox.stats()
+    stats["enabled"] = True
+    return jsonify(stats)
+
+
+@bp.route("/api/read-replica")
+@admin_login_required
+def read_replica_status():
+    """Admin view of this worker's role and, for readers, the snapshot it serves"""
+    snapshot = _replica["snapshot"]
+    return jsonify({
+        "role": WORKER_ROLE,
+        "max_staleness": READ_MAX_STALENESS,
+        "snapshot": None if snapshot is None else {
+            "path": snapshot["path"],
+            "created": snapshot["created"],
+            "users": len(snapshot["users"]),
+            "staleness": round(time.time() - snapshot["confirmed_at"], 3)
+        },
+        "serving_snapshot": WORKER_ROLE == "reader" and snapshot is not None
+                            and time.time() - snapshot["confirmed_at"] <= READ_MAX_STALENESS,
+        "loads": _replica["loads"],
+        "fallbacks": _replica["fallbacks"],
+        "last_error": _replica["last_error"]
+    })
+
+
+@bp.route("/api/user-info")
 def get_user_info():
     """API endpoint to get current logged-in user info"""
     if 'username' not in session:
@@ -790,102 +4737,154 @@ def get_user_info():
     })
 
 
-@app.route("/api/get-tiles")
+@bp.route("/api/get-tiles")
 def get_tiles():
-    """API endpoint to get all energy tiles as JSON"""
-    energy_tiles = load_energy_tiles()
+    """API endpoint to get all energy tiles as JSON
+    Supports ETag/Last-Modified revalidation and ?since=<version> deltas"""
+    since = request.args.get("since")
+    if since is not None:
+        try:
+            since = int(since)
+        except ValueError:
+            return jsonify({"status": "error", "message": "since must be an integer version"}), 400
+        version = get_tile_version()
+        if since > version:
+            return jsonify({"status": "error", "message": "Unknown tile version"}), 400
+        delta = get_tile_delta(since)
+        delta.update({"version": version, "since": since})
+        response = jsonify(delta)
+        response.headers["X-Tiles-Version"] = str(version)
+        return response
     
-    tiles_list = []
-    for tile_id, tile in energy_tiles.items():
-        tiles_list.append({
-            "id": tile_id,
-            "name": tile["name"],
-            "lat": tile["lat"],
-            "lon": tile["lon"],
-            "radius": tile["radius"],
-            "capacity": tile["capacity"]
-        })
+    snapshot = get_tile_snapshot()
+    encoding = "identity"
+    if snapshot["br"] is not None and request.accept_encodings["br"]:
+        encoding = "br"
+    elif request.accept_encodings["gzip"]:
+        encoding = "gzip"
+    
+    response = current_app.response_class(snapshot[encoding], mimetype="application/json")
+    if encoding != "identity":
+        response.headers["Content-Encoding"] = encoding
+    response.headers["Vary"] = "Accept-Encoding"
+    response.headers["X-Tiles-Version"] = str(snapshot["version"])
+    response.headers["Cache-Control"] = "no-cache"
+    response.set_etag(f"{snapshot['etag']}-{encoding}")
+    if snapshot["last_modified"] is not None:
+        response.last_modified = snapshot["last_modified"]
+    return response.make_conditional(request)
+
+
+@bp.route("/api/tiles")
+def tiles_in_bbox():
+    """Tiles inside a viewport: ?bbox=minLat,minLon,maxLat,maxLon&limit="""
+    try:
+        bbox = parse_bbox(request.args.get("bbox", ""))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    try:
+        limit = parse_result_limit(request.args.get("limit"), MAX_TILE_RESULTS)
+    except ValueError:
+        return jsonify({"status": "error", "message": "limit must be an integer"}), 400
+    
+    index = get_tile_index()
+    # One extra tile tells a full last page apart from a truncated one
+    tile_ids = index.in_bbox(*bbox, limit + 1)
+    return jsonify({
+        "tiles": [tile_to_json(tile_id, index.tiles[tile_id]) for tile_id in tile_ids[:limit]],
+        "truncated": len(tile_ids) > limit
+    })
+
+
+@bp.route("/api/heatmap")
+def energy_heatmap():
+    """Energy generated per grid cell: ?bbox=minLat,minLon,maxLat,maxLon&zoom=&from=YYYY-MM-DD&to=YYYY-MM-DD"""
+    try:
+        min_lat, min_lon, max_lat, max_lon = parse_bbox(request.args.get("bbox", ""))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    try:
+        zoom = min(max(int(request.args.get("zoom", 12)), 0), HEATMAP_MAX_ZOOM)
+        date_from = datetime.fromisoformat(request.args["from"]).date().isoformat() if request.args.get("from") else None
+        date_to = datetime.fromisoformat(request.args["to"]).date().isoformat() if request.args.get("to") else None
+    except ValueError:
+        return jsonify({"status": "error", "message": "zoom must be an integer and from/to ISO dates"}), 400
+    
+    min_lat, max_lat = max(min_lat, -90.0), min(max_lat, 89.999999)
+    min_lon, max_lon = max(min_lon, -180.0), min(max_lon, 179.999999)
+    zoom, cells = get_energy_heatmap().query(min_lat, min_lon, max_lat, max_lon, zoom, date_from, date_to)
+    size = heatmap_cell_size(zoom)
+    return jsonify({
+        "status": "success",
+        "zoom": zoom,
+        "cell_deg": size,
+        "from": date_from,
+        "to": date_to,
+        "max_energy_wh": round(max((energy for _, _, energy, _ in cells), default=0), 6),
+        "cells": [{
+            "lat": round(row * size - 90 + size / 2, 6),
+            "lon": round(col * size - 180 + size / 2, 6),
+            "energy_wh": round(energy, 6),
+            "readings": readings
+        } for row, col, energy, readings in cells]
+    })
+
+
+@bp.route("/api/tiles/nearest")
+def nearest_tiles():
+    """The k tiles closest to ?lat=&lon=, ranked by calculate_distance"""
+    try:
+        lat = float(request.args.get("lat"))
+        lon = float(request.args.get("lon"))
+        k = parse_result_limit(request.args.get("k"), 5)
+    except (TypeError, ValueError):
+        return jsonify({"status": "error", "message": "lat and lon are required numbers"}), 400
+    if not (-90 <= lat <= 90) or not (-180 <= lon <= 180):
+        return jsonify({"status": "error", "message": "Invalid GPS coordinates"}), 400
     
-    return jsonify(tiles_list)
+    index = get_tile_index()
+    results = []
+    for distance, tile_id in index.nearest(lat, lon, k):
+        tile = tile_to_json(tile_id, index.tiles[tile_id])
+        tile["distance_km"] = round(distance, 4)
+        results.append(tile)
+    return jsonify({"tiles": results})
 
 
-@app.route("/add-energy", methods=["POST"])
+@bp.route("/add-energy", methods=["POST"])
 def add_energy():
     """IoT endpoint to submit sensor energy data and configuration"""
     try:
-        data = request.get_json()
-        
-        username = data.get("username")
-        tile_id = data.get("selectedTile")
-        electricity_wh = float(data.get("electricity", 0))
-        latitude = data.get("latitude")
-        longitude = data.get("longitude")
-        
-        if not username or not tile_id:
-            return jsonify({"success": False, "message": "Missing username or tile"}), 400
-        
-        # Load and verify tile exists
-        energy_tiles = load_energy_tiles()
-        if tile_id not in energy_tiles:
-            return jsonify({"success": False, "message": "Invalid tile"}), 400
-        
-        tile_info = energy_tiles[tile_id]
-        
-        # Record sensor data
-        energy_record = {
-            "timestamp": datetime.now().isoformat(),
-            "username": username,
-            "tile_id": tile_id,
-            "tile_name": tile_info["name"],
-            "location": {"lat": latitude, "lon": longitude} if latitude and longitude else {},
-            "electricity_wh": round(electricity_wh, 4),
-            "tile_lat": tile_info["lat"],
-            "tile_lon": tile_info["lon"]
-        }
-        save_energy_record(energy_record)
-        
-        # Update user account
-        user_data = load_user_data()
-        if username not in user_data:
-            user_data[username] = {
-                "total_energy_wh": 0,
-                "reward_points": 0,
-                "pressure_given": 0,
-                "ampere": 0,
-                "voltage": 0,
-                "total_steps": 0
-            }
-        
-        reward_points = calculate_reward_points(electricity_wh)
-        user_data[username]["total_energy_wh"] += electricity_wh
-        user_data[username]["reward_points"] += reward_points
-        user_data[username]["tiles_visited"] = user_data[username].get("tiles_visited", 0) + 1
-        
-        save_user_data(user_data)
-        
-        return jsonify({
-            "success": True,
-            "message": "Thank you for your cooperation!",
-            "electricity_wh": round(electricity_wh, 4),
-            "reward_points": int(reward_points),
-            "tile_name": tile_info["name"],
-            "username": username
-        })
+        reading = get_ingest_pipeline().run("add_energy", request.get_json())
+    except IngestError as e:
+        return ingest_error_response(e, {
+            "missing_fields": "Missing username or tile",
+            "invalid_tile": "Invalid tile"
+        }, {"success": False})
     except Exception as e:
         print(f"Add Energy Error: {e}")
         return jsonify({"success": False, "message": str(e)}), 400
+    
+    return ingest_response(reading, {
+        "success": True,
+        "message": "Thank you for your cooperation!",
+        "electricity_wh": round(reading["electricity_wh"], 4),
+        "reward_points": int(reading["reward_points"]),
+        "tile_name": reading["tile"]["name"],
+        "username": reading["username"]
+    })
 
 
 # ============= LOCATION MANAGEMENT ROUTES =============
-@app.route("/api/get-users")
+@bp.route("/api/get-users")
 @admin_login_required
 def get_users():
     """Get all registered users for admin"""
     try:
         users = load_users()
+        user_data = load_user_data_cached()
         users_list = []
         for username in users:
-            user_data = load_user_data()
             user_info = user_data.get(username, {})
             users_list.append({
                 "username": username,
@@ -898,7 +4897,7 @@ def get_users():
         return jsonify({"error": str(e)}), 400
 
 
-@app.route("/api/assign-location", methods=["POST"])
+@bp.route("/api/assign-location", methods=["POST"])
 @admin_login_required
 def assign_location():
     """Admin assigns a location to a user"""
@@ -949,7 +4948,77 @@ def assign_location():
         return jsonify({"status": "error", "message": str(e)}), 400
 
 
-@app.route("/api/user-location/<username>")
+@bp.route("/api/assign-locations", methods=["POST"])
+@admin_login_required
+def bulk_assign_locations():
+    """Admin bulk assignment: {"users": [...]} and/or {"bbox": ...}, "reassign", "dry_run"."""
+    data = request.get_json(silent=True) or {}
+    try:
+        bbox = parse_bbox(data["bbox"]) if data.get("bbox") else None
+        result = assign_users_to_tiles(data.get("users"), bbox, bool(data.get("reassign")), bool(data.get("dry_run")))
+    except (ValueError, TypeError) as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except Exception as e:
+        print(f"Bulk Assign Error: {e}")
+        return jsonify({"status": "error", "message": str(e)}), 500
+    result["status"] = "error" if result["errors"] else "success"
+    return jsonify(result), (400 if result["errors"] else 200)
+
+
+@bp.route("/api/energy-history/<username>")
+@login_required
+def energy_history(username):
+    """A user's energy records a page at a time: ?limit=&cursor=&from=&to=&order=desc|asc"""
+    if session.get('username') != username:
+        return jsonify({"status": "error", "message": "Unauthorized"}), 403
+    order = request.args.get("order", "desc")
+    if order not in ("desc", "asc"):
+        return jsonify({"status": "error", "message": "order must be desc or asc"}), 400
+    try:
+        limit = max(1, min(int(request.args.get("limit", HISTORY_PAGE_SIZE)), HISTORY_MAX_PAGE))
+        start = parse_history_bound(request.args.get("from"), False)
+        end = parse_history_bound(request.args.get("to"), True)
+    except ValueError:
+        return jsonify({"status": "error", "message": "limit must be an integer and from/to ISO dates"}), 400
+    positions = None
+    if request.args.get("cursor"):
+        try:
+            positions = decode_history_cursor(request.args["cursor"], order)
+        except ValueError as e:
+            return jsonify({"status": "error", "message": str(e)}), 400
+    
+    records, positions = user_history_page(username, limit, order, start, end, positions)
+    return jsonify({
+        "status": "success",
+        "username": username,
+        "order": order,
+        "records": records,
+        "next_cursor": encode_history_cursor(order, positions) if positions else None
+    })
+
+
+@bp.route("/api/energy-history/<username>/export")
+@login_required
+def export_energy_history(username):
+    """Stream a user's whole energy history, oldest first: ?format=csv|ndjson&from=&to="""
+    if session.get('username') != username:
+        return jsonify({"status": "error", "message": "Unauthorized"}), 403
+    fmt = request.args.get("format", "csv")
+    if fmt not in ("csv", "ndjson"):
+        return jsonify({"status": "error", "message": "format must be csv or ndjson"}), 400
+    try:
+        start = parse_history_bound(request.args.get("from"), False)
+        end = parse_history_bound(request.args.get("to"), True)
+    except ValueError:
+        return jsonify({"status": "error", "message": "from/to must be ISO dates"}), 400
+    mimetype = "application/x-ndjson" if fmt == "ndjson" else "text/csv"
+    response = Response(stream_with_context(iter_history_export(username, fmt, start, end)), mimetype=mimetype)
+    filename = re.sub(r"[^A-Za-z0-9_.-]", "_", username)
+    response.headers["Content-Disposition"] = f"attachment; filename={filename}-energy-history.{fmt}"
+    return response
+
+
+@bp.route("/api/user-location/<username>")
 @login_required
 def get_user_location(username):
     """Get user's assigned location"""
@@ -982,7 +5051,7 @@ def get_user_location(username):
         return jsonify({"error": str(e)}), 400
 
 
-@app.route("/api/set-user-location", methods=["POST"])
+@bp.route("/api/set-user-location", methods=["POST"])
 @login_required
 def set_user_location():
     """Allow user to set/change their own location"""
@@ -1027,118 +5096,89 @@ def set_user_location():
         return jsonify({"status": "error", "message": str(e)}), 400
 
 
-@app.route("/api/submit-sensor-data", methods=["POST"])
+@bp.route("/api/submit-sensor-data", methods=["POST"])
 def submit_sensor_data():
     """Hardware sensor endpoint - submits location & energy data
     Hardware sends: username, latitude, longitude, electricity_wh, total_steps
     System checks if location matches assigned tile and returns stats
     """
     try:
-        data = request.get_json()
-        
-        username = data.get("username")
-        hardware_lat = float(data.get("latitude", 0))
-        hardware_lon = float(data.get("longitude", 0))
-        electricity_wh = float(data.get("electricity_wh", 0))
-        total_steps = int(data.get("total_steps", 0))
-        
-        if not username:
-            return jsonify({"status": "error", "message": "Username required"}), 400
-        
-        # Get user's assigned location
-        user_data = load_user_data()
-        if username not in user_data:
-            user_data[username] = {
-                "total_energy_wh": 0,
-                "reward_points": 0,
-                "pressure_given": 0,
-                "ampere": 0,
-                "voltage": 0,
-                "tiles_visited": 0,
-                "total_steps": 0,
-                "assigned_location": None
-            }
-        
-        assigned_location = user_data[username].get("assigned_location")
-        location_match = False
-        tile_info = None
-        matched_tile_id = None
-        
-        # Check if location matches assigned tile
-        if assigned_location:
-            energy_tiles = load_energy_tiles()
-            if assigned_location in energy_tiles:
-                tile_info = energy_tiles[assigned_location]
-                # Check if hardware location is within tile radius
-                distance = calculate_distance(hardware_lat, hardware_lon, tile_info["lat"], tile_info["lon"])
-                if distance < (tile_info["radius"] * 111):  # 1 degree ≈ 111 km
-                    location_match = True
-                    matched_tile_id = assigned_location
-        
-        # Only record energy if location matches
-        if location_match and electricity_wh > 0:
-            # Record sensor data
-            energy_record = {
-                "timestamp": datetime.now().isoformat(),
-                "username": username,
-                "tile_id": matched_tile_id,
-                "tile_name": tile_info["name"],
-                "location": {"lat": hardware_lat, "lon": hardware_lon},
-                "electricity_wh": round(electricity_wh, 4),
-                "tile_lat": tile_info["lat"],
-                "tile_lon": tile_info["lon"]
-            }
-            save_energy_record(energy_record)
-            
-            # Update user stats
-            reward_points = calculate_reward_points(electricity_wh)
-            user_data[username]["total_energy_wh"] += electricity_wh
-            user_data[username]["reward_points"] += reward_points
-            user_data[username]["total_steps"] = total_steps  # Update step count
-            
-            save_user_data(user_data)
-            
-            return jsonify({
-                "status": "success",
-                "location_match": True,
-                "message": "Energy recorded successfully!",
-                "tile_name": tile_info["name"],
-                "electricity_wh": round(electricity_wh, 4),
-                "reward_points": int(reward_points),
-                "total_steps": total_steps,
-                "total_energy_wh": round(user_data[username]["total_energy_wh"], 4),
-                "total_reward_points": int(user_data[username]["reward_points"])
-            })
-        else:
-            # Update steps even if no energy or location mismatch
-            if total_steps > 0:
-                user_data[username]["total_steps"] = total_steps
-                save_user_data(user_data)
-            
-            if not location_match:
-                return jsonify({
-                    "status": "warning",
-                    "location_match": False,
-                    "message": "Location does not match assigned tile. No energy recorded.",
-                    "assigned_location": tile_info["name"] if tile_info else "Not assigned",
-                    "total_steps": total_steps,
-                    "electricity_wh": 0,
-                    "reward_points": 0
-                })
-            else:
-                return jsonify({
-                    "status": "success",
-                    "location_match": True if location_match else False,
-                    "message": "Data received",
-                    "electricity_wh": 0,
-                    "total_steps": total_steps
-                })
+        reading = get_ingest_pipeline().run("sensor", request.get_json())
+    except IngestError as e:
+        return ingest_error_response(e, {"missing_fields": "Username required"}, {"status": "error"})
     except Exception as e:
         print(f"Submit Sensor Data Error: {e}")
         return jsonify({"status": "error", "message": str(e)}), 400
+    
+    total_steps = reading["total_steps"]
+    if reading["credited"]:
+        return ingest_response(reading, {
+            "status": "success",
+            "location_match": True,
+            "message": "Energy recorded successfully!",
+            "tile_name": reading["tile"]["name"],
+            "electricity_wh": round(reading["electricity_wh"], 4),
+            "reward_points": int(reading["reward_points"]),
+            "total_steps": total_steps,
+            "total_energy_wh": round(reading["user"]["total_energy_wh"], 4),
+            "total_reward_points": int(reading["user"]["reward_points"])
+        })
+    elif not reading["location_match"]:
+        return ingest_response(reading, {
+            "status": "warning",
+            "location_match": False,
+            "message": "Location does not match assigned tile. No energy recorded.",
+            "assigned_location": reading["tile"]["name"] if reading["tile"] else "Not assigned",
+            "total_steps": total_steps,
+            "electricity_wh": 0,
+            "reward_points": 0
+        })
+    else:
+        return ingest_response(reading, {
+            "status": "success",
+            "location_match": True,
+            "message": "Data received",
+            "electricity_wh": 0,
+            "total_steps": total_steps
+        })
 
-if __name__ == "__main__":
-    app.run(debug=True, host='0.0.0.0')
+# ============= APP FACTORY =============
+# Importing this module builds `app` (for `gunicorn app:app` and `flask --app
+# app`). With WARM_UP=on the read caches are built at import as well; under
+# `gunicorn --preload` that happens once in the master and the forked workers
+# share the loaded tables copy-on-write instead of each parsing the data
+# files on its first request.
+WARM_UP = os.environ.get("WARM_UP", "off") == "on"
 
+def warm_up():
+    """Build the caches a first request would otherwise build inline"""
+    ensure_default_tiles()
+    if WORKER_ROLE == "reader":
+        refresh_replica()
+    else:
+        restore_state()
+        refresh_aggregates(JobBudget(60))
+    for path in energy_record_logs():
+        get_record_index(path).refresh()
+    # Keep the collector from touching (and so un-sharing) these objects in forked workers
+    gc.freeze()
+
+def create_app(config=None, warm=None):
+    """Build the Flask app; warm defaults to the WARM_UP setting"""
+    from flask_session import Session
+    application = Flask(__name__)
+    application.config['SECRET_KEY'] = secrets.token_hex(32)
+    application.config['SESSION_TYPE'] = 'filesystem'
+    application.config['SESSION_FILE_DIR'] = os.path.join(os.getcwd(), "flask_session")
+    if config:
+        application.config.update(config)
+    Session(application)
+    application.register_blueprint(bp)
+    if WARM_UP if warm is None else warm:
+        warm_up()
+    return application
 
+app = create_app()
 
+if __name__ == "__main__":
+    app.run(debug=True, host='0.0.0.0')
@@ -0,0 +1,242 @@
+"""Micro-benchmarks for the energy tile server.
+
+Run from the project directory:
+
+    python benchmarks.py footsteps
+    python benchmarks.py startup --users 1000000
+    python benchmarks.py memory --users 1000000
+    python benchmarks.py recalculate --records 5000000
+"""
+import argparse
+import json
+import math
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import app
+
+
+def bench_footsteps(args):
+    """Per-sample cost of integrating raw piezo footstep traces"""
+    rng = random.Random(42)
+    samples = args.samples
+    footsteps = []
+    for _ in range(args.footsteps):
+        voltage = [30 * math.sin(math.pi * k / samples) + rng.gauss(0, 0.5) for k in range(samples)]
+        current = [v / app.PIEZO_LOAD_OHMS for v in voltage]
+        pressure = [60 * math.sin(math.pi * k / samples) for k in range(samples)]
+        footsteps.append({"voltage": voltage, "current": current, "pressure": pressure})
+    total_samples = samples * len(footsteps)
+
+    backends = [("numpy" if app.numpy is not None else "pure python", app.numpy)]
+    if app.numpy is not None:
+        backends.append(("pure python", None))
+    for label, numpy_module in backends:
+        saved, app.numpy = app.numpy, numpy_module
+        try:
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                energy_wh, _ = app.summarize_footsteps(footsteps, args.sample_rate)
+            elapsed = (time.perf_counter() - start) / args.repeat
+        finally:
+            app.numpy = saved
+        print(f"footsteps [{label}]: {len(footsteps)} x {samples} samples -> {energy_wh:.6f} Wh, "
+              f"{elapsed * 1e9 / total_samples:.1f} ns/sample, {total_samples / elapsed / 1e6:.2f} M samples/s")
+
+
+def write_records(path, count, users, rng):
+    """Synthetic energy records in the energy_records.txt shape"""
+    with open(path, "w") as f:
+        for i in range(count):
+            f.write(json.dumps({
+                "timestamp": f"2026-01-01T00:{(i // 60) % 60:02d}:{i % 60:02d}",
+                "username": f"user_{rng.randrange(users):07d}",
+                "tile_id": "tile_001",
+                "tile_name": "Main Building",
+                "location": {"lat": 12.9716, "lon": 77.5946},
+                "electricity_wh": round(rng.uniform(0, 2), 4),
+                "tile_lat": 12.9716,
+                "tile_lon": 77.5946
+            }) + "\n")
+
+
+def make_user_data(count, rng):
+    """Synthetic user aggregates in the user_data.txt shape"""
+    return {
+        f"user_{i:07d}": {
+            "total_energy_wh": rng.uniform(0, 500),
+            "reward_points": rng.uniform(0, 50000),
+            "pressure_given": rng.uniform(0, 1000),
+            "ampere": rng.uniform(0, 1),
+            "voltage": rng.uniform(0, 40),
+            "tiles_visited": rng.randint(0, 100),
+            "total_steps": rng.randint(0, 100000),
+            "assigned_location": f"tile_{rng.randint(1, 999):03d}"
+        }
+        for i in range(count)
+    }
+
+
+WORKER_PROBE = """
+import time
+start = time.perf_counter()
+import app
+loaded = time.perf_counter()
+client = app.app.test_client()
+with client.session_transaction() as s:
+    s["username"] = "user_0000001"
+    s["user_type"] = "user"
+ready = time.perf_counter()
+client.get("/dashboard/user_0000001")
+first = time.perf_counter()
+client.get("/dashboard/user_0000001")
+print(loaded - start, first - ready, time.perf_counter() - first)
+"""
+
+
+def probe_worker(warm):
+    """(import, first request, second request) seconds for a fresh interpreter"""
+    env = dict(os.environ, WARM_UP="on" if warm else "off", SCHEDULER="off",
+               PYTHONPATH=os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.run([sys.executable, "-c", WORKER_PROBE], env=env, check=True,
+                            capture_output=True, text=True).stdout
+    return [float(value) for value in output.split()[-3:]]
+
+
+def bench_startup(args):
+    """Cold start: parsing user_data.txt vs restoring from a checkpoint, and
+    import / first-request time of a worker with and without warm-up"""
+    workdir = tempfile.mkdtemp(prefix="efs-bench-")
+    cwd = os.getcwd()
+    try:
+        os.chdir(workdir)
+        app.save_user_data(make_user_data(args.users, random.Random(7)))
+        app.save_energy_tiles(app.DEFAULT_ENERGY_TILES)
+        write_records("energy_records.txt", args.users, args.users, random.Random(7))
+
+        start = time.perf_counter()
+        app.load_user_data()
+        text_seconds = time.perf_counter() - start
+
+        app.load_user_data_cached()
+        start = time.perf_counter()
+        path = app.write_checkpoint()
+        write_seconds = time.perf_counter() - start
+
+        app._user_data_cache.update(stamp=None, data=app.UserTable())
+        start = time.perf_counter()
+        mode = app.restore_from_checkpoint()
+        restore_seconds = time.perf_counter() - start
+
+        print(f"startup [{args.users} users]: text parse {text_seconds:.2f}s, "
+              f"checkpoint restore ({mode}) {restore_seconds:.2f}s, "
+              f"checkpoint write {write_seconds:.2f}s, "
+              f"user_data.txt {os.path.getsize('user_data.txt') / 1e6:.1f} MB, "
+              f"checkpoint {os.path.getsize(path) / 1e6:.1f} MB")
+
+        for warm in (False, True):
+            imported, first, second = probe_worker(warm)
+            print(f"startup [{args.users} users, WARM_UP={'on' if warm else 'off'}]: "
+                  f"import {imported * 1000:.0f}ms, first dashboard {first * 1000:.0f}ms, "
+                  f"second {second * 1000:.1f}ms")
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir)
+
+
+def measure_allocation(build):
+    """Bytes still allocated by the object build() returns"""
+    tracemalloc.start()
+    try:
+        result = build()
+        size = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return result, size
+
+
+def bench_memory(args):
+    """Resident size of user aggregates: dict-of-dicts vs the columnar UserTable"""
+    workdir = tempfile.mkdtemp(prefix="efs-bench-")
+    cwd = os.getcwd()
+    try:
+        os.chdir(workdir)
+        app.save_user_data(make_user_data(args.users, random.Random(7)))
+
+        start = time.perf_counter()
+        data, dict_bytes = measure_allocation(app.load_user_data)
+        dict_seconds = time.perf_counter() - start
+        del data
+        start = time.perf_counter()
+        table, table_bytes = measure_allocation(app.UserTable.load)
+        table_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        table.ranking("reward_points")
+        rank_seconds = time.perf_counter() - start
+
+        print(f"memory [{args.users} users]: dicts {dict_bytes / 1e6:.1f} MB "
+              f"({dict_bytes / args.users:.0f} B/user, load {dict_seconds:.2f}s), "
+              f"UserTable {table_bytes / 1e6:.1f} MB "
+              f"({table_bytes / args.users:.0f} B/user, load {table_seconds:.2f}s), "
+              f"ranking {rank_seconds * 1000:.0f} ms")
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir)
+
+
+def bench_recalculate(args):
+    """Reward recalculation throughput over a synthetic record history"""
+    workdir = tempfile.mkdtemp(prefix="efs-bench-")
+    cwd = os.getcwd()
+    rng = random.Random(11)
+    try:
+        os.chdir(workdir)
+        write_records("energy_records.txt", args.records, args.users, rng)
+        size = os.path.getsize("energy_records.txt")
+
+        start = time.perf_counter()
+        report = app.recalculate_rewards(dry_run=True)
+        seconds = time.perf_counter() - start
+        rate = report["records"] / seconds
+        print(f"recalculate [{report['records']} records, {size / 1e6:.0f} MB, {os.cpu_count()} CPUs]: "
+              f"{seconds:.2f}s, {rate:,.0f} records/s, ~{1e8 / rate / 60:.1f} min per 100M records")
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir)
+
+
+BENCHMARKS = {
+    "footsteps": bench_footsteps,
+    "startup": bench_startup,
+    "memory": bench_memory,
+    "recalculate": bench_recalculate,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("benchmarks", nargs="*",
+                        help=f"benchmarks to run: {', '.join(sorted(BENCHMARKS))} (default: all)")
+    parser.add_argument("--footsteps", type=int, default=100)
+    parser.add_argument("--samples", type=int, default=1000, help="samples per footstep")
+    parser.add_argument("--sample-rate", type=float, default=1000.0)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--users", type=int, default=200000, help="users for the startup, memory and recalculate benchmarks")
+    parser.add_argument("--records", type=int, default=1000000, help="records for the recalculate benchmark")
+    args = parser.parse_args()
+    unknown = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmark(s): {', '.join(sorted(unknown))}")
+    for name in args.benchmarks or sorted(BENCHMARKS):
+        BENCHMARKS[name](args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,373 @@
+"""Fleet load simulator for the sensor endpoints.
+
+Walkers arrive at tiles from energy_tiles.txt, take a burst of footsteps and
+report it, with GPS jitter inside the tile's radius, to one of
+/api/submit-sensor-data, /add-energy or /api/iot-sensor. Runs against a
+local server only:
+
+    python app.py &
+    python load_simulator.py --rate 500 --duration 60 --processes 4
+
+Open-loop mode (the default) sends on a precomputed arrival schedule and
+measures latency from each request's intended send time, so a stalled
+server shows up as queueing delay instead of silently lowering the offered
+load (coordinated omission). --mode closed runs --connections back-to-back
+senders per process instead.
+
+Tiles come from energy_tiles.txt; for thousands of tiles load a fleet first
+with `flask --app app import-tiles`.
+"""
+import argparse
+import http.client
+import json
+import math
+import multiprocessing
+import queue
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+ENDPOINTS = {
+    "submit": "/api/submit-sensor-data",
+    "add": "/add-energy",
+    "iot": "/api/iot-sensor",
+}
+WH_PER_STEP = (0.0005, 0.002)  # piezo tile output per footstep, Wh
+
+
+# ============= LATENCY HISTOGRAM =============
+class LatencyHistogram:
+    """Log-linear histogram in the HdrHistogram layout: values (microseconds)
+    below 2 * SUB_BUCKETS are exact, larger ones keep ~1/SUB_BUCKETS relative
+    precision. Histograms from several processes merge by adding counts."""
+
+    SUB_BUCKETS = 64
+
+    def __init__(self):
+        self.counts = {}
+        self.total = 0
+        self.max_value = 0
+
+    def bucket(self, value):
+        if value < 2 * self.SUB_BUCKETS:
+            return value
+        shift = value.bit_length() - self.SUB_BUCKETS.bit_length()
+        return (shift << 16) | (value >> shift)
+
+    @staticmethod
+    def bucket_value(bucket):
+        """Highest value that falls in a bucket"""
+        shift, top = bucket >> 16, bucket & 0xFFFF
+        return ((top + 1) << shift) - 1 if shift else bucket
+
+    def record(self, seconds):
+        value = max(int(seconds * 1e6), 0)
+        bucket = self.bucket(value)
+        self.counts[bucket] = self.counts.get(bucket, 0) + 1
+        self.total += 1
+        self.max_value = max(self.max_value, value)
+
+    def merge(self, other):
+        for bucket, count in other.counts.items():
+            self.counts[bucket] = self.counts.get(bucket, 0) + count
+        self.total += other.total
+        self.max_value = max(self.max_value, other.max_value)
+
+    def percentile(self, percent):
+        """Latency in ms at or below which `percent` of samples fall"""
+        if not self.total:
+            return 0.0
+        target = math.ceil(self.total * percent / 100)
+        seen = 0
+        for bucket in sorted(self.counts, key=self.bucket_value):
+            seen += self.counts[bucket]
+            if seen >= target:
+                return min(self.bucket_value(bucket), self.max_value) / 1000
+        return self.max_value / 1000
+
+    def summary(self):
+        return {f"p{p:g}": round(self.percentile(p), 3) for p in (50, 90, 99, 99.9, 99.99)} | {
+            "max": round(self.max_value / 1000, 3), "count": self.total}
+
+
+# ============= TRAFFIC MODEL =============
+def load_tiles(path, limit):
+    """Tiles as (tile_id, lat, lon, radius) from an energy_tiles.txt file"""
+    tiles = []
+    with open(path, "r") as f:
+        for line in f:
+            parts = line.strip().split("|")
+            if len(parts) >= 5:
+                tiles.append((parts[0], float(parts[2]), float(parts[3]), float(parts[4])))
+    if not tiles:
+        raise SystemExit(f"no tiles in {path}")
+    return tiles[:limit] if limit else tiles
+
+
+def interarrival_times(kind, rate, rng):
+    """Endless gaps between arrivals for a mean rate (per second)"""
+    if kind == "constant":
+        while True:
+            yield 1 / rate
+    elif kind == "poisson":
+        while True:
+            yield rng.expovariate(rate)
+    elif kind == "bursty":
+        # On/off source: 1s bursts at 4x the rate, then 3s idle, same mean
+        while True:
+            for _ in range(max(int(rate * 4), 1)):
+                yield rng.expovariate(rate * 4)
+            yield 3.0
+
+
+class Walker:
+    """A person crossing tiles; keeps a step counter like the hardware does"""
+
+    def __init__(self, walker_id, run_id, rng):
+        self.username = f"sim_walker_{walker_id}"
+        # fresh device ids per run, so reading ids do not hit the server's dedup window
+        self.device_id = f"sim-device-{run_id}-{walker_id}"
+        self.total_steps = 0
+        self.seq = 0
+        self.rng = rng
+
+    def footstep_burst(self, tile, endpoint, jitter):
+        """Request path and JSON body for one burst of steps on a tile"""
+        tile_id, lat, lon, radius = tile
+        steps = max(int(self.rng.expovariate(1 / 12)), 1)
+        self.total_steps += steps
+        self.seq += 1
+        energy = sum(self.rng.uniform(*WH_PER_STEP) for _ in range(steps))
+        # uniform point in a disc of radius * jitter around the tile centre
+        distance = radius * jitter * math.sqrt(self.rng.random())
+        angle = self.rng.uniform(0, 2 * math.pi)
+        point_lat = lat + distance * math.cos(angle)
+        point_lon = lon + distance * math.sin(angle) / max(math.cos(math.radians(lat)), 0.01)
+        body = {"username": self.username, "device_id": self.device_id, "reading_id": self.seq,
+                "latitude": round(point_lat, 7), "longitude": round(point_lon, 7)}
+        if endpoint == "submit":
+            body.update(electricity_wh=round(energy, 6), total_steps=self.total_steps)
+        elif endpoint == "add":
+            body.update(selectedTile=tile_id, electricity=round(energy, 6))
+        else:
+            body.update(tile_id=tile_id, electricity_wh=round(energy, 6))
+        return ENDPOINTS[endpoint], json.dumps(body)
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if name not in ENDPOINTS:
+            raise argparse.ArgumentTypeError(f"unknown endpoint {name!r} (choose from {', '.join(ENDPOINTS)})")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+# ============= WORKERS =============
+class Connection:
+    """Keep-alive HTTP connection that reconnects when the server closes it"""
+
+    def __init__(self, host, port, timeout):
+        self.host, self.port, self.timeout = host, port, timeout
+        self.conn = None
+
+    def post(self, path, body):
+        for attempt in (0, 1):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                self.conn.request("POST", path, body, {"Content-Type": "application/json"})
+                response = self.conn.getresponse()
+                response.read()
+                if response.getheader("Connection", "").lower() == "close" or response.version == 10:
+                    self.conn.close()
+                    self.conn = None
+                return response.status
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                self.conn.close()
+                self.conn = None
+                if attempt:
+                    raise
+
+
+class Results:
+    def __init__(self):
+        self.latency = LatencyHistogram()  # from intended send time
+        self.service = LatencyHistogram()  # from actual send time
+        self.by_endpoint = {name: LatencyHistogram() for name in ENDPOINTS}
+        self.statuses = {}
+        self.errors = {}
+        self.lock = threading.Lock()
+
+    def record(self, endpoint, status, intended, sent, finished):
+        with self.lock:
+            self.latency.record(finished - intended)
+            self.service.record(finished - sent)
+            self.by_endpoint[endpoint].record(finished - intended)
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+
+    def error(self, e):
+        with self.lock:
+            name = type(e).__name__
+            self.errors[name] = self.errors.get(name, 0) + 1
+
+    def merge(self, other):
+        self.latency.merge(other.latency)
+        self.service.merge(other.service)
+        for name, histogram in other.by_endpoint.items():
+            self.by_endpoint[name].merge(histogram)
+        for key, count in other.statuses.items():
+            self.statuses[key] = self.statuses.get(key, 0) + count
+        for key, count in other.errors.items():
+            self.errors[key] = self.errors.get(key, 0) + count
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+
+def run_process(index, args, tiles, run_id, start_at, result_queue):
+    """One load-generating process: its share of the rate, its own walkers"""
+    rng = random.Random(args.seed * 1000 + index)
+    url = urlsplit(args.url)
+    walkers = [Walker(f"{index}_{i}", run_id, rng) for i in range(args.walkers)]
+    names = list(args.mix)
+    weights = [args.mix[name] for name in names]
+    results = Results()
+    end_at = start_at + args.duration
+    work = queue.Queue(maxsize=args.connections * 64)
+
+    def next_request():
+        walker = rng.choice(walkers)
+        endpoint = rng.choices(names, weights)[0]
+        return (endpoint,) + walker.footstep_burst(rng.choice(tiles), endpoint, args.gps_jitter)
+
+    def send(connection, endpoint, path, body, intended):
+        sent = time.perf_counter()
+        try:
+            status = connection.post(path, body)
+        except Exception as e:
+            results.error(e)
+            return
+        results.record(endpoint, status, intended, sent, time.perf_counter())
+
+    def open_loop_sender():
+        connection = Connection(url.hostname, url.port or 80, args.timeout)
+        while True:
+            item = work.get()
+            if item is None:
+                return
+            send(connection, *item)
+
+    def closed_loop_sender():
+        connection = Connection(url.hostname, url.port or 80, args.timeout)
+        while time.perf_counter() < end_at:
+            with results.lock:
+                request = next_request()
+            now = time.perf_counter()
+            send(connection, *request, now)
+
+    while time.perf_counter() < start_at:
+        time.sleep(min(start_at - time.perf_counter(), 0.05))
+    if args.mode == "closed":
+        threads = [threading.Thread(target=closed_loop_sender) for _ in range(args.connections)]
+        for thread in threads:
+            thread.start()
+    else:
+        threads = [threading.Thread(target=open_loop_sender) for _ in range(args.connections)]
+        for thread in threads:
+            thread.start()
+        intended = start_at
+        for gap in interarrival_times(args.arrival, args.rate / args.processes, rng):
+            intended += gap
+            if intended >= end_at:
+                break
+            delay = intended - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            # the schedule does not wait for the server: requests queue here instead
+            work.put(next_request() + (intended,))
+        for _ in threads:
+            work.put(None)
+    for thread in threads:
+        thread.join()
+    result_queue.put(results)
+
+
+# ============= REPORT =============
+def report(args, results, elapsed):
+    total = results.latency.total
+    print(f"{args.mode}-loop, {args.arrival} arrivals, target {args.rate:g}/s over {args.duration:g}s, "
+          f"{args.processes} processes x {args.connections} connections")
+    print(f"  completed {total} requests in {elapsed:.1f}s ({total / elapsed:.1f}/s), "
+          f"errors {sum(results.errors.values())} {results.errors or ''}")
+    print(f"  status codes: {dict(sorted(results.statuses.items()))}")
+    header = f"  {'latency ms':<24}" + "".join(f"{key:>10}" for key in results.latency.summary())
+    print(header)
+    rows = [("response (intended)", results.latency), ("service (sent)", results.service)]
+    rows += [(f"  {name}", histogram) for name, histogram in results.by_endpoint.items() if histogram.total]
+    for label, histogram in rows:
+        print(f"  {label:<24}" + "".join(f"{value:>10}" for value in histogram.summary().values()))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({
+                "config": {key: value for key, value in vars(args).items() if key != "json"},
+                "elapsed": elapsed,
+                "statuses": results.statuses,
+                "errors": results.errors,
+                "latency_ms": results.latency.summary(),
+                "service_ms": results.service.summary(),
+                "endpoints_ms": {name: h.summary() for name, h in results.by_endpoint.items() if h.total}
+            }, f, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:5000", help="local server to drive")
+    parser.add_argument("--tiles-file", default="energy_tiles.txt")
+    parser.add_argument("--tiles", type=int, default=0, help="use only the first N tiles (default: all)")
+    parser.add_argument("--walkers", type=int, default=200, help="simulated walkers per process")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("submit=1,add=1,iot=1"),
+                        help="endpoint weights, e.g. submit=2,add=1,iot=1")
+    parser.add_argument("--mode", choices=["open", "closed"], default="open")
+    parser.add_argument("--arrival", choices=["poisson", "constant", "bursty"], default="poisson")
+    parser.add_argument("--rate", type=float, default=100.0, help="target requests/s (open loop)")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds")
+    parser.add_argument("--processes", type=int, default=max(multiprocessing.cpu_count() // 2, 1))
+    parser.add_argument("--connections", type=int, default=16, help="concurrent senders per process")
+    parser.add_argument("--gps-jitter", type=float, default=0.8,
+                        help="GPS scatter as a fraction of each tile's radius (>1 lands outside tiles)")
+    parser.add_argument("--timeout", type=float, default=10.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    url = urlsplit(args.url)
+    if url.hostname not in ("127.0.0.1", "localhost", "::1"):
+        parser.error("the simulator only drives a local server")
+    tiles = load_tiles(args.tiles_file, args.tiles)
+
+    result_queue = multiprocessing.Queue()
+    run_id = f"{int(time.time() * 1000):x}"
+    start_at = time.perf_counter() + 0.5
+    processes = [multiprocessing.Process(target=run_process, args=(i, args, tiles, run_id, start_at, result_queue))
+                 for i in range(args.processes)]
+    for process in processes:
+        process.start()
+    results = Results()
+    for _ in processes:
+        results.merge(result_queue.get())
+    for process in processes:
+        process.join()
+    report(args, results, time.perf_counter() - start_at)
+
+
+if __name__ == "__main__":
+    main()
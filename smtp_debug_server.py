@@ -0,0 +1,137 @@
+"""Local SMTP stand-in for exercising the OTP email outbox.
+
+Accepts mail on a local port and prints each message (or appends it to an
+mbox file) instead of delivering it. Point the app at it with:
+
+    python smtp_debug_server.py --port 8025 &
+    SMTP_HOST=127.0.0.1 SMTP_PORT=8025 python app.py
+
+--fail-rate answers that fraction of messages with a transient 451 so the
+outbox's retry/backoff path can be watched in /api/email-outbox, and
+--delay adds latency per message to see connection reuse and queue lag.
+Only plain SMTP is spoken: leave SMTP_STARTTLS off and SMTP_USERNAME unset.
+"""
+import argparse
+import mailbox
+import random
+import socketserver
+import threading
+import time
+from email import message_from_bytes
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    """One SMTP session: HELO/EHLO, MAIL, RCPT, DATA, RSET, NOOP, QUIT"""
+
+    def reply(self, line):
+        self.wfile.write(line.encode() + b"\r\n")
+
+    def handle(self):
+        server = self.server
+        server.count("connections")
+        self.reply("220 localhost smtp_debug_server ready")
+        sender, recipients = None, []
+        for raw in self.rfile:
+            command = raw.decode("utf-8", "replace").strip()
+            verb = command[:4].upper()
+            if verb in ("HELO", "EHLO"):
+                self.reply("250 localhost")
+            elif verb == "MAIL":
+                sender, recipients = command.partition(":")[2].strip(), []
+                self.reply("250 OK")
+            elif verb == "RCPT":
+                if sender is None:
+                    self.reply("503 MAIL first")
+                    continue
+                recipients.append(command.partition(":")[2].strip().strip("<>"))
+                self.reply("250 OK")
+            elif verb == "DATA":
+                if not recipients:
+                    self.reply("503 RCPT first")
+                    continue
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                data = self.read_data()
+                if server.delay:
+                    time.sleep(server.delay)
+                if random.random() < server.fail_rate:
+                    server.count("rejected")
+                    self.reply("451 Temporary failure, try again later")
+                else:
+                    server.deliver(recipients, data)
+                    self.reply("250 OK: queued")
+                sender, recipients = None, []
+            elif verb == "RSET":
+                sender, recipients = None, []
+                self.reply("250 OK")
+            elif verb == "NOOP":
+                self.reply("250 OK")
+            elif verb == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+    def read_data(self):
+        lines = []
+        for raw in self.rfile:
+            if raw in (b".\r\n", b".\n"):
+                break
+            lines.append(raw[1:] if raw.startswith(b"..") else raw)
+        return b"".join(lines)
+
+
+class DebuggingSMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, mbox=None, fail_rate=0.0, delay=0.0, quiet=False):
+        super().__init__(address, SMTPHandler)
+        self.mbox = mailbox.mbox(mbox) if mbox else None
+        self.fail_rate = fail_rate
+        self.delay = delay
+        self.quiet = quiet
+        self.counts = {"connections": 0, "messages": 0, "rejected": 0}
+        self.lock = threading.Lock()
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+    def deliver(self, recipients, data):
+        self.count("messages")
+        message = message_from_bytes(data)
+        with self.lock:
+            if self.mbox is not None:
+                self.mbox.add(message)
+                self.mbox.flush()
+        if not self.quiet:
+            print(f"---------- to {', '.join(recipients)} ----------")
+            print(data.decode("utf-8", "replace").rstrip())
+            print("-" * 40, flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8025)
+    parser.add_argument("--mbox", help="also append received messages to this mbox file")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="fraction of messages answered with 451")
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds to wait before answering DATA")
+    parser.add_argument("--quiet", action="store_true", help="do not print messages")
+    args = parser.parse_args()
+    if args.host not in ("127.0.0.1", "localhost", "::1"):
+        parser.error("the debugging server only listens on localhost")
+    server = DebuggingSMTPServer((args.host, args.port), args.mbox, args.fail_rate, args.delay, args.quiet)
+    print(f"SMTP debugging server on {args.host}:{args.port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"{server.counts['messages']} messages, {server.counts['rejected']} rejected, "
+              f"{server.counts['connections']} connections")
+
+
+if __name__ == "__main__":
+    main()
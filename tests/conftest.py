@@ -0,0 +1,57 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Background jobs would run against whichever directory a test left behind
+os.environ["SCHEDULER"] = "off"
+
+
+@pytest.fixture
+def load_app(tmp_path, monkeypatch):
+    """Import app fresh inside an empty data directory. Settings are read at
+    import time, so environment overrides are passed here."""
+    monkeypatch.chdir(tmp_path)
+
+    def load(**env):
+        for name, value in env.items():
+            monkeypatch.setenv(name, str(value))
+        import app
+        return importlib.reload(app)
+    return load
+
+
+@pytest.fixture
+def app_module(load_app):
+    return load_app()
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+
+def login(client, username, user_type="user"):
+    with client.session_transaction() as s:
+        s["username"] = username
+        s["user_type"] = user_type
+
+
+def put_users(app, users):
+    """Write user_data.txt rows: {username: {field: value}}"""
+    with app.user_data_lock():
+        user_data = app.load_user_data()
+        for username, fields in users.items():
+            user_data.setdefault(username, app.new_user_record()).update(fields)
+        app.save_user_data(user_data)
+
+
+def write_records(records, path="energy_records.txt"):
+    import json
+    with open(path, "a") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
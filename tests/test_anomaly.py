@@ -0,0 +1,54 @@
+import pytest
+
+from conftest import login, put_users
+
+TILE = {"latitude": 35.6595, "longitude": 139.7004}
+
+
+@pytest.fixture
+def app_module(load_app):
+    # Readings arrive faster than a real sensor would send them
+    return load_app(SENSOR_RATE_LIMIT=10000, SENSOR_RATE_BURST=10000)
+
+
+def iot_reading(client, wh, username="alice"):
+    return client.post("/api/iot-sensor", json={"username": username, "tile_id": "tile_001",
+                                                 "electricity_wh": wh})
+
+
+def test_non_finite_reading_is_quarantined(app_module, client):
+    for _ in range(5):
+        assert iot_reading(client, 2.0).get_json()["status"] == "success"
+
+    for value in ("nan", "inf"):
+        body = iot_reading(client, value).get_json()
+        assert body["quarantined"] is True and body["reward_points"] == 0
+
+    count, mean, variance, last, change = app_module.TILE_READING_STATS.state["tile_001"]
+    assert count == 5 and mean == 2.0 and last == 2.0
+    reasons = [r["reasons"] for r in app_module.load_quarantined_readings()]
+    assert reasons == [["not_finite"], ["not_finite"]]
+
+
+def test_uncredited_zero_readings_do_not_set_the_baseline(app_module, client):
+    put_users(app_module, {"alice": {"assigned_location": "tile_001"}})
+    for _ in range(app_module.ANOMALY_WARMUP + 5):
+        body = client.post("/api/submit-sensor-data", json=dict(TILE, username="alice", electricity_wh=0)).get_json()
+        assert not body.get("quarantined")
+    assert "alice" not in app_module.USER_READING_STATS.state
+
+    body = client.post("/api/submit-sensor-data", json=dict(TILE, username="alice", electricity_wh=0.5)).get_json()
+    assert body["status"] == "success" and not body.get("quarantined")
+
+
+def test_spread_floor_tolerates_small_readings_after_zeros(client):
+    for _ in range(30):
+        iot_reading(client, 0)
+    assert not iot_reading(client, 0.5).get_json().get("quarantined")
+    assert iot_reading(client, 500).get_json()["quarantined"] is True
+
+
+def test_quarantine_view_rejects_bad_limit(client):
+    login(client, "admin", "admin")
+    assert client.get("/admin/quarantine?limit=x").status_code == 400
+    assert client.get("/admin/quarantine?limit=5&format=json").status_code == 200
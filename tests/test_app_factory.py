@@ -0,0 +1,45 @@
+import gc
+import os
+
+import pytest
+
+from conftest import put_users, write_records
+
+
+@pytest.fixture(autouse=True)
+def unfreeze():
+    yield
+    gc.unfreeze()
+
+
+def test_create_app_builds_independent_apps(app_module):
+    first = app_module.create_app({"TESTING": True}, warm=False)
+    second = app_module.create_app(warm=False)
+    assert first.config["TESTING"] is True and not second.config.get("TESTING")
+    assert first.config["SECRET_KEY"] != second.config["SECRET_KEY"]
+    assert first.test_client().get("/api/get-tiles").status_code == 200
+    assert second.test_client().get("/api/tiles/nearest?lat=35.66&lon=139.7").status_code == 200
+
+
+def test_warm_up_builds_the_read_caches(app_module):
+    put_users(app_module, {"alice": {"reward_points": 5}, "bob": {"reward_points": 9}})
+    write_records([{"timestamp": "2024-01-01T00:00:00", "username": "alice", "electricity_wh": 1}])
+    app_module.create_app(warm=True)
+
+    assert app_module._user_data_cache["stamp"] == app_module.get_user_data_stamp()
+    assert app_module._leaderboard_cache["order"] == ["bob", "alice"]
+    index = app_module.get_record_index("energy_records.txt")
+    assert index.indexed_upto == os.path.getsize("energy_records.txt")
+    assert gc.get_freeze_count() > 0
+
+
+def test_warm_up_setting_applies_at_import(load_app):
+    app_module = load_app(WARM_UP="on")
+    assert app_module.WARM_UP is True
+    assert os.path.exists("energy_tiles.txt")
+    assert app_module._user_data_cache["stamp"] == app_module.get_user_data_stamp()
+
+
+def test_cold_import_leaves_caches_empty(app_module):
+    assert app_module.WARM_UP is False
+    assert app_module._leaderboard_cache["stamp"] is None
@@ -0,0 +1,71 @@
+import pytest
+
+from conftest import put_users
+
+TILES = {
+    "tile_001": {"name": "Small", "lat": 35.0, "lon": 139.0, "radius": 0.001, "capacity": 2},
+    "tile_002": {"name": "Far", "lat": 36.0, "lon": 140.0, "radius": 0.001, "capacity": 5},
+}
+
+
+@pytest.fixture
+def app_module(app_module):
+    app_module.save_energy_tiles(TILES)
+    app_module.save_users({name: {"password_hash": "", "email": f"{name}@example.com", "mfa_secret": ""}
+                           for name in ("alice", "bob", "carol", "dave")})
+    return app_module
+
+
+def near_small_tile(*names):
+    return [{"username": name, "lat": 35.0 + 0.001 * i, "lon": 139.0} for i, name in enumerate(names)]
+
+
+def assigned(app):
+    return {name: user["assigned_location"] for name, user in app.load_user_data().items()}
+
+
+def test_capacity_is_respected(app_module):
+    result = app_module.assign_users_to_tiles(near_small_tile("alice", "bob", "carol"))
+    assert result["committed"] and result["assigned"] == 3
+    assert result["assignments"] == {"alice": "tile_001", "bob": "tile_001", "carol": "tile_002"}
+    assert assigned(app_module) == result["assignments"]
+
+
+def test_dry_run_does_not_write(app_module):
+    result = app_module.assign_users_to_tiles(near_small_tile("alice"), dry_run=True)
+    assert result["assignments"] == {"alice": "tile_001"} and not result["committed"]
+    assert "alice" not in app_module.load_user_data()
+
+
+def test_tiles_filled_while_planning_are_rechecked(app_module, monkeypatch):
+    plan = app_module.greedy_assign
+
+    def concurrent_assignment(*args):
+        assignments = plan(*args)
+        # Another admin fills a slot and assigns bob before this commit
+        put_users(app_module, {"dave": {"assigned_location": "tile_001"},
+                               "bob": {"assigned_location": "tile_002"}})
+        return assignments
+    monkeypatch.setattr(app_module, "greedy_assign", concurrent_assignment)
+
+    result = app_module.assign_users_to_tiles(near_small_tile("alice", "bob", "carol"))
+    assert result["assignments"] == {"alice": "tile_001", "carol": "tile_002"}
+    assert result["skipped_already_assigned"] == ["bob"]
+    users = assigned(app_module)
+    assert list(users.values()).count("tile_001") == 2
+    assert users["bob"] == "tile_002"
+
+
+def test_assignment_dropped_when_its_tile_is_full(app_module, monkeypatch):
+    plan = app_module.greedy_assign
+
+    def concurrent_assignment(*args):
+        assignments = plan(*args)
+        put_users(app_module, {"dave": {"assigned_location": "tile_001"}})
+        return assignments
+    monkeypatch.setattr(app_module, "greedy_assign", concurrent_assignment)
+
+    result = app_module.assign_users_to_tiles(near_small_tile("alice", "bob"))
+    assert result["assignments"] == {"alice": "tile_001"}
+    assert result["unassigned"] == ["bob"]
+    assert "bob" not in app_module.load_user_data() or not assigned(app_module)["bob"]
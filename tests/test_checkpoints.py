@@ -0,0 +1,58 @@
+import os
+
+from conftest import put_users, write_records
+
+
+def record(username, wh):
+    return {"timestamp": "2026-01-01T12:00:00", "username": username, "tile_id": "tile_001",
+            "electricity_wh": wh, "location": {}}
+
+
+def rewrite_user_data(app, users):
+    """Replace user_data.txt, as a partial write would have left it"""
+    os.remove("user_data.txt")
+    put_users(app, users)
+
+
+def test_unchanged_user_data_is_served_from_the_checkpoint(app_module):
+    put_users(app_module, {"alice": {"reward_points": 10}, "bob": {"reward_points": 20}})
+    app_module.write_checkpoint()
+    app_module._user_data_cache["stamp"] = None
+    assert app_module.restore_from_checkpoint() == "checkpoint"
+    assert app_module.get_leaderboard_order() == ["bob", "alice"]
+
+
+def test_missing_user_data_is_rebuilt_from_checkpoint_and_tail(app_module):
+    put_users(app_module, {"alice": {"total_energy_wh": 1.0, "reward_points": 100, "total_steps": 7}})
+    app_module.write_checkpoint()
+    write_records([record("alice", 2.0), record("carol", 0.5)])
+    os.remove("user_data.txt")
+
+    assert app_module.restore_from_checkpoint() == "replayed"
+    users = app_module.load_user_data()
+    assert users["alice"]["total_energy_wh"] == 3.0 and users["alice"]["total_steps"] == 7
+    assert users["alice"]["reward_points"] == 100 + app_module.calculate_reward_points(2.0)
+    assert users["carol"]["total_energy_wh"] == 0.5
+
+
+def test_surviving_rows_win_over_the_checkpoint(app_module):
+    put_users(app_module, {"alice": {"total_energy_wh": 1.0, "reward_points": 100},
+                           "bob": {"total_energy_wh": 1.0, "reward_points": 100}})
+    app_module.write_checkpoint()
+    write_records([record("alice", 2.0), record("bob", 4.0)])
+    # bob's row already includes his 4 Wh; alice's row was lost
+    rewrite_user_data(app_module, {"bob": {"total_energy_wh": 5.0, "reward_points": 500, "total_steps": 9}})
+
+    assert app_module.restore_from_checkpoint() == "replayed"
+    users = app_module.load_user_data()
+    assert users["bob"]["total_energy_wh"] == 5.0 and users["bob"]["reward_points"] == 500
+    assert users["bob"]["total_steps"] == 9
+    assert users["alice"]["total_energy_wh"] == 3.0
+
+
+def test_newer_complete_user_data_is_kept(app_module):
+    put_users(app_module, {"alice": {"reward_points": 10}})
+    app_module.write_checkpoint()
+    put_users(app_module, {"alice": {"reward_points": 30}, "bob": {"reward_points": 5}})
+    assert app_module.restore_from_checkpoint() == "text"
+    assert app_module.load_user_data()["alice"]["reward_points"] == 30
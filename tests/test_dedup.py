@@ -0,0 +1,74 @@
+import multiprocessing
+
+from conftest import put_users
+
+
+def post_iot(client, reading_id, tile_id="tile_001", **extra):
+    return client.post("/api/iot-sensor", json=dict({"username": "alice", "tile_id": tile_id, "electricity_wh": 1.5,
+                                                     "reading_id": reading_id}, **extra))
+
+
+def test_retry_replays_the_original_response(app_module, client):
+    first = post_iot(client, "r1").get_json()
+    retry = post_iot(client, "r1").get_json()
+    assert retry.pop("duplicate") is True
+    assert retry == first
+    assert app_module.load_user_data()["alice"]["total_energy_wh"] == 1.5
+
+
+def test_sensor_retry_replays_user_totals(app_module, client):
+    put_users(app_module, {"alice": {"assigned_location": "tile_001"}})
+    reading = {"username": "alice", "latitude": 35.6595, "longitude": 139.7004, "electricity_wh": 2.0,
+               "total_steps": 10, "device_id": "shoe-1", "seq": 1}
+    first = client.post("/api/submit-sensor-data", json=reading).get_json()
+    retry = client.post("/api/submit-sensor-data", json=reading).get_json()
+    assert retry["duplicate"] is True
+    assert retry["total_energy_wh"] == first["total_energy_wh"] == 2.0
+    assert retry["total_reward_points"] == first["total_reward_points"]
+
+
+def test_failed_reading_can_be_retried(app_module, client):
+    assert post_iot(client, "r2", tile_id="tile_999").status_code == 400
+    assert post_iot(client, "r2").get_json().get("duplicate") is None
+    assert app_module.load_user_data()["alice"]["total_energy_wh"] == 1.5
+
+
+def claim_in_child(window):
+    assert window.claim("device", "r1")
+    window.complete("device", "r1", {"reward_points": 150})
+
+
+def test_window_is_shared_with_forked_workers(app_module):
+    window = app_module.DedupWindow(600, slots=64)
+    child = multiprocessing.get_context("fork").Process(target=claim_in_child, args=(window,))
+    child.start()
+    child.join(timeout=10)
+    assert child.exitcode == 0
+    assert window.claim("device", "r1") is False
+    assert window.outcome("device", "r1", timeout=1) == (True, {"reward_points": 150})
+
+
+def test_in_flight_and_expired_ids(app_module, monkeypatch):
+    window = app_module.DedupWindow(600, slots=64)
+    assert window.claim("device", "r1") is True
+    assert window.outcome("device", "r1", timeout=0.05) == (False, None)
+
+    now = app_module.time.monotonic()
+    monkeypatch.setattr(app_module.time, "monotonic", lambda: now + 601)
+    assert window.claim("device", "r1") is True
+
+
+def test_full_probe_window_recycles_the_oldest_id(app_module):
+    window = app_module.DedupWindow(600, slots=1)
+    window.PROBES = 1
+    assert window.claim("device", "r1") is True
+    assert window.claim("device", "r2") is True
+    assert window.claim("device", "r1") is True
+
+
+def test_oversized_outcome_is_a_conflict(app_module, client, monkeypatch):
+    monkeypatch.setattr(app_module.DedupWindow, "SUMMARY_BYTES", 10)
+    post_iot(client, "r3")
+    response = post_iot(client, "r3")
+    assert response.status_code == 409
+    assert app_module.load_user_data()["alice"]["total_energy_wh"] == 1.5
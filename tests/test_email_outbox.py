@@ -0,0 +1,105 @@
+import mailbox
+import re
+import smtplib
+import threading
+import time
+
+import pytest
+
+from smtp_debug_server import DebuggingSMTPServer
+
+
+@pytest.fixture
+def smtp_server(tmp_path):
+    server = DebuggingSMTPServer(("127.0.0.1", 0), mbox=str(tmp_path / "mail.mbox"), quiet=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def app_module(load_app, smtp_server, monkeypatch):
+    app = load_app(SMTP_HOST="127.0.0.1", SMTP_PORT=smtp_server.server_address[1])
+    monkeypatch.setattr(app, "OUTBOX_BACKOFF", 0.01)
+    return app
+
+
+def new_outbox(app, workers=1, batch=5):
+    return app.EmailOutbox(app.SmtpPool(size=1), workers=workers, batch=batch)
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_batches_reuse_pooled_connections(app_module, smtp_server):
+    outbox = new_outbox(app_module)
+    for i in range(12):
+        assert outbox.enqueue(f"user{i}@example.com", "Code", f"code {i}")
+    assert outbox.flush(timeout=10)
+    stats = outbox.stats()
+    assert stats["sent"] == 12 and stats["pending"] == 0 and stats["in_flight"] == 0
+    assert smtp_server.counts["messages"] == 12
+    assert stats["pool"]["opened"] == smtp_server.counts["connections"] == 1
+    assert stats["pool"]["reused"] >= 1
+
+
+def test_transient_failures_are_retried(app_module, smtp_server):
+    smtp_server.fail_rate = 1.0
+    outbox = new_outbox(app_module)
+    outbox.enqueue("admin@example.com", "Code", "code")
+    wait_for(lambda: outbox.stats()["retries"] >= 2)
+    smtp_server.fail_rate = 0.0
+    assert outbox.flush(timeout=10)
+    stats = outbox.stats()
+    assert stats["sent"] == 1 and stats["failed"] == 0
+    assert smtp_server.counts["rejected"] >= 2 and smtp_server.counts["messages"] == 1
+
+
+def test_gives_up_after_max_attempts(app_module, smtp_server, monkeypatch):
+    monkeypatch.setattr(app_module, "OUTBOX_MAX_ATTEMPTS", 3)
+    smtp_server.fail_rate = 1.0
+    outbox = new_outbox(app_module)
+    outbox.enqueue("admin@example.com", "Code", "code")
+    assert outbox.flush(timeout=10)
+    stats = outbox.stats()
+    assert stats["failed"] == 1 and stats["retries"] == 2 and stats["sent"] == 0
+    assert "451" in stats["last_error"]
+
+
+def test_permanent_errors_are_not_retried(app_module):
+    assert app_module.is_permanent_smtp_error(smtplib.SMTPDataError(550, b"rejected"))
+    assert not app_module.is_permanent_smtp_error(smtplib.SMTPDataError(451, b"try again"))
+    assert app_module.is_permanent_smtp_error(smtplib.SMTPRecipientsRefused({"a@example.com": (550, b"no")}))
+    assert not app_module.is_permanent_smtp_error(ConnectionRefusedError())
+
+
+def mailed_codes(tmp_path):
+    messages = mailbox.mbox(str(tmp_path / "mail.mbox"))
+    return [re.search(r"code is (\d{6})", message.get_payload()).group(1) for message in messages]
+
+
+def test_admin_login_emails_the_otp_and_resends_it(app_module, client, tmp_path, monkeypatch):
+    response = client.post("/admin-login", data={"admin_username": "admin", "admin_password": "admin123"})
+    assert response.status_code == 302 and "/verify-mfa" in response.headers["Location"]
+    outbox = app_module._background_services["outbox"]
+    assert outbox.flush(timeout=10)
+    codes = mailed_codes(tmp_path)
+    assert len(codes) == 1 and codes[0] != "000000"
+
+    page = client.get("/verify-mfa?user_type=admin&username=admin&resend=1").get_data(as_text=True)
+    assert "Please wait" in page
+    monkeypatch.setattr(app_module, "OTP_RESEND_INTERVAL", 0)
+    page = client.get("/verify-mfa?user_type=admin&username=admin&resend=1").get_data(as_text=True)
+    assert "Resend code" in page
+    assert outbox.flush(timeout=10)
+    assert mailed_codes(tmp_path) == codes * 2
+
+    response = client.post("/verify-mfa", data={"mfa_method": "email", "email_otp": codes[0],
+                                                "user_type": "admin", "username": "admin"})
+    assert response.status_code == 302 and response.headers["Location"].endswith("/admin-panel")
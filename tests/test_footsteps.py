@@ -0,0 +1,63 @@
+import pytest
+
+
+@pytest.fixture(params=["numpy", "python"])
+def physics(request, app_module, monkeypatch):
+    if request.param == "python":
+        monkeypatch.setattr(app_module, "optional_numpy", lambda: None)
+    elif app_module.optional_numpy() is None:
+        pytest.skip("numpy is not installed")
+    return app_module
+
+
+def test_constant_voltage_across_the_load(physics):
+    # 10 V over 1 kOhm is 0.1 W; 1000 samples at 1 kHz span 0.999 s
+    wh = physics.integrate_footstep_wh([10.0] * 1000, sample_rate_hz=1000, load_ohms=1000)
+    assert wh == pytest.approx(0.1 * 0.999 / 3600)
+
+
+def test_current_trace_is_used_when_given(physics):
+    # Triangle pulse: power 0, 2, 0 W over two 0.5 s intervals is 1 J
+    wh = physics.integrate_footstep_wh([0.0, 2.0, 0.0], [0.0, 1.0, 0.0], sample_rate_hz=2)
+    assert wh == pytest.approx(1 / 3600)
+
+
+def test_single_sample_has_no_energy(physics):
+    assert physics.integrate_footstep_wh([5.0]) == 0.0
+
+
+def test_summary_tracks_pressure_and_peaks(app_module):
+    footsteps = [{"voltage": [0, 4, -6, 0], "pressure": [10, 30, 20]},
+                 {"voltage": [0, 2, 0], "current": [0, 0.5, 0], "pressure": [5]}]
+    wh, deltas = app_module.summarize_footsteps(footsteps, 1000, load_ohms=100)
+    assert wh > 0
+    assert deltas["add"] == {"pressure_given": 35}
+    assert deltas["max"] == {"voltage": 6, "ampere": 0.5}
+
+
+@pytest.mark.parametrize("footsteps, rate", [([{"voltage": [1, 2], "current": [1]}], 1000),
+                                             ([{"voltage": [1, 2]}], 0)])
+def test_summary_rejects_inconsistent_samples(app_module, footsteps, rate):
+    with pytest.raises(ValueError):
+        app_module.summarize_footsteps(footsteps, rate)
+
+
+def test_endpoint_credits_the_integrated_energy(app_module, client):
+    footsteps = [{"voltage": [20.0] * 500, "pressure": [60]}] * 2
+    body = client.post("/api/footstep-samples", json={"username": "alice", "tile_id": "tile_001",
+                                                      "sample_rate_hz": 1000, "footsteps": footsteps}).get_json()
+    expected = 2 * app_module.integrate_footstep_wh([20.0] * 500, sample_rate_hz=1000)
+    assert body["status"] == "success" and body["footsteps"] == 2
+    assert body["electricity_wh"] == pytest.approx(expected, abs=1e-8)
+
+    record = app_module.load_energy_records()[-1]
+    assert record["footsteps"] == 2 and record["electricity_wh"] == round(expected, 8)
+    user = app_module.load_user_data()["alice"]
+    assert user["pressure_given"] == 120 and user["voltage"] == 20.0
+
+
+def test_endpoint_rejects_too_many_samples(app_module, client):
+    footsteps = [{"voltage": [1.0] * (app_module.MAX_SAMPLES_PER_REQUEST + 1)}]
+    response = client.post("/api/footstep-samples", json={"username": "alice", "tile_id": "tile_001",
+                                                          "footsteps": footsteps})
+    assert response.status_code == 400
@@ -0,0 +1,53 @@
+import gzip
+import json
+
+from conftest import login
+
+
+def add_tile(client, name):
+    login(client, "admin", "admin")
+    form = {"tile_name": name, "latitude": "35.0", "longitude": "139.0", "radius": "0.001", "capacity": "1000"}
+    assert client.post("/add-tile", data=form).get_json()["status"] == "success"
+
+
+def test_etag_revalidation_returns_304_until_tiles_change(client):
+    first = client.get("/api/get-tiles")
+    assert first.status_code == 200 and len(first.get_json()) == 5
+    etag = first.headers["ETag"]
+
+    again = client.get("/api/get-tiles", headers={"If-None-Match": etag})
+    assert again.status_code == 304 and again.data == b""
+
+    add_tile(client, "New Tile")
+    changed = client.get("/api/get-tiles", headers={"If-None-Match": etag})
+    assert changed.status_code == 200 and len(changed.get_json()) == 6
+    assert changed.headers["ETag"] != etag
+
+
+def test_compressed_body_matches_identity(client):
+    plain = client.get("/api/get-tiles")
+    packed = client.get("/api/get-tiles", headers={"Accept-Encoding": "gzip"})
+    assert packed.headers["Content-Encoding"] == "gzip"
+    assert json.loads(gzip.decompress(packed.data)) == plain.get_json()
+    assert packed.headers["ETag"] != plain.headers["ETag"]
+
+
+def test_since_returns_collapsed_changes(client):
+    version = int(client.get("/api/get-tiles").headers["X-Tiles-Version"])
+    add_tile(client, "Added")
+    add_tile(client, "Added Then Removed")
+    client.post("/remove-tile/tile_007")
+    client.post("/remove-tile/tile_002")
+
+    delta = client.get(f"/api/get-tiles?since={version}").get_json()
+    assert [tile["id"] for tile in delta["added"]] == ["tile_006"]
+    assert delta["changed"] == [] and delta["removed"] == ["tile_002"]
+    assert delta["since"] == version and delta["version"] == version + 4
+
+    empty = client.get(f"/api/get-tiles?since={delta['version']}").get_json()
+    assert empty["added"] == empty["changed"] == empty["removed"] == []
+
+
+def test_since_rejects_bad_versions(client):
+    assert client.get("/api/get-tiles?since=x").status_code == 400
+    assert client.get("/api/get-tiles?since=999").status_code == 400
@@ -0,0 +1,54 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from conftest import write_records
+
+BBOX = "35,139,36,140"
+
+
+def record(days_ago, wh=2.0):
+    return {"timestamp": (datetime.now() - timedelta(days=days_ago)).isoformat(), "username": "alice",
+            "tile_id": "tile_001", "electricity_wh": wh, "location": {"lat": 35.6595, "lon": 139.7004}}
+
+
+def total(body):
+    return sum(cell["energy_wh"] for cell in body["cells"])
+
+
+def test_heatmap_sums_records_in_viewport(client):
+    write_records([record(0), record(1, 3.0)])
+    body = client.get(f"/api/heatmap?bbox={BBOX}").get_json()
+    assert body["status"] == "success" and total(body) == 5.0
+    today = datetime.now().date().isoformat()
+    assert total(client.get(f"/api/heatmap?bbox={BBOX}&from={today}").get_json()) == 2.0
+
+
+@pytest.mark.parametrize("bbox", ["nan,139,36,140", "35,139,36,inf", "-95,139,36,140"])
+def test_bad_bbox_is_rejected(client, bbox):
+    assert client.get(f"/api/heatmap?bbox={bbox}").status_code == 400
+
+
+def test_day_layers_are_pruned_after_retention(app_module, client, monkeypatch):
+    monkeypatch.setattr(app_module, "HEATMAP_RETENTION_DAYS", 30)
+    write_records([record(40), record(29), record(0)])
+    old = (datetime.now() - timedelta(days=45)).date().isoformat()
+    body = client.get(f"/api/heatmap?bbox={BBOX}&from={old}").get_json()
+    assert total(body) == 4.0
+    assert total(client.get(f"/api/heatmap?bbox={BBOX}").get_json()) == 6.0
+    assert len(app_module.get_energy_heatmap().day_keys) == 2
+
+
+def test_state_saves_are_throttled(app_module):
+    heatmap = app_module.get_energy_heatmap()
+    write_records([record(0)])
+    heatmap.refresh()
+    assert heatmap.save_state() is True
+    write_records([record(0)])
+    heatmap.refresh()
+    assert heatmap.save_state() is False
+    assert heatmap.save_state(force=True) is True
+
+    reloaded = app_module.EnergyHeatmap()
+    reloaded.refresh()
+    assert reloaded.all_time[0] == heatmap.all_time[0]
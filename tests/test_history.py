@@ -0,0 +1,95 @@
+import csv
+import io
+import json
+import os
+
+import pytest
+
+from conftest import login, write_records
+
+
+def record(i, username="alice", day="2024-01-01"):
+    return {"timestamp": f"{day}T00:{i // 60:02d}:{i % 60:02d}", "username": username, "tile_id": "tile_001",
+            "tile_name": "Shibuya", "electricity_wh": i, "location": {"lat": 35.6, "lon": 139.7}}
+
+
+@pytest.fixture
+def history(app_module, client):
+    """30 of alice's records split between the main log and a shard log, plus noise from bob"""
+    write_records([record(i) for i in range(0, 30, 2)] + [record(5, "bob")])
+    os.makedirs(app_module.SHARD_DIR)
+    write_records([record(i) for i in range(1, 30, 2)], os.path.join(app_module.SHARD_DIR, "energy_records.shard-0.txt"))
+    login(client, "alice")
+    return client
+
+
+def walk(client, query, cursor=None):
+    seen = []
+    while True:
+        url = f"/api/energy-history/alice?{query}" + (f"&cursor={cursor}" if cursor else "")
+        body = client.get(url).get_json()
+        seen.append([r["electricity_wh"] for r in body["records"]])
+        cursor = body["next_cursor"]
+        if cursor is None:
+            return seen
+
+
+def test_pages_merge_logs_newest_first(history):
+    pages = walk(history, "limit=7")
+    assert [len(page) for page in pages] == [7, 7, 7, 7, 2]
+    assert sum(pages, []) == list(range(29, -1, -1))
+
+
+def test_ascending_pages(history):
+    assert sum(walk(history, "limit=8&order=asc"), []) == list(range(30))
+
+
+def test_cursor_is_stable_while_records_are_appended(history):
+    first = history.get("/api/energy-history/alice?limit=10").get_json()
+    write_records([record(59)])
+    rest = sum(walk(history, "limit=10", first["next_cursor"]), [])
+    assert rest == list(range(19, -1, -1))
+
+
+def test_date_bounds(history):
+    write_records([record(0, day="2024-01-02"), record(1, day="2024-01-03")])
+    body = history.get("/api/energy-history/alice?from=2024-01-02&to=2024-01-02").get_json()
+    assert [r["timestamp"][:10] for r in body["records"]] == ["2024-01-02"]
+
+
+def test_bad_requests(history):
+    desc = history.get("/api/energy-history/alice?limit=5").get_json()["next_cursor"]
+    assert history.get(f"/api/energy-history/alice?order=asc&cursor={desc}").status_code == 400
+    assert history.get("/api/energy-history/alice?cursor=garbage").status_code == 400
+    assert history.get("/api/energy-history/alice?order=sideways").status_code == 400
+    assert history.get("/api/energy-history/alice?from=yesterday").status_code == 400
+
+
+def test_other_users_history_is_forbidden(history):
+    assert history.get("/api/energy-history/bob").status_code == 403
+    assert history.get("/api/energy-history/bob/export").status_code == 403
+
+
+def test_csv_export_streams_everything_oldest_first(history, app_module, monkeypatch):
+    monkeypatch.setattr(app_module, "HISTORY_MAX_PAGE", 4)
+    response = history.get("/api/energy-history/alice/export")
+    assert response.headers["Content-Disposition"] == "attachment; filename=alice-energy-history.csv"
+    rows = list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+    assert rows[0] == app_module.HISTORY_EXPORT_FIELDS
+    assert [int(row[3]) for row in rows[1:]] == list(range(30))
+    assert rows[1][4:6] == ["35.6", "139.7"]
+
+
+def test_ndjson_export(history):
+    response = history.get("/api/energy-history/alice/export?format=ndjson&to=2024-01-01T00:00:10")
+    assert [json.loads(line)["electricity_wh"] for line in response.get_data(as_text=True).splitlines()] == list(range(10))
+    assert history.get("/api/energy-history/alice/export?format=xml").status_code == 400
+
+
+def test_bounds_hold_when_records_were_appended_out_of_order(history):
+    # Stamped before the append: a slower writer's earlier record lands last
+    write_records([record(5, day="2024-01-02"), record(1, day="2024-01-02"), record(3, day="2024-01-02")])
+    body = history.get("/api/energy-history/alice?from=2024-01-02T00:00:02&to=2024-01-02T00:00:04").get_json()
+    assert [r["timestamp"] for r in body["records"]] == ["2024-01-02T00:00:03"]
+    asc = history.get("/api/energy-history/alice?from=2024-01-02&order=asc").get_json()
+    assert [r["electricity_wh"] for r in asc["records"]] == [1, 3, 5]
@@ -0,0 +1,73 @@
+import argparse
+import itertools
+import json
+import math
+import random
+
+import pytest
+
+import load_simulator
+from conftest import ROOT, put_users
+
+
+@pytest.fixture
+def app_module(load_app):
+    return load_app(SENSOR_RATE_LIMIT=10000, SENSOR_RATE_BURST=10000)
+
+
+def test_histogram_percentiles_stay_within_bucket_precision():
+    rng = random.Random(3)
+    samples = [rng.lognormvariate(-5, 1.5) for _ in range(20000)]
+    histogram = load_simulator.LatencyHistogram()
+    for seconds in samples:
+        histogram.record(seconds)
+    ordered = sorted(int(s * 1e6) for s in samples)
+    for percent in (50, 90, 99, 99.9):
+        exact = ordered[math.ceil(len(ordered) * percent / 100) - 1] / 1000
+        assert histogram.percentile(percent) == pytest.approx(exact, rel=2 / histogram.SUB_BUCKETS)
+    assert histogram.percentile(100) == ordered[-1] / 1000
+
+
+def test_histograms_merge_by_adding_counts():
+    first, second, both = (load_simulator.LatencyHistogram() for _ in range(3))
+    for i, seconds in enumerate(0.001 * n for n in range(1, 500)):
+        (first if i % 2 else second).record(seconds)
+        both.record(seconds)
+    first.merge(second)
+    assert first.summary() == both.summary()
+
+
+@pytest.mark.parametrize("kind", ["constant", "poisson", "bursty"])
+def test_arrivals_keep_the_mean_rate(kind):
+    gaps = list(itertools.islice(load_simulator.interarrival_times(kind, 50, random.Random(1)), 20000))
+    assert len(gaps) / sum(gaps) == pytest.approx(50, rel=0.05)
+
+
+def test_mix_rejects_unknown_endpoints():
+    assert load_simulator.parse_mix("submit=2,iot") == {"submit": 2.0, "iot": 1.0}
+    with pytest.raises(argparse.ArgumentTypeError):
+        load_simulator.parse_mix("submit,upload=1")
+
+
+def test_walker_bursts_are_accepted_by_every_endpoint(app_module, client):
+    tiles = load_simulator.load_tiles(f"{ROOT}/energy_tiles.txt", 0)
+    walker = load_simulator.Walker(0, "run", random.Random(5))
+    put_users(app_module, {walker.username: {"assigned_location": tiles[0][0]}})
+    for endpoint in ("submit", "add", "iot"):
+        for _ in range(20):
+            path, body = walker.footstep_burst(tiles[0], endpoint, jitter=0.8)
+            response = client.post(path, data=body, content_type="application/json")
+            assert response.status_code == 200
+            assert response.get_json().get("location_match", True) is True
+        if endpoint == "submit":
+            submitted_steps = walker.total_steps
+    user = app_module.load_user_data()[walker.username]
+    assert user["total_steps"] == submitted_steps
+    assert len(app_module.load_energy_records()) == 60
+
+
+def test_bursts_carry_increasing_reading_ids():
+    walker = load_simulator.Walker(1, "run", random.Random(5))
+    tile = ("tile_001", 35.6595, 139.7004, 0.001)
+    ids = [json.loads(walker.footstep_burst(tile, "iot", 0.8)[1])["reading_id"] for _ in range(3)]
+    assert ids == [1, 2, 3]
@@ -0,0 +1,73 @@
+import os
+
+from conftest import put_users, write_records
+
+
+def record(username, timestamp, wh=1.0):
+    return {"timestamp": timestamp, "username": username, "tile_id": "tile_001", "electricity_wh": wh}
+
+
+def test_mapped_user_data_matches_load_user_data(app_module):
+    put_users(app_module, {"alice": {"reward_points": 150, "assigned_location": "tile_001"},
+                           "bob": {"total_steps": 42}})
+    view = app_module.get_mapped_user_data()
+    assert sorted(view) == ["alice", "bob"] and "carol" not in view
+    assert {name: view[name] for name in view} == app_module.load_user_data()
+
+
+def test_mapped_view_follows_rewrites_and_reuses_the_index(app_module):
+    put_users(app_module, {"alice": {"reward_points": 1}})
+    first = app_module.get_mapped_user_data()
+    assert app_module.get_mapped_user_data() is first
+    assert os.path.exists(app_module.USER_INDEX_FILE)
+
+    put_users(app_module, {"alice": {"reward_points": 2}, "bob": {}})
+    second = app_module.get_mapped_user_data()
+    assert second is not first and second["alice"]["reward_points"] == 2 and "bob" in second
+
+    # A fresh view picks up the saved offsets instead of rescanning the file
+    reopened = app_module.MappedUserData()
+    assert reopened.offsets == second.offsets
+
+
+def test_stale_index_is_rebuilt(app_module):
+    put_users(app_module, {"alice": {}})
+    app_module.MappedUserData()
+    with open("user_data.txt", "a") as f:
+        f.write("bob|0|0|0|0|0|0|0|\n")
+    assert "bob" in app_module.MappedUserData()
+
+
+def test_record_index_only_reads_complete_new_lines(app_module):
+    write_records([record("alice", "2024-01-01T00:00:00"), record("bob", "2024-01-01T00:01:00")])
+    index = app_module.EnergyRecordIndex("energy_records.txt")
+    assert len(index.user_offsets("alice")) == 1
+
+    with open("energy_records.txt", "a") as f:
+        f.write('{"timestamp": "2024-01-01T00:02:00", "username": "alice"')
+    assert len(index.user_offsets("alice")) == 1
+    with open("energy_records.txt", "a") as f:
+        f.write(', "electricity_wh": 2.0}\n')
+    offsets = index.user_offsets("alice")
+    assert [r["electricity_wh"] for r in index.read_records(offsets)] == [1.0, 2.0]
+
+
+def test_record_index_resets_when_the_log_is_replaced(app_module):
+    write_records([record("alice", "2024-01-01T00:00:00")] * 3)
+    index = app_module.EnergyRecordIndex("energy_records.txt")
+    assert len(index.user_offsets("alice")) == 3
+    write_records([record("alice", "2024-02-01T00:00:00")], "replacement.txt")
+    os.replace("replacement.txt", "energy_records.txt")
+    assert len(index.user_offsets("alice")) == 1
+
+
+def test_recent_user_records_merges_shard_logs_by_timestamp(app_module):
+    write_records([record("alice", f"2024-01-01T00:0{i}:00", wh=i) for i in (0, 2, 4)])
+    os.makedirs(app_module.SHARD_DIR)
+    write_records([record("alice", f"2024-01-01T00:0{i}:00", wh=i) for i in (1, 3)] + [record("bob", "2024-01-01T00:09:00")],
+                  os.path.join(app_module.SHARD_DIR, "energy_records.shard-0.txt"))
+
+    recent = app_module.recent_user_records("alice", 3)
+    assert [r["electricity_wh"] for r in recent] == [2, 3, 4]
+    assert app_module.recent_user_records("alice", 0) == []
+    assert app_module.recent_user_records("carol", 5) == []
@@ -0,0 +1,30 @@
+from conftest import put_users
+
+
+def test_leaderboard_is_cached_until_user_data_changes(app_module, client):
+    put_users(app_module, {"alice": {"reward_points": 50}})
+    first = client.get("/leaderboard")
+    assert first.status_code == 200 and b"alice" in first.data
+    etag = first.headers["ETag"]
+
+    assert client.get("/leaderboard", headers={"If-None-Match": etag}).status_code == 304
+
+    put_users(app_module, {"bob": {"reward_points": 80}})
+    changed = client.get("/leaderboard", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+    assert changed.data.index(b"bob") < changed.data.index(b"alice")
+
+
+def test_energy_tiles_page_revalidates(client):
+    first = client.get("/energy-tiles")
+    assert first.status_code == 200
+    assert first.headers["Cache-Control"] == "no-cache"
+    assert client.get("/energy-tiles", headers={"If-None-Match": first.headers["ETag"]}).status_code == 304
+
+
+def test_fragment_cache_is_bounded(app_module, client, monkeypatch):
+    monkeypatch.setattr(app_module, "FRAGMENT_CACHE_SIZE", 3)
+    put_users(app_module, {f"user{i}": {"reward_points": i} for i in range(10)})
+    assert client.get("/leaderboard").status_code == 200
+    assert len(app_module._fragment_cache) == 3
@@ -0,0 +1,86 @@
+import threading
+
+import pytest
+
+from conftest import put_users
+
+SHIBUYA = {"latitude": 35.6595, "longitude": 139.7004}
+
+
+@pytest.fixture
+def app_module(load_app):
+    return load_app(SENSOR_RATE_LIMIT=10000, SENSOR_RATE_BURST=10000)
+
+
+def user(app, username):
+    return app.load_user_data()[username]
+
+
+def test_endpoints_credit_the_same_reading_alike(app_module, client):
+    put_users(app_module, {"carol": {"assigned_location": "tile_001"}})
+    responses = [
+        client.post("/api/iot-sensor", json={"username": "alice", "tile_id": "tile_001", "electricity_wh": 1.5}),
+        client.post("/add-energy", json={"username": "bob", "selectedTile": "tile_001", "electricity": 1.5}),
+        client.post("/api/submit-sensor-data", json=dict(SHIBUYA, username="carol", electricity_wh=1.5, total_steps=40))
+    ]
+    assert [r.get_json()["reward_points"] for r in responses] == [150, 150, 150]
+
+    records = app_module.load_energy_records()
+    assert [(r["username"], r["tile_id"], r["electricity_wh"]) for r in records] == [
+        ("alice", "tile_001", 1.5), ("bob", "tile_001", 1.5), ("carol", "tile_001", 1.5)]
+    for username in ("alice", "bob", "carol"):
+        assert user(app_module, username)["reward_points"] == 150
+        assert user(app_module, username)["total_energy_wh"] == 1.5
+
+    # Endpoint differences are decoder flags, not separate code paths
+    assert user(app_module, "bob")["tiles_visited"] == 1
+    assert user(app_module, "alice").get("tiles_visited", 0) == 0
+    assert user(app_module, "carol")["total_steps"] == 40
+
+
+def test_sensor_outside_assigned_tile_is_not_credited(app_module, client):
+    put_users(app_module, {"carol": {"assigned_location": "tile_001"}})
+    body = client.post("/api/submit-sensor-data", json={"username": "carol", "latitude": 0, "longitude": 0,
+                                                        "electricity_wh": 1.5, "total_steps": 12}).get_json()
+    assert body["status"] == "warning" and body["reward_points"] == 0
+    assert app_module.load_energy_records() == []
+    assert user(app_module, "carol")["total_steps"] == 12
+    assert user(app_module, "carol").get("reward_points", 0) == 0
+
+
+def test_unknown_tile_and_missing_fields_are_rejected(client):
+    assert client.post("/api/iot-sensor", json={"username": "alice", "tile_id": "nope"}).status_code == 400
+    assert client.post("/api/iot-sensor", json={"tile_id": "tile_001"}).status_code == 400
+    assert client.post("/add-energy", json={"username": "bob"}).get_json()["success"] is False
+
+
+def test_inserted_stage_runs_and_failure_callbacks_fire(app_module):
+    pipeline = app_module.IngestPipeline(app_module.DEFAULT_INGEST_STAGES, app_module.DirectBackend())
+    failed = []
+
+    def reject(reading, pipeline):
+        reading["on_failure"].append(failed.append)
+        raise app_module.IngestError("blocked")
+    pipeline.insert_stage("persist", "reject", reject)
+    assert [name for name, _ in pipeline.stages][-2:] == ["reject", "persist"]
+
+    with pytest.raises(app_module.IngestError):
+        pipeline.run("iot", {"username": "alice", "tile_id": "tile_001", "electricity_wh": 1})
+    assert len(failed) == 1 and failed[0]["reward_points"] == 100
+    assert app_module.load_energy_records() == []
+
+
+def test_group_commit_persists_concurrent_readings_together(app_module):
+    backend = app_module.GroupCommitBackend(max_delay=0.05)
+    pipeline = app_module.IngestPipeline(app_module.DEFAULT_INGEST_STAGES, backend)
+    threads = [threading.Thread(target=pipeline.run, args=("iot", {"username": f"user{i % 4}", "tile_id": "tile_002",
+                                                                     "electricity_wh": 1}))
+               for i in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(app_module.load_energy_records()) == 20
+    assert [user(app_module, f"user{i}")["reward_points"] for i in range(4)] == [500] * 4
+    assert backend.commits < 20
@@ -0,0 +1,80 @@
+import random
+from datetime import datetime
+
+import pytest
+
+from conftest import write_records
+
+
+@pytest.fixture(params=["list", "sortedcontainers"])
+def board_class(request, app_module, monkeypatch):
+    if request.param == "list":
+        monkeypatch.setattr(app_module, "SortedList", None)
+    else:
+        sortedcontainers = pytest.importorskip("sortedcontainers")
+        monkeypatch.setattr(app_module, "SortedList", sortedcontainers.SortedList)
+    return app_module.RankedBoard
+
+
+def test_ranks_follow_accumulated_points(board_class):
+    board = board_class({"alice": 5})
+    board.add("bob", 3)
+    board.add("carol", 7)
+    board.add("bob", 4)
+    # Ties are ordered by username
+    assert board.top(10) == [("bob", 7), ("carol", 7), ("alice", 5)]
+    assert [board.rank(name) for name in ("bob", "carol", "alice", "nobody")] == [1, 2, 3, None]
+    assert len(board) == 3
+
+
+def test_matches_a_full_sort(board_class):
+    rng = random.Random(7)
+    board = board_class()
+    for _ in range(2000):
+        board.add(f"user{rng.randrange(300)}", rng.choice([0.5, 1, 2.25, 10]))
+    expected = sorted(board.scores.items(), key=lambda item: (-item[1], item[0]))
+    assert board.top(len(board)) == expected
+    for position, (username, _) in enumerate(expected, 1):
+        assert board.rank(username) == position
+
+
+def period_record(username, timestamp, wh):
+    return {"timestamp": timestamp, "username": username, "tile_id": "tile_001", "electricity_wh": wh}
+
+
+def test_finished_periods_are_frozen_and_late_records_skipped(app_module):
+    write_records([period_record("alice", "2020-01-10T09:00:00", 1), period_record("bob", "2020-01-11T09:00:00", 2),
+                   period_record("alice", "2020-02-01T09:00:00", 5)])
+    boards = app_module.PeriodLeaderboards()
+    boards.refresh()
+    assert boards.frozen_keys("month") == ["2020-01", "2020-02"]
+    key, frozen, entries = boards.standings("month", "2020-01")
+    assert frozen is True and entries == [("bob", 200), ("alice", 100)]
+    assert boards.user_rank("month", "alice", "2020-01") == ("2020-01", 2, 100, 2)
+
+    write_records([period_record("carol", "2020-01-20T09:00:00", 9)])
+    boards.refresh()
+    assert boards.late_records == 3
+    assert boards.standings("month", "2020-01")[2] == [("bob", 200), ("alice", 100)]
+
+
+def test_current_period_is_updated_incrementally_and_survives_restart(app_module, client):
+    now = datetime.now().isoformat()
+    write_records([period_record("alice", now, 1), period_record("bob", now, 3)])
+    body = client.get("/api/leaderboard/week").get_json()
+    assert [(row["username"], row["points"]) for row in body["leaderboard"]] == [("bob", 300), ("alice", 100)]
+    assert body["frozen"] is False
+
+    write_records([period_record("alice", now, 4)])
+    rank = client.get("/api/leaderboard/week/rank/alice").get_json()
+    assert rank["rank"] == 1 and rank["points"] == 500 and rank["ranked_users"] == 2
+
+    assert app_module.roll_leaderboard_periods(None)["saved"] is True
+    restarted = app_module.PeriodLeaderboards()
+    assert restarted.standings("day")[2] == [("alice", 500), ("bob", 300)]
+
+
+def test_period_api_rejects_unknown_periods(client):
+    assert client.get("/api/leaderboard/year").status_code == 404
+    assert client.get("/api/leaderboard/day?key=1999-01-01").status_code == 404
+    assert client.get("/api/leaderboard/day?limit=x").status_code == 400
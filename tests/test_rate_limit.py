@@ -0,0 +1,90 @@
+import multiprocessing
+import threading
+
+import pytest
+
+
+@pytest.fixture
+def app_module(load_app):
+    return load_app(SENSOR_RATE_LIMIT=1, SENSOR_RATE_BURST=3)
+
+
+def reading(client, device="sensor-1", tile_id="tile_001"):
+    return client.post("/api/iot-sensor", json={"username": "alice", "device_id": device, "tile_id": tile_id,
+                                                 "electricity_wh": 1})
+
+
+def test_burst_then_429_with_retry_after(client):
+    assert [reading(client).status_code for _ in range(3)] == [200, 200, 200]
+    limited = reading(client)
+    assert limited.status_code == 429
+    assert limited.headers["Retry-After"] == "1"
+    assert limited.get_json()["status"] == "error"
+
+
+def test_buckets_are_per_device_and_tile(client):
+    for _ in range(3):
+        reading(client)
+    assert reading(client).status_code == 429
+    assert reading(client, device="sensor-2").status_code == 200
+    assert reading(client, tile_id="tile_002").status_code == 200
+
+
+def test_tokens_refill_at_the_configured_rate(app_module, monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(app_module.time, "monotonic", lambda: clock[0])
+    limiter = app_module.TokenBucketLimiter(rate=2, burst=2, slots=16)
+    assert limiter.acquire("k") == (True, 0)
+    assert limiter.acquire("k") == (True, 0)
+    allowed, retry_after = limiter.acquire("k")
+    assert not allowed and retry_after == pytest.approx(0.5)
+
+    clock[0] += 0.5
+    assert limiter.acquire("k") == (True, 0)
+
+
+def test_full_probe_window_recycles_a_bucket(app_module):
+    limiter = app_module.TokenBucketLimiter(rate=1, burst=1, slots=4)
+    for i in range(20):
+        assert limiter.acquire(f"device-{i}")[0]
+
+
+def take_token(limiter, results):
+    results.put(limiter.acquire("shared")[0])
+
+
+def test_buckets_are_shared_with_forked_workers(app_module):
+    limiter = app_module.TokenBucketLimiter(rate=0.001, burst=1, slots=16)
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+    child = context.Process(target=take_token, args=(limiter, results))
+    child.start()
+    child.join(timeout=10)
+    assert results.get(timeout=5) is True
+    assert limiter.acquire("shared")[0] is False
+
+
+def test_deep_backlog_sheds_load_with_503(app_module, client, monkeypatch):
+    monkeypatch.setattr(app_module, "INGEST_MAX_QUEUE_DEPTH", -1)
+    response = reading(client)
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert app_module.load_energy_records() == []
+
+
+def test_direct_backend_depth_returns_to_zero(app_module, monkeypatch):
+    backend = app_module.DirectBackend()
+    seen = []
+
+    def failing_save(user_data):
+        seen.append(backend.queue_depth())
+        raise OSError("disk full")
+    monkeypatch.setattr(app_module, "save_user_data", failing_save)
+    reading = {"username": "alice", "record": None, "deltas": {"add": {"reward_points": 1}, "set": {}}}
+    threads = [threading.Thread(target=lambda: pytest.raises(OSError, backend.persist, reading)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(seen) == 8 and min(seen) >= 1
+    assert backend.queue_depth() == 0
@@ -0,0 +1,85 @@
+import json
+import time
+
+import pytest
+
+from conftest import login, put_users
+
+
+@pytest.fixture
+def reader(load_app):
+    """A reader worker; the tests publish snapshots as the writer leader would"""
+    app_module = load_app(WORKER_ROLE="reader", READ_MAX_STALENESS=10)
+    put_users(app_module, {"alice": {"reward_points": 10}, "bob": {"reward_points": 20}})
+    return app_module
+
+
+def publish(app_module):
+    """Publish as the writer pool's leader, which reads the live files"""
+    role, app_module.WORKER_ROLE = app_module.WORKER_ROLE, "writer"
+    try:
+        return app_module.publish_snapshot(None)
+    finally:
+        app_module.WORKER_ROLE = role
+
+
+def test_reader_serves_the_published_snapshot(reader):
+    assert publish(reader)["written"] is True
+    assert reader.refresh_replica()["path"] is not None
+
+    put_users(reader, {"carol": {"reward_points": 99}})
+    assert "carol" not in reader.load_user_data_cached()
+    assert reader.get_leaderboard_order() == ["bob", "alice"]
+    assert reader.get_mapped_user_data()["bob"]["reward_points"] == 20
+
+    publish(reader)
+    reader.refresh_replica()
+    assert reader.get_leaderboard_order() == ["carol", "bob", "alice"]
+    assert reader._replica["loads"] == 2
+
+
+def test_unchanged_data_is_reconfirmed_not_rewritten(reader):
+    path = publish(reader)["path"]
+    reader.refresh_replica()
+    with open(reader.PUBLISHED_SNAPSHOT_FILE) as f:
+        first_confirmed = json.load(f)["confirmed_at"]
+
+    again = publish(reader)
+    assert again == {"written": False, "path": path}
+    reader.refresh_replica()
+    assert reader._replica["loads"] == 1
+    assert reader._replica["snapshot"]["confirmed_at"] >= first_confirmed
+
+
+def test_stale_snapshot_falls_back_to_live_files(reader, monkeypatch):
+    publish(reader)
+    reader.refresh_replica()
+    put_users(reader, {"carol": {"reward_points": 99}})
+    now = time.time()
+    monkeypatch.setattr(reader.time, "time", lambda: now + reader.READ_MAX_STALENESS + 1)
+    assert reader.current_replica() is None
+    assert "carol" in reader.load_user_data_cached()
+    assert reader._replica["fallbacks"] >= 1
+
+
+def test_without_a_published_snapshot_readers_use_live_files(reader):
+    assert reader.refresh_replica() == {"path": None}
+    assert reader.get_leaderboard_order() == ["bob", "alice"]
+
+
+def test_other_roles_ignore_snapshots(load_app):
+    app_module = load_app(WORKER_ROLE="writer")
+    put_users(app_module, {"alice": {}})
+    app_module.publish_snapshot(None)
+    app_module.refresh_replica()
+    assert app_module.current_replica() is None
+
+
+def test_status_endpoint(reader):
+    publish(reader)
+    reader.refresh_replica()
+    client = reader.app.test_client()
+    login(client, "admin", "admin")
+    status = client.get("/api/read-replica").get_json()
+    assert status["role"] == "reader" and status["serving_snapshot"] is True
+    assert status["snapshot"]["users"] == 2 and status["loads"] == 1
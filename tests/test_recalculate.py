@@ -0,0 +1,49 @@
+import pytest
+
+from conftest import put_users, write_records
+
+
+def record(username, wh):
+    return {"timestamp": "2026-01-01T12:00:00", "username": username, "tile_id": "tile_001", "electricity_wh": wh}
+
+
+def test_points_are_recomputed_from_records(app_module):
+    put_users(app_module, {"alice": {"total_energy_wh": 3.0, "reward_points": 1},
+                           "bob": {"reward_points": 42}})
+    write_records([record("alice", 1.0), record("alice", 2.0)])
+    expected = app_module.calculate_reward_points(1.0) + app_module.calculate_reward_points(2.0)
+
+    report = app_module.recalculate_rewards(processes=1, dry_run=True)
+    assert report["users_changed"] == 1 and not report["committed"]
+    assert app_module.load_user_data()["alice"]["reward_points"] == 1
+
+    report = app_module.recalculate_rewards(processes=1)
+    assert report["committed"] and report["users_without_records"] == 1
+    users = app_module.load_user_data()
+    assert users["alice"]["reward_points"] == expected and users["bob"]["reward_points"] == 42
+
+
+def test_chunked_pool_matches_single_pass(app_module):
+    write_records([record(f"user{i % 7}", 0.25 * i) for i in range(200)])
+    single = app_module.recalculate_rewards(processes=1, dry_run=True)
+    pooled = app_module.recalculate_rewards(processes=2, dry_run=True, chunk_bytes=1024)
+    assert pooled["changes"] == single["changes"] and pooled["records"] == 200
+
+
+def test_sharded_ingestion_needs_force(load_app):
+    app = load_app(INGEST_SHARDS=1)
+    write_records([record("alice", 1.0)])
+    with pytest.raises(RuntimeError, match="INGEST_SHARDS"):
+        app.recalculate_rewards(processes=1)
+    assert app.recalculate_rewards(processes=1, dry_run=True)["users_changed"] == 1
+    assert app.recalculate_rewards(processes=1, force=True)["committed"]
+
+
+def test_cli_refuses_without_force(load_app):
+    app = load_app(INGEST_SHARDS=1)
+    write_records([record("alice", 1.0)])
+    runner = app.app.test_cli_runner()
+    result = runner.invoke(args=["recalculate-rewards", "--processes", "1"])
+    assert result.exit_code != 0 and "INGEST_SHARDS" in result.output
+    result = runner.invoke(args=["recalculate-rewards", "--processes", "1", "--force"])
+    assert result.exit_code == 0 and "committed=True" in result.output
@@ -0,0 +1,75 @@
+import json
+import os
+import struct
+import time
+
+from conftest import login, write_records
+
+
+def test_run_job_keeps_metrics(app_module):
+    scheduler = app_module.Scheduler(lock_path="test.lock")
+    scheduler.add_job("ok", lambda budget: {"done": True}, interval=60, budget=5)
+    scheduler.add_job("fails", lambda budget: 1 / 0, interval=60, budget=5)
+    scheduler.add_job("slow", lambda budget: time.sleep(0.02), interval=60, budget=0.01)
+    for name in scheduler.jobs:
+        scheduler.run_job(name)
+
+    jobs = scheduler.stats()["jobs"]
+    assert jobs["ok"]["runs"] == 1 and jobs["ok"]["last_result"] == {"done": True}
+    assert jobs["fails"]["failures"] == 1 and "division" in jobs["fails"]["last_error"]
+    assert jobs["slow"]["over_budget"] == 1
+    assert 50 <= jobs["ok"]["next_run_in"] <= 70
+
+
+def test_only_one_scheduler_leads(app_module):
+    first = app_module.Scheduler(lock_path="test.lock")
+    second = app_module.Scheduler(lock_path="test.lock")
+    assert first.try_lead() is True
+    assert second.try_lead() is False
+    first._lock_file.close()
+    assert second.try_lead() is True
+
+
+def test_compaction_drops_corrupt_lines(app_module):
+    good = {"timestamp": "2024-01-01T00:00:00", "username": "alice", "electricity_wh": 1}
+    write_records([good])
+    with open("energy_records.txt", "a") as f:
+        f.write("\n{not json\n")
+    write_records([good])
+
+    result = app_module.compact_energy_records(app_module.JobBudget(30))
+    assert result == {"scanned": 4, "complete": True, "removed": 2}
+    with open("energy_records.txt") as f:
+        assert [json.loads(line) for line in f] == [good, good]
+    assert app_module.compact_energy_records(app_module.JobBudget(30))["removed"] == 0
+
+
+def test_compaction_resumes_when_the_budget_runs_out(app_module):
+    write_records([{"timestamp": "2024-01-01T00:00:00", "username": "alice"}] * 3)
+    assert app_module.compact_energy_records(app_module.JobBudget(0)) == {"scanned": 1, "complete": False}
+    assert app_module.compact_energy_records(app_module.JobBudget(30))["scanned"] == 2
+
+
+def test_expired_mfa_sessions_are_dropped(app_module):
+    now = time.time()
+    app_module.save_mfa_sessions({
+        "old": {"username": "alice", "user_type": "user", "otp": "123456", "timestamp": now - 3600},
+        "new": {"username": "bob", "user_type": "user", "otp": "654321", "timestamp": now}
+    })
+    assert app_module.expire_mfa_sessions(app_module.JobBudget(5)) == {"expired": 1, "active": 1}
+    assert list(app_module.load_mfa_sessions()) == ["new"]
+
+
+def test_expired_flask_sessions_are_pruned(app_module, tmp_path):
+    session_dir = tmp_path / "sessions"
+    session_dir.mkdir()
+    for name, expires in (("expired", int(time.time()) - 60), ("live", int(time.time()) + 60), ("forever", 0)):
+        (session_dir / name).write_bytes(struct.pack("I", expires) + b"payload")
+    result = app_module.prune_flask_sessions(app_module.JobBudget(5), str(session_dir))
+    assert result == {"removed": 1, "kept": 2}
+    assert sorted(os.listdir(session_dir)) == ["forever", "live"]
+
+
+def test_status_reports_disabled_scheduler(client):
+    login(client, "admin", "admin")
+    assert client.get("/api/scheduler").get_json() == {"enabled": False}
@@ -0,0 +1,77 @@
+import pytest
+
+
+@pytest.fixture
+def router(load_app):
+    app = load_app(SHARD_MERGE_INTERVAL=3600)
+    router = app.IngestRouter(2)
+    yield app, router
+    for process, _ in router.shards.values():
+        process.terminate()
+        process.join(timeout=5)
+
+
+def reward(router, username, points, tile_id="tile_001"):
+    router.submit(tile_id, username, None, {"add": {"reward_points": points}})
+
+
+def saved_points(app, username):
+    return app.load_user_data().get(username, {}).get("reward_points", 0)
+
+
+def test_merge_folds_shard_deltas_into_user_data(router):
+    app, router = router
+    for tile_id in ("tile_001", "tile_002", "tile_003", "tile_004"):
+        reward(router, "alice", 5, tile_id)
+    assert router.pending_for("alice")["add"] == {"reward_points": 20}
+
+    router.merge()
+    assert saved_points(app, "alice") == 20
+    assert router.pending_for("alice")["add"] == {}
+
+    router.shutdown()
+    assert saved_points(app, "alice") == 20
+
+
+def test_save_runs_outside_the_router_lock(router, monkeypatch):
+    app, router = router
+    save = app.save_user_data
+    held = []
+
+    def checked_save(user_data):
+        held.append(router.lock.locked())
+        save(user_data)
+    monkeypatch.setattr(app, "save_user_data", checked_save)
+
+    reward(router, "alice", 5)
+    router.merge()
+    assert held == [False]
+
+
+def test_failed_save_is_retried_by_the_next_merge(router, monkeypatch):
+    app, router = router
+    save = app.save_user_data
+
+    def failing_save(user_data):
+        raise OSError("disk full")
+    monkeypatch.setattr(app, "save_user_data", failing_save)
+
+    reward(router, "alice", 5)
+    with pytest.raises(OSError):
+        router.merge()
+    reward(router, "alice", 7)
+    assert router.pending_for("alice")["add"] == {"reward_points": 12}
+
+    monkeypatch.setattr(app, "save_user_data", save)
+    router.merge()
+    assert saved_points(app, "alice") == 12
+    assert router.pending_for("alice")["add"] == {}
+
+
+def test_ask_fails_fast_when_a_shard_exits(router):
+    app, router = router
+    process, _ = router.shards[0]
+    process.terminate()
+    process.join(timeout=5)
+    with pytest.raises(RuntimeError, match="shard 0 has exited"):
+        router.merge()
@@ -0,0 +1,95 @@
+import importlib.util
+import os
+
+import pytest
+
+from conftest import ROOT, put_users
+
+
+@pytest.fixture
+def steps(tmp_path, monkeypatch):
+    """The step tracker CLI module, run inside an empty data directory"""
+    monkeypatch.chdir(tmp_path)
+    spec = importlib.util.spec_from_file_location("step_tracker", os.path.join(ROOT, "New Python.File.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_store(steps):
+    store = steps.StepStore()
+    store.load()
+    return store
+
+
+def test_points_include_the_bonus(steps):
+    store = load_store(steps)
+    store.append([("steps", "alice", 8000), ("steps", "bob", 500)])
+    assert store.points("alice") == 100 and store.points("bob") == 5
+    assert load_store(steps).users == store.users
+
+
+def test_compaction_keeps_totals(steps):
+    store = load_store(steps)
+    store.append([("steps", "alice", 1200)])
+    store.compact()
+    store.append([("steps", "alice", 300)])
+    reloaded = load_store(steps)
+    assert reloaded.users["alice"] == [15, 1500, 0]
+    assert reloaded.replayed == 1
+
+
+def test_legacy_import_skips_malformed_lines(steps, capsys):
+    with open(steps.LEGACY_FILE, "w") as f:
+        f.write("alice,40\nbroken line\nbob,abc\ncarol,1,2\nbad|name,5\n\ndave,7\n")
+    store = load_store(steps)
+    assert {name: user[0] for name, user in store.users.items()} == {"alice": 40, "dave": 7}
+    assert "Skipped 4 malformed lines" in capsys.readouterr().out
+
+
+def test_leaderboard_lists_every_user(steps, capsys):
+    store = load_store(steps)
+    store.append([("points", f"user{i:02d}", i) for i in range(15)])
+    steps.show_leaderboard(store)
+    lines = capsys.readouterr().out.strip().splitlines()[1:]
+    assert len(lines) == 15
+    assert lines[0] == "1. user14 - 14 points" and lines[-1] == "15. user00 - 0 points"
+
+
+def test_new_user_is_ranked_before_adding_steps(steps, monkeypatch, capsys):
+    load_store(steps).append([("points", "alice", 30)])
+    answers = iter(["bob", "3", "4"])
+    monkeypatch.setattr("builtins.input", lambda prompt="": next(answers))
+    steps.interactive(load_store(steps))
+    assert "2. bob - 0 points" in capsys.readouterr().out
+    assert load_store(steps).users["bob"] == [0, 0, 0]
+
+def test_sync_to_web_adds_steps_once(steps, load_app):
+    app = load_app()
+    put_users(app, {"alice": {"total_steps": 10}})
+    store = load_store(steps)
+    store.append([("steps", "alice", 500), ("steps", "stranger", 100)])
+    steps.sync_to_web(store)
+    steps.sync_to_web(store)
+    assert app.load_user_data()["alice"]["total_steps"] == 510
+    assert "stranger" not in app.load_user_data()
+    assert load_store(steps).users["alice"][2] == 500
+
+
+def test_failed_sync_is_retried(steps, load_app, monkeypatch):
+    app = load_app()
+    put_users(app, {"alice": {}})
+    store = load_store(steps)
+    store.append([("steps", "alice", 500)])
+    save = app.save_user_data
+
+    def failing_save(user_data):
+        raise OSError("disk full")
+    monkeypatch.setattr(app, "save_user_data", failing_save)
+    with pytest.raises(OSError):
+        steps.sync_to_web(store)
+    assert load_store(steps).users["alice"][2] == 0
+
+    monkeypatch.setattr(app, "save_user_data", save)
+    steps.sync_to_web(store)
+    assert app.load_user_data()["alice"]["total_steps"] == 500
@@ -0,0 +1,70 @@
+import io
+import json
+
+from conftest import login
+
+CSV_HEADER = "tile_id,name,lat,lon,radius,capacity\n"
+
+
+def import_csv(app, body, **kwargs):
+    return app.import_tiles(io.StringIO(CSV_HEADER + body), "csv", **kwargs)
+
+
+def test_import_adds_and_updates_tiles(app_module):
+    result = import_csv(app_module, "tile_001,Shibuya Renamed,35.6595,139.7004,0.001,1200\n,New Tile,35.0,139.0,0.001,1000\n")
+    assert result["committed"] and result["added"] == 1 and result["updated"] == 1
+    tiles = app_module.load_energy_tiles()
+    assert tiles["tile_001"]["name"] == "Shibuya Renamed" and tiles["tile_001"]["capacity"] == 1200
+    assert tiles["tile_006"] == {"name": "New Tile", "lat": 35.0, "lon": 139.0, "radius": 0.001, "capacity": 1000}
+
+
+def test_import_applies_add_tile_rules_to_explicit_values(app_module):
+    rows = [{"name": "Zero Capacity", "lat": 35, "lon": 139, "capacity": 0},
+            {"name": "Equator", "lat": 0, "lon": 0}]
+    result = app_module.import_tiles([json.dumps(row) + "\n" for row in rows], "ndjson")
+    assert result["errors"] == [{"row": 1, "message": "Capacity must be greater than 0"}]
+    assert not result["committed"]
+
+    result = app_module.import_tiles([json.dumps(rows[1]) + "\n"], "ndjson")
+    assert result["committed"]
+    assert app_module.load_energy_tiles()["tile_006"]["lat"] == 0.0
+
+
+def test_import_rejects_bad_tile_ids(app_module):
+    rows = [{"tile_id": "bad\nid", "name": "A", "lat": 35, "lon": 139},
+            {"tile_id": "bad|id", "name": "B", "lat": 35, "lon": 139},
+            {"tile_id": "tile_009", "name": "C", "lat": 35, "lon": 139},
+            {"tile_id": "tile_009", "name": "D", "lat": 35, "lon": 139}]
+    result = app_module.import_tiles([json.dumps(row) + "\n" for row in rows], "ndjson")
+    assert [error["row"] for error in result["errors"]] == [1, 2, 4]
+    assert "bad\nid" not in app_module.load_energy_tiles()
+
+
+def test_generated_ids_skip_explicit_ones(app_module):
+    result = import_csv(app_module, "tile_006,Explicit,35,139,0.001,1000\n,Generated,35,139,0.001,1000\n")
+    assert result["added"] == 2
+    tiles = app_module.load_energy_tiles()
+    assert tiles["tile_006"]["name"] == "Explicit" and tiles["tile_007"]["name"] == "Generated"
+
+
+def test_dry_run_does_not_commit(app_module):
+    result = import_csv(app_module, ",New Tile,35,139,0.001,1000\n", dry_run=True)
+    assert result["added"] == 1 and not result["committed"]
+    assert "tile_006" not in app_module.load_energy_tiles()
+
+
+def test_export_round_trips(app_module, client):
+    login(client, "admin", "admin")
+    exported = client.get("/api/tiles/export?format=ndjson").get_data(as_text=True)
+    result = app_module.import_tiles(io.StringIO(exported), "ndjson", dry_run=True)
+    assert result["errors"] == [] and result["updated"] == 5 and result["added"] == 0
+
+
+def test_add_tile_never_reuses_an_id(app_module, client):
+    login(client, "admin", "admin")
+    assert client.post("/remove-tile/tile_002").status_code == 200
+    response = client.post("/add-tile", data={"tile_name": "Akihabara", "latitude": "35.6984", "longitude": "139.7731"})
+    assert response.get_json()["status"] == "success"
+    tiles = app_module.load_energy_tiles()
+    assert tiles["tile_005"]["name"] == "Ginza"
+    assert tiles["tile_006"]["name"] == "Akihabara"
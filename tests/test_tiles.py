@@ -0,0 +1,54 @@
+import pytest
+
+TOKYO = "35,139,36,140"
+
+
+def test_tiles_in_bbox(client):
+    body = client.get(f"/api/tiles?bbox={TOKYO}").get_json()
+    assert sorted(tile["id"] for tile in body["tiles"]) == [f"tile_00{i}" for i in range(1, 6)]
+    assert body["truncated"] is False
+
+
+def test_truncated_only_when_more_tiles_exist(client):
+    exact = client.get(f"/api/tiles?bbox={TOKYO}&limit=5").get_json()
+    assert len(exact["tiles"]) == 5 and exact["truncated"] is False
+    short = client.get(f"/api/tiles?bbox={TOKYO}&limit=4").get_json()
+    assert len(short["tiles"]) == 4 and short["truncated"] is True
+
+
+@pytest.mark.parametrize("bbox", ["nan,139,36,140", "35,-inf,36,140", "35,139,inf,140",
+                                  "-91,139,36,140", "35,139,36,181", "36,139,35,140", "35,139,36", "a,b,c,d"])
+def test_bad_bbox_is_rejected(client, bbox):
+    response = client.get(f"/api/tiles?bbox={bbox}")
+    assert response.status_code == 400
+    assert response.get_json()["status"] == "error"
+
+
+def test_bad_limit_is_rejected(client):
+    assert client.get(f"/api/tiles?bbox={TOKYO}&limit=x").status_code == 400
+
+
+def test_nearest_ranks_by_distance(app_module, client):
+    body = client.get("/api/tiles/nearest?lat=35.6595&lon=139.7004&k=3").get_json()
+    assert body["tiles"][0]["id"] == "tile_001" and body["tiles"][0]["distance_km"] == 0
+    tiles = app_module.load_energy_tiles()
+    expected = sorted(tiles, key=lambda t: app_module.calculate_distance(35.6595, 139.7004, tiles[t]["lat"], tiles[t]["lon"]))
+    assert [tile["id"] for tile in body["tiles"]] == expected[:3]
+
+
+def test_nearest_matches_brute_force_on_a_dense_grid(app_module):
+    import random
+    rng = random.Random(7)
+    tiles = {f"t{i}": {"name": str(i), "lat": rng.uniform(35, 35.2), "lon": rng.uniform(139, 139.2),
+                       "radius": 0.001, "capacity": 1000} for i in range(400)}
+    index = app_module.TileSpatialIndex(tiles)
+    for _ in range(20):
+        lat, lon = rng.uniform(34.9, 35.3), rng.uniform(138.9, 139.3)
+        brute = sorted((app_module.calculate_distance(lat, lon, t["lat"], t["lon"]), tile_id)
+                       for tile_id, t in tiles.items())
+        assert index.nearest(lat, lon, 10) == brute[:10]
+
+
+def test_nearest_rejects_bad_coordinates(client):
+    assert client.get("/api/tiles/nearest?lat=x&lon=139").status_code == 400
+    assert client.get("/api/tiles/nearest?lat=95&lon=139").status_code == 400
@@ -0,0 +1,83 @@
+import pytest
+
+from conftest import put_users
+
+TILE = {"name": "Shibuya", "lat": 35.6595, "lon": 139.7004, "radius": 0.001, "capacity": 1000}
+NEAR = 35.6595 + 0.00135  # ~150 m north: outside the 111 m radius, inside 1.5x
+FAR = 35.6595 + 0.01
+
+
+@pytest.fixture
+def matcher(app_module):
+    return app_module.TrajectoryMatcher(window=8, dwell_seconds=20, max_gap_seconds=120,
+                                        alpha=0.3, exit_factor=1.5, max_users=3)
+
+
+def observe(matcher, lat, now, username="alice"):
+    return matcher.observe(username, "tile_001", TILE, lat, TILE["lon"], now=now)
+
+
+def test_on_tile_fix_always_matches(matcher):
+    assert observe(matcher, TILE["lat"], 0) == (True, 0.0)
+
+
+def test_near_fix_matches_only_after_dwelling(matcher):
+    observe(matcher, TILE["lat"], 0)
+    assert observe(matcher, NEAR, 5)[0] is False
+    for now in (10, 15, 20):
+        observe(matcher, TILE["lat"], now)
+    matched, dwell = observe(matcher, NEAR, 25)
+    assert matched is True and dwell == 25
+
+
+def test_far_fix_never_matches(matcher):
+    for now in range(0, 60, 5):
+        observe(matcher, TILE["lat"], now)
+    assert observe(matcher, FAR, 60)[0] is False
+
+
+def test_walking_away_ends_presence(matcher):
+    for now in range(0, 30, 5):
+        observe(matcher, TILE["lat"], now)
+    for now in range(30, 80, 5):
+        observe(matcher, FAR, now)
+    assert observe(matcher, NEAR, 80) == (False, 0.0)
+
+
+def test_long_silence_starts_a_new_trajectory(matcher):
+    for now in range(0, 30, 5):
+        observe(matcher, TILE["lat"], now)
+    assert observe(matcher, NEAR, 30 + 121)[0] is False
+
+
+def test_users_are_capped(matcher):
+    for i, username in enumerate(["a", "b", "c", "d"]):
+        observe(matcher, TILE["lat"], i, username)
+    assert len(matcher) == 3 and "a" not in matcher.users
+
+
+def submit(client, latitude):
+    return client.post("/api/submit-sensor-data", json={"username": "alice", "latitude": latitude,
+                                                        "longitude": TILE["lon"], "electricity_wh": 1}).get_json()
+
+
+def test_endpoint_credits_a_near_fix_after_dwelling(app_module, client, monkeypatch):
+    put_users(app_module, {"alice": {"assigned_location": "tile_001"}})
+    clock = [1000.0]
+    monkeypatch.setattr(app_module.time, "monotonic", lambda: clock[0])
+    assert submit(client, NEAR)["location_match"] is False
+    for _ in range(5):
+        clock[0] += 5
+        assert submit(client, TILE["lat"])["location_match"] is True
+    clock[0] += 5
+    assert submit(client, NEAR)["location_match"] is True
+
+
+def test_single_point_check_when_disabled(load_app):
+    app_module = load_app(TRAJECTORY_MATCHING="off")
+    client = app_module.app.test_client()
+    put_users(app_module, {"alice": {"assigned_location": "tile_001"}})
+    for _ in range(5):
+        submit(client, TILE["lat"])
+    assert submit(client, NEAR)["location_match"] is False
+    assert len(app_module.TRAJECTORIES) == 0
@@ -0,0 +1,62 @@
+import pytest
+
+from conftest import put_users
+
+USERS = {
+    "alice": {"total_energy_wh": 1.5, "reward_points": 150, "voltage": 3.3, "total_steps": 40,
+              "assigned_location": "tile_001"},
+    "bob": {"reward_points": 300, "tiles_visited": 2},
+    "carol": {"reward_points": 150}
+}
+
+
+@pytest.fixture(params=["array", "numpy"])
+def ranking_backend(request, app_module, monkeypatch):
+    if request.param == "array":
+        monkeypatch.setattr(app_module, "optional_numpy", lambda: None)
+    elif app_module.optional_numpy() is None:
+        pytest.skip("numpy is not installed")
+    return app_module
+
+
+def test_load_matches_load_user_data(app_module):
+    put_users(app_module, USERS)
+    table = app_module.UserTable.load()
+    assert table.to_dict() == app_module.load_user_data()
+    assert table["alice"]["assigned_location"] == "tile_001"
+    assert table["bob"]["assigned_location"] == app_module.load_user_data()["bob"]["assigned_location"]
+    assert table["alice"].get("nope", "default") == "default"
+    assert "dave" not in table and table.get("dave") is None
+
+
+def test_columns_are_typed(app_module):
+    put_users(app_module, USERS)
+    table = app_module.UserTable.load()
+    assert table.columns["reward_points"].typecode == "d"
+    assert table.columns["total_steps"].typecode == "q"
+    assert table["alice"]["total_steps"] == 40 and isinstance(table["alice"]["total_steps"], int)
+
+
+def test_totals_and_overwritten_rows(app_module):
+    table = app_module.UserTable.from_user_data({name: dict(app_module.new_user_record(), **fields)
+                                                 for name, fields in USERS.items()})
+    assert table.total("reward_points") == 600
+    table.set_row("bob", (0, 10, 0, 0, 0, 0, 0, "tile_002"))
+    assert len(table) == 3 and table.total("reward_points") == 310
+    assert table["bob"].to_dict()["assigned_location"] == "tile_002"
+
+
+def test_ranking_keeps_file_order_for_ties(ranking_backend):
+    put_users(ranking_backend, USERS)
+    table = ranking_backend.UserTable.load()
+    assert [table.usernames[row] for row in table.ranking()] == ["bob", "alice", "carol"]
+    assert ranking_backend.get_leaderboard_order() == ["bob", "alice", "carol"]
+
+
+def test_cached_table_is_reparsed_when_the_file_changes(app_module):
+    put_users(app_module, USERS)
+    first = app_module.load_user_data_cached()
+    assert app_module.load_user_data_cached() is first
+    put_users(app_module, {"dave": {"reward_points": 1000}})
+    assert app_module.load_user_data_cached()["dave"]["reward_points"] == 1000
+    assert app_module.get_leaderboard_order()[0] == "dave"